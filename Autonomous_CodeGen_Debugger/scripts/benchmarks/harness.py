@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""In-process benchmark of the debug engine (``server.worker.execute``) with stage
+breakdown and regression tracking.
+
+The model is loaded once and every task runs through the same engine the worker
+serves. Per task and in aggregate it reports pass@1 / pass@k (unbiased estimator over
+``--samples`` runs), repair iterations to green, p50/p95 latency per stage, tokens
+generated and tokens/s. Each run is appended to a JSONL history; ``compare`` tests
+two runs for significant regressions (Fisher's exact test on pass counts,
+Mann-Whitney U on latencies) and exits 1 when it finds one.
+
+Usage:
+  python scripts/benchmarks/harness.py run --model /path/to/model --samples 5 --k 1,5
+  python scripts/benchmarks/harness.py run --model /path/to/model --tasks tasks.jsonl --label my-change
+  python scripts/benchmarks/harness.py compare            # previous run vs. latest
+  python scripts/benchmarks/harness.py compare abc123 def456 --alpha 0.01
+"""
+from __future__ import annotations
+import argparse, json, math, statistics, subprocess, sys, time, uuid
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+BASE = Path(__file__).resolve().parents[2]
+HISTORY = BASE / "outputs" / "benchmarks" / "history.jsonl"
+
+# Explicit signatures and doctests, so "passed" means the spec below holds
+TASKS = [
+    {"task": "Write a function is_ipv4(s) that validates dotted-quad IPv4 addresses.", "fn": "is_ipv4",
+     "signature": "def is_ipv4(s: str) -> bool",
+     "doctests": ">>> is_ipv4('192.168.0.1')\nTrue\n>>> is_ipv4('256.0.0.1')\nFalse\n>>> is_ipv4('1.2.3')\nFalse"},
+    {"task": "Write a function is_palindrome(s) that returns True for palindromic strings, ignoring case.", "fn": "is_palindrome",
+     "signature": "def is_palindrome(s: str) -> bool",
+     "doctests": ">>> is_palindrome('Racecar')\nTrue\n>>> is_palindrome('hello')\nFalse"},
+    {"task": "Write a function factorial(n) that computes n! for n >= 0.", "fn": "factorial",
+     "signature": "def factorial(n: int) -> int",
+     "doctests": ">>> factorial(0)\n1\n>>> factorial(5)\n120"},
+    {"task": "Write a function reverse_words(s) that reverses the order of words in a sentence.", "fn": "reverse_words",
+     "signature": "def reverse_words(s: str) -> str",
+     "doctests": ">>> reverse_words('hello big world')\n'world big hello'\n>>> reverse_words('one')\n'one'"},
+    {"task": "Write a function sum_nested(lst) that sums all integers in an arbitrarily nested list.", "fn": "sum_nested",
+     "signature": "def sum_nested(lst: list) -> int",
+     "doctests": ">>> sum_nested([1, [2, [3, 4]], 5])\n15\n>>> sum_nested([])\n0"},
+    {"task": "Write a function balanced_parentheses(s) that checks whether (), [] and {} are balanced.", "fn": "balanced_parentheses",
+     "signature": "def balanced_parentheses(s: str) -> bool",
+     "doctests": ">>> balanced_parentheses('([]{})')\nTrue\n>>> balanced_parentheses('(]')\nFalse\n>>> balanced_parentheses('((')\nFalse"},
+]
+
+
+# ------------------------------ statistics ---------------------------------------
+
+def pct(xs: List[float], p: float) -> float | None:
+    if not xs:
+        return None
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def pass_at_k(n: int, c: int, k: int) -> float:
+    """Unbiased pass@k from ``n`` samples with ``c`` passing (Chen et al., 2021)."""
+    if k > n:
+        k = n
+    if n - c < k:
+        return 1.0
+    return 1.0 - math.comb(n - c, k) / math.comb(n, k)
+
+
+def fisher_exact(a: int, b: int, c: int, d: int) -> float:
+    """Two-sided Fisher's exact test p-value for the 2x2 table [[a, b], [c, d]]."""
+    r1, c1, n = a + b, a + c, a + b + c + d
+
+    def prob(x: int) -> float:
+        return math.comb(c1, x) * math.comb(n - c1, r1 - x) / math.comb(n, r1)
+
+    p_obs = prob(a)
+    lo, hi = max(0, r1 + c1 - n), min(r1, c1)
+    return min(1.0, sum(prob(x) for x in range(lo, hi + 1) if prob(x) <= p_obs * (1 + 1e-9)))
+
+
+def mann_whitney(xs: List[float], ys: List[float]) -> float:
+    """Two-sided Mann-Whitney U p-value (normal approximation with tie correction)."""
+    n1, n2 = len(xs), len(ys)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    ranked = sorted([(v, 0) for v in xs] + [(v, 1) for v in ys])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for r in range(i, j + 1):
+            ranks[r] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    r1 = sum(r for r, (_, g) in zip(ranks, ranked) if g == 0)
+    u = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    var = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(var)
+    return min(1.0, math.erfc(max(0.0, z) / math.sqrt(2)))
+
+
+# ------------------------------ run ----------------------------------------------
+
+def load_tasks(path: str | None, limit: int | None) -> List[Dict[str, Any]]:
+    tasks = TASKS
+    if path:
+        with open(path, encoding="utf-8") as f:
+            tasks = [json.loads(line) for line in f if line.strip()]
+    return tasks[:limit] if limit else tasks
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(BASE), capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=str(BASE),
+                               capture_output=True, text=True, timeout=10).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "") if out.returncode == 0 else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_sample(worker, task: Dict[str, Any], args) -> Dict[str, Any]:
+    from server import metrics
+
+    req = worker.RunRequest(
+        task=task["task"], fn=task.get("fn"), signature=task.get("signature"), doctests=task.get("doctests"),
+        iters=args.iters, timeout=args.timeout, max_new_tokens=args.max_new_tokens, decode=args.decode,
+        candidates=args.candidates, no_design=bool(task.get("signature")), deadline=args.deadline,
+    )
+    meter = metrics.RunMetrics()
+    t0 = time.perf_counter()
+    try:
+        res = worker.execute(req, meter=meter)
+        ok, plan, error = res.ok, res.plan, None
+    except Exception as e:  # a crash counts as a failed sample
+        ok, plan, error = False, [], f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - t0
+    stages = dict(meter.stage_seconds, total=wall)
+    return {
+        "ok": ok,
+        "iterations": sum(1 for e in plan if e.get("tag") == "repair:start"),
+        "stages": {k: round(v, 4) for k, v in stages.items()},
+        "prompt_tokens": meter.tokens["prompt"],
+        "generated_tokens": meter.tokens["generated"],
+        "model_seconds": round(meter.model_seconds, 4),
+        "deadline_exceeded": any(e.get("tag") == "deadline:exceeded" for e in plan),
+        "error": error,
+    }
+
+
+def summarize(samples: List[Dict[str, Any]], ks: List[int]) -> Dict[str, Any]:
+    n, c = len(samples), sum(1 for s in samples if s["ok"])
+    stage_names = sorted({k for s in samples for k in s["stages"]})
+    gen = sum(s["generated_tokens"] for s in samples)
+    model_s = sum(s["model_seconds"] for s in samples)
+    green = [s["iterations"] for s in samples if s["ok"]]
+    return {
+        "samples": n, "passed": c,
+        "pass_at": {str(k): round(pass_at_k(n, c, k), 4) for k in ks if k <= n},
+        "iterations_to_green": {"mean": round(statistics.mean(green), 2) if green else None, "p50": pct(green, 50)},
+        "stages": {name: {"p50": pct([s["stages"][name] for s in samples if name in s["stages"]], 50),
+                          "p95": pct([s["stages"][name] for s in samples if name in s["stages"]], 95)}
+                   for name in stage_names},
+        "generated_tokens": gen,
+        "tokens_per_s": round(gen / model_s, 1) if model_s > 0 else None,
+    }
+
+
+def cmd_run(args) -> int:
+    import server.worker as worker
+    from src.backends.select import select_backend
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    if args.decode is None:
+        args.decode = "sample" if args.samples > 1 else "greedy"
+    tasks = load_tasks(args.tasks, args.limit)
+    if not args.sandbox_cache:
+        worker.SANDBOX_CACHE = None  # cached doctest results would hide sandbox latency
+    t0 = time.time()
+    worker.BACKEND = select_backend(args.model)
+    print(f"[harness] loaded {args.model} in {time.time() - t0:.1f}s; {len(tasks)} tasks x {args.samples} samples", flush=True)
+
+    results, all_samples = [], []
+    for i, task in enumerate(tasks, 1):
+        samples = [run_sample(worker, task, args) for _ in range(args.samples)]
+        summary = summarize(samples, ks)
+        results.append({"task": task["task"], "fn": task.get("fn"), "summary": summary, "samples": samples})
+        all_samples.extend(samples)
+        print(f"[{i}/{len(tasks)}] {task.get('fn') or task['task'][:40]}: {summary['passed']}/{summary['samples']} "
+              f"pass@1={summary['pass_at'].get('1')} total_p50={summary['stages']['total']['p50']:.2f}s", flush=True)
+
+    aggregate = summarize(all_samples, ks)
+    # pass@k over tasks is the mean of per-task estimates, not a pooled count
+    aggregate["pass_at"] = {str(k): round(statistics.mean(r["summary"]["pass_at"][str(k)] for r in results), 4)
+                            for k in ks if k <= args.samples}
+    record = {
+        "id": uuid.uuid4().hex[:12], "ts": time.time(), "commit": git_commit(), "label": args.label,
+        "model": args.model,
+        "settings": {k: getattr(args, k) for k in ("samples", "decode", "iters", "candidates", "max_new_tokens",
+                                                   "timeout", "deadline", "tasks", "sandbox_cache")},
+        "aggregate": aggregate, "tasks": results,
+    }
+    history = Path(args.history)
+    history.parent.mkdir(parents=True, exist_ok=True)
+    with history.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(f"\nRun {record['id']} (commit {record['commit']}): pass@k {aggregate['pass_at']}, "
+          f"iterations to green {aggregate['iterations_to_green']}, {aggregate['generated_tokens']} tokens "
+          f"at {aggregate['tokens_per_s']} tok/s")
+    for name, q in aggregate["stages"].items():
+        print(f"  {name:<16} p50={q['p50']:.3f}s p95={q['p95']:.3f}s")
+    print(f"Appended to {history}")
+    return 0
+
+
+# ------------------------------ compare ------------------------------------------
+
+def load_history(path: Path) -> List[Dict[str, Any]]:
+    if not path.exists():
+        return []
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_run(history: List[Dict[str, Any]], ref: str) -> Dict[str, Any]:
+    """A run by id, label or commit prefix (latest match), or by position (-1 = latest)."""
+    try:
+        return history[int(ref)]
+    except (ValueError, IndexError):
+        pass
+    for rec in reversed(history):
+        if rec["id"].startswith(ref) or rec.get("label") == ref or (rec.get("commit") or "").startswith(ref):
+            return rec
+    raise SystemExit(f"No run matching {ref!r} in history")
+
+
+def cmd_compare(args) -> int:
+    history = load_history(Path(args.history))
+    if len(history) < 2 and not (args.base and args.head):
+        print("Need at least two runs in the history")
+        return 2
+    base = find_run(history, args.base or "-2")
+    head = find_run(history, args.head or "-1")
+    samples = lambda rec: [s for t in rec["tasks"] for s in t["samples"]]
+    bs, hs = samples(base), samples(head)
+    print(f"base {base['id']} ({base.get('commit')}, {base.get('label') or '-'})  vs  "
+          f"head {head['id']} ({head.get('commit')}, {head.get('label') or '-'})")
+
+    regressions: List[str] = []
+    b_pass, h_pass = sum(s["ok"] for s in bs), sum(s["ok"] for s in hs)
+    p = fisher_exact(b_pass, len(bs) - b_pass, h_pass, len(hs) - h_pass)
+    b_rate, h_rate = b_pass / max(1, len(bs)), h_pass / max(1, len(hs))
+    flag = p < args.alpha and h_rate < b_rate
+    print(f"  pass rate        {b_rate:.3f} -> {h_rate:.3f}   p={p:.4f}{'  REGRESSION' if flag else ''}")
+    if flag:
+        regressions.append("pass rate")
+
+    stages = sorted({k for s in bs + hs for k in s["stages"]})
+    for name in stages:
+        xb = [s["stages"][name] for s in bs if name in s["stages"]]
+        xh = [s["stages"][name] for s in hs if name in s["stages"]]
+        if not xb or not xh:
+            continue
+        p = mann_whitney(xb, xh)
+        mb, mh = statistics.median(xb), statistics.median(xh)
+        # significant and slower by more than the noise threshold
+        flag = p < args.alpha and mh > mb * (1 + args.min_slowdown)
+        print(f"  {name:<16} p50 {mb:.3f}s -> {mh:.3f}s   p={p:.4f}{'  REGRESSION' if flag else ''}")
+        if flag:
+            regressions.append(f"{name} latency")
+
+    tps = lambda rec: rec["aggregate"].get("tokens_per_s")
+    if tps(base) and tps(head):
+        print(f"  tokens/s         {tps(base)} -> {tps(head)}")
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+        return 1
+    print("No significant regressions")
+    return 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="Benchmark the engine and append the result to the history")
+    r.add_argument("--model", required=True)
+    r.add_argument("--tasks", default=None, help="JSONL with task, fn, signature, doctests (default: built-in suite)")
+    r.add_argument("--limit", type=int, default=None, help="Only the first N tasks")
+    r.add_argument("--samples", type=int, default=1, help="Runs per task (n for pass@k)")
+    r.add_argument("--k", default="1", help="Comma-separated k values for pass@k (k <= samples)")
+    r.add_argument("--decode", choices=["greedy", "sample"], default=None, help="Default: sample when --samples > 1")
+    r.add_argument("--iters", type=int, default=3)
+    r.add_argument("--candidates", type=int, default=1)
+    r.add_argument("--max-new-tokens", type=int, default=160)
+    r.add_argument("--timeout", type=int, default=60)
+    r.add_argument("--deadline", type=float, default=None)
+    r.add_argument("--sandbox-cache", action="store_true", help="Keep the doctest result cache (skews sandbox latency)")
+    r.add_argument("--label", default=None, help="Name for this run in the history (e.g. a branch)")
+    r.add_argument("--history", default=str(HISTORY))
+    c = sub.add_parser("compare", help="Flag significant regressions between two runs in the history")
+    c.add_argument("base", nargs="?", default=None, help="Run id, label, commit prefix or index (default: previous run)")
+    c.add_argument("head", nargs="?", default=None, help="Same (default: latest run)")
+    c.add_argument("--alpha", type=float, default=0.05)
+    c.add_argument("--min-slowdown", type=float, default=0.1, help="Ignore latency changes below this fraction")
+    c.add_argument("--history", default=str(HISTORY))
+    args = ap.parse_args()
+    return cmd_run(args) if args.cmd == "run" else cmd_compare(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
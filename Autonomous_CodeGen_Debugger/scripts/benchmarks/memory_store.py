@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Benchmark case-memory retrieval: BM25 inverted index vs. the old full scan, and
+semantic (vector) retrieval with exact and IVF search.
+
+Usage: python scripts/benchmarks/memory_store.py --sizes 10000,100000,1000000
+"""
+from __future__ import annotations
+import argparse, json, random, statistics, sys, tempfile, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from src.memory import store  # noqa: E402
+from src.memory.index import CaseIndex  # noqa: E402
+
+try:
+    import numpy as np
+except ImportError:  # semantic retrieval needs numpy
+    np = None
+
+VERBS = ["write", "implement", "create", "compute", "return", "parse", "validate", "find", "count", "sort"]
+NOUNS = [
+    "palindrome", "ipv4", "address", "string", "list", "matrix", "fibonacci", "prime", "roots", "quadratic",
+    "anagram", "email", "date", "json", "tree", "graph", "path", "interval", "median", "duplicates",
+    "vowels", "words", "binary", "search", "stack", "queue", "cache", "url", "hex", "roman",
+]
+
+
+def synth_task(rng: random.Random) -> str:
+    nouns = rng.sample(NOUNS, 3) + [f"w{rng.randrange(50_000)}"]
+    return f"{rng.choice(VERBS).capitalize()} a function that handles {' '.join(nouns)} and returns the result."
+
+
+def populate(path: Path, n: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    with path.open("w", encoding="utf-8") as f:
+        for i in range(n):
+            task = synth_task(rng)
+            rec = {
+                "task": task, "fn": f"fn_{i}", "signature": f"def fn_{i}(x)",
+                "code": f"def fn_{i}(x):\n    return x\n", "plan": [], "tokens": store._normalize(task),
+            }
+            f.write(json.dumps(rec) + "\n")
+
+
+def linear_scan(path: Path, task: str, top_k: int = 2) -> list:
+    # retrieve_hints before the index: parse every record, score by token-set overlap
+    q = set(store._normalize(task))
+    hits = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            score = len(q & set(rec.get("tokens", [])))
+            if score:
+                hits.append((score, rec))
+    hits.sort(key=lambda x: x[0], reverse=True)
+    return [rec for _, rec in hits[:top_k]]
+
+
+def pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def bench(n: int, queries: int, baseline_queries: int, semantic: bool = True) -> dict:
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as td:
+        store.MEMORY_DIR = Path(td)
+        store.MEMORY_FILE = Path(td) / "cases.jsonl"
+        t0 = time.perf_counter()
+        populate(store.MEMORY_FILE, n)
+        populate_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        CaseIndex(store.MEMORY_FILE).rebuild()
+        build_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        idx = CaseIndex(store.MEMORY_FILE)
+        idx.refresh()
+        load_s = time.perf_counter() - t0
+
+        tasks = [synth_task(rng) for _ in range(queries)]
+        store.retrieve_hints(tasks[0])  # load the shared per-process index
+        lat = []
+        for t in tasks:
+            t0 = time.perf_counter()
+            store.retrieve_hints(t)
+            lat.append(time.perf_counter() - t0)
+
+        save = []
+        for i in range(min(queries, 200)):
+            t0 = time.perf_counter()
+            store.save_case(tasks[i % len(tasks)], "f", "def f(x)", "def f(x):\n    return x\n")
+            save.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        store.retrieve_hints(tasks[0])
+        after_save_s = time.perf_counter() - t0
+
+        sem = bench_semantic(tasks) if semantic else {}
+
+        scan = []
+        for t in tasks[:baseline_queries]:
+            t0 = time.perf_counter()
+            linear_scan(store.MEMORY_FILE, t)
+            scan.append(time.perf_counter() - t0)
+
+        size_mb = store.MEMORY_FILE.stat().st_size / 1024 ** 2
+    return {
+        "cases": n,
+        "file_mb": round(size_mb, 1),
+        "populate_s": round(populate_s, 2),
+        "index_build_s": round(build_s, 2),
+        "index_load_s": round(load_s, 3),
+        "query_p50_ms": round(pct(lat, 50) * 1000, 2),
+        "query_p95_ms": round(pct(lat, 95) * 1000, 2),
+        "save_case_p50_ms": round(pct(save, 50) * 1000, 3),
+        "query_after_saves_ms": round(after_save_s * 1000, 2),
+        "scan_p50_ms": round(statistics.median(scan) * 1000, 1) if scan else None,
+        **sem,
+    }
+
+
+def bench_semantic(tasks: list[str]) -> dict:
+    from src.memory import vectors
+
+    vs = vectors.VectorStore(store.MEMORY_FILE)
+    t0 = time.perf_counter()
+    vs.rebuild()
+    build_s = time.perf_counter() - t0
+    vs.search(tasks[0])  # map the matrix and build the coarse index when large
+    ivf_s = time.perf_counter() - t0 - build_s
+    lat = []
+    for t in tasks:
+        t0 = time.perf_counter()
+        vs.search(t, top_k=5)
+        lat.append(time.perf_counter() - t0)
+    save = []
+    for t in tasks:
+        t0 = time.perf_counter()
+        store.save_case(t, "f", "def f(x)", "def f(x):\n    return x\n")
+        save.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    vs.search(tasks[0])  # encodes the cases saved above
+    catch_up_s = time.perf_counter() - t0
+    row = {
+        "vec_build_s": round(build_s, 2),
+        "vec_ivf_build_s": round(ivf_s, 2),
+        "vec_query_p50_ms": round(pct(lat, 50) * 1000, 2),
+        "vec_query_p95_ms": round(pct(lat, 95) * 1000, 2),
+        "vec_save_case_p50_ms": round(pct(save, 50) * 1000, 3),
+        "vec_catch_up_s": round(catch_up_s, 3),
+    }
+    if vs._ivf is not None:
+        # recall@5 of the IVF search against exact search over the whole matrix
+        hit = total = 0
+        for t in tasks:
+            q = vectors.encode([t])[0]
+            exact = set(np.argsort(-(vs._mm @ q))[:5].tolist())
+            approx = vectors.ivf_candidates(vs._ivf, q, len(vs._mm))
+            got = set(approx[np.argsort(-(vs._mm[approx] @ q))[:5]].tolist())
+            hit, total = hit + len(exact & got), total + len(exact)
+        row["vec_ivf_recall_at_5"] = round(hit / total, 3)
+    return row
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated case counts")
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--baseline-queries", type=int, default=3, help="full-scan queries per size (slow at 1M)")
+    ap.add_argument("--no-semantic", action="store_true", help="skip the vector-store measurements")
+    ap.add_argument("--out", default="", help="optional JSON report path")
+    args = ap.parse_args()
+
+    rows = []
+    for n in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        row = bench(n, args.queries, args.baseline_queries, not args.no_semantic and np is not None)
+        rows.append(row)
+        print(
+            f"n={n:>8}  build={row['index_build_s']:.2f}s  load={row['index_load_s']:.3f}s  "
+            f"query p50={row['query_p50_ms']}ms p95={row['query_p95_ms']}ms  "
+            f"save p50={row['save_case_p50_ms']}ms  scan p50={row['scan_p50_ms']}ms"
+            + (f"  vec p50={row['vec_query_p50_ms']}ms" if "vec_query_p50_ms" in row else "")
+            + (f" (ivf recall@5={row['vec_ivf_recall_at_5']})" if "vec_ivf_recall_at_5" in row else ""),
+            flush=True,
+        )
+    if args.out:
+        Path(args.out).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        print(f"Saved report to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,70 +1,94 @@
 #!/usr/bin/env python3
-"""Lightweight verification of local HF model snapshots.
+"""Verification of local HF model snapshots.
 
-Loads AutoConfig and AutoTokenizer (no weights) for each model under
-the user-provided snapshots to confirm files are present and readable.
+Finds every snapshot (directory with ``config.json``) under the given roots and
+checks all of them at once in a thread pool: the shards listed in each index exist,
+safetensors headers match the file sizes, and (``--level full``) each shard's
+SHA-256 matches the HF cache blob it links to. Digests are cached by (path, size,
+mtime) in ``outputs/.model_digests.json``, so re-checking unchanged snapshots is
+instant, and the verdicts recorded there let ``select_backend`` refuse a known-bad
+snapshot before loading it.
+
+``--load`` additionally loads AutoConfig and AutoTokenizer (no weights) for each
+snapshot that passed.
+
+    python scripts/check_models.py /path/to/models --workers 8
 """
 
 from __future__ import annotations
+import argparse
+import json
+import os
 import sys
+import time
 from pathlib import Path
 
-MODELS = {
-    'santacoder': 'models--bigcode--santacoder',
-    'starcoder2-3b': 'models--bigcode--starcoder2-3b',
-    'codellama-7b-instruct': 'models--codellama--CodeLlama-7b-Instruct-hf',
-}
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
-ROOT = Path('/Users/enigma/Downloads/models')
+from src.backends.snapshot import DigestCache, find_snapshots, verify_snapshots  # noqa: E402
 
-def snapshot_path(base: Path) -> Path | None:
-    ref = base / 'refs' / 'main'
-    if not ref.exists():
-        return None
-    sha = ref.read_text().strip()
-    snap = base / 'snapshots' / sha
-    return snap if snap.exists() else None
+ROOT = Path(os.getenv('CODEGEN_MODELS_ROOT', '/Users/enigma/Downloads/models'))
 
-def main() -> int:
-    print('Python:', sys.version)
+
+def load_config_and_tokenizer(snap: Path) -> str | None:
     try:
         from transformers import AutoConfig, AutoTokenizer  # type: ignore
     except Exception as e:
-        print('ERROR: transformers import failed:', repr(e))
+        return f'transformers import failed: {e!r}'
+    try:
+        cfg = AutoConfig.from_pretrained(str(snap), local_files_only=True, trust_remote_code=True)
+        tok = AutoTokenizer.from_pretrained(str(snap), local_files_only=True, trust_remote_code=True)
+        print(f'  config.model_type: {getattr(cfg, "model_type", "?")}, tokenizer: {tok.__class__.__name__}')
+    except Exception as e:
+        return f'config/tokenizer load failed: {e}'
+    return None
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description='Verify local HF model snapshots in parallel')
+    ap.add_argument('roots', nargs='*', type=Path, default=[ROOT], help='model directories or roots to search')
+    ap.add_argument('--level', choices=['layout', 'full'], default='full',
+                    help='layout: index/header/size checks only; full: also SHA-256 of every shard')
+    ap.add_argument('--workers', type=int, default=None, help='hashing threads (default: min(8, CPUs))')
+    ap.add_argument('--load', action='store_true', help='also load config and tokenizer of passing snapshots')
+    ap.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = ap.parse_args()
+
+    snaps = [s for root in args.roots for s in find_snapshots(root)]
+    if not snaps:
+        print('No snapshots (directories with config.json) under:', ', '.join(map(str, args.roots)))
         return 1
+    t0 = time.perf_counter()
+    reports = verify_snapshots(snaps, level=args.level, workers=args.workers, cache=DigestCache())
+    elapsed = time.perf_counter() - t0
 
-    errors: dict[str, str] = {}
-    for name, rel in MODELS.items():
-        base = ROOT / name / rel
-        print(f"\n[{name}] base: {base}")
-        snap = snapshot_path(base)
-        if snap is None:
-            errors[name] = 'missing refs/main or snapshot directory'
-            print(f'[{name}] ERROR: missing refs/main or snapshot directory')
-            continue
-        print(f'[{name}] snapshot: {snap}')
-        try:
-            cfg = AutoConfig.from_pretrained(str(snap), local_files_only=True, trust_remote_code=True)
-            print(f'[{name}] config.model_type: {getattr(cfg, "model_type", "?")}')
-        except Exception as e:
-            errors[name] = f'config load failed: {e}'
-            print(f'[{name}] ERROR: config load failed:', e)
+    failed = 0
+    for r in reports:
+        snap = Path(r['snapshot'])
+        if r['ok'] and args.load:
+            err = load_config_and_tokenizer(snap)
+            if err:
+                r['ok'] = False
+                r['errors'].append(err)
+        failed += not r['ok']
+        if args.json:
             continue
-        try:
-            tok = AutoTokenizer.from_pretrained(str(snap), local_files_only=True, trust_remote_code=True)
-            print(f'[{name}] tokenizer: {tok.__class__.__name__}')
-        except Exception as e:
-            errors[name] = f'tokenizer load failed: {e}'
-            print(f'[{name}] ERROR: tokenizer load failed:', e)
-
-    print('\nSummary:')
-    if errors:
-        for k, v in errors.items():
-            print(f'- {k}: {v}')
-        return 2
-    print('All configs/tokenizers loaded OK (weights not loaded).')
-    return 0
+        hashed = sum(1 for f in r['files'] if 'sha256' in f and not f.get('cached'))
+        cached = sum(1 for f in r['files'] if f.get('cached'))
+        verified = sum(1 for f in r['files'] if f.get('expected'))
+        print(f"[{'OK' if r['ok'] else 'FAIL'}] {snap}")
+        print(f"  {len(r['files'])} shard(s), {r['bytes'] / 1e9:.2f} GB; hashed {hashed}, cached {cached}, "
+              f"matched to blob digest {verified}")
+        for e in r['errors']:
+            print(f'  - {e}')
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        total = sum(r['bytes'] for r in reports)
+        print(f'\n{len(reports) - failed}/{len(reports)} snapshot(s) OK, {total / 1e9:.2f} GB in {elapsed:.1f}s')
+    return 2 if failed else 0
+
 
 if __name__ == '__main__':
     raise SystemExit(main())
-
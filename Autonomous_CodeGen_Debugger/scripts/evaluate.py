@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""Sharded, resumable evaluation over task datasets (HumanEval/MBPP-shaped JSONL).
+
+Every shard is one process with one model load; it runs its tasks through the debug
+engine (``server.worker.execute``) and then checks the final code against the
+dataset's hidden tests in the sandbox (``run_check``). Each finished task is
+appended (and fsynced) to ``<out>/shard-<i>-of-<N>.jsonl``, so a crashed or stopped
+shard resumes where it left off. ``merge`` combines the shard files into one report.
+
+Accepted record shapes (one JSON object per line):
+- HumanEval: ``task_id``, ``prompt``, ``entry_point``, ``test`` (defines ``check``)
+- MBPP: ``task_id``, ``text`` (or ``prompt``), ``code``, ``test_list``, optional ``test_setup_code``
+- generic: ``task_id``, ``task``, ``fn``, optional ``signature``/``doctests``, ``test``
+
+Usage:
+  python scripts/evaluate.py run --dataset HumanEval.jsonl --model /path/to/model --workers 4 --out outputs/eval/he
+  python scripts/evaluate.py run ... --shard 2 --num-shards 8      # one shard per machine, same --out
+  python scripts/evaluate.py merge --out outputs/eval/he
+"""
+from __future__ import annotations
+import argparse, ast, doctest, json, os, re, statistics, subprocess, sys, time, zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from scripts.benchmarks.harness import pass_at_k, pct  # noqa: E402
+
+BASE = Path(__file__).resolve().parents[1]
+
+
+# ------------------------------ datasets -----------------------------------------
+
+def _doctests_from(doc: str) -> str | None:
+    try:
+        examples = doctest.DocTestParser().get_examples(doc)
+    except ValueError:
+        return None
+    lines = []
+    for ex in examples:
+        lines.append(">>> " + ex.source.rstrip("\n").replace("\n", "\n... "))
+        if ex.want.strip():
+            lines.append(ex.want.rstrip("\n"))
+    return "\n".join(lines) or None
+
+
+def _from_humaneval(rec: Dict[str, Any]) -> Dict[str, Any]:
+    fn, prompt = rec["entry_point"], rec["prompt"]
+    m = re.search(rf"^def\s+{re.escape(fn)}\s*\(", prompt, re.M)
+    header = prompt[:m.start()] if m else ""
+    signature, doc = None, ""
+    try:
+        for node in ast.parse(prompt + "\n    pass\n").body:
+            if isinstance(node, ast.FunctionDef) and node.name == fn:
+                doc = ast.get_docstring(node) or ""
+                node.body = [ast.Pass()]
+                signature = ast.unparse(node).split(":\n")[0]
+    except SyntaxError:
+        pass
+    task = re.split(r"\n\s*(>>>|For example|Example)", doc)[0].strip() or f"Implement {fn}."
+    return {"task_id": rec["task_id"], "task": task, "fn": fn, "signature": signature, "doctests": _doctests_from(doc),
+            "header": header, "test": rec["test"] + f"\n\ncheck({fn})\n"}
+
+
+def _from_mbpp(rec: Dict[str, Any]) -> Dict[str, Any]:
+    tests = list(rec["test_list"])
+    m = re.search(r"assert\s+(?:not\s+)?\(?\s*(?:set\(|math\.isclose\()?\s*([A-Za-z_]\w*)\s*\(", tests[0]) if tests else None
+    fn = m.group(1) if m else "solution"
+    sm = re.search(rf"^def\s+{re.escape(fn)}\s*\([^)]*\)[^:]*", rec.get("code", ""), re.M)
+    signature = sm.group(0).strip() if sm else f"def {fn}(*args)"
+    # each assert becomes a ">>> expr\nTrue" example, which survives any repr differences
+    examples = []
+    for t in tests:
+        expr = re.sub(r"^\s*assert\s+", "", t).strip()
+        if "\n" not in expr:
+            examples.append(f">>> {expr}\nTrue")
+    setup = rec.get("test_setup_code") or ""
+    return {"task_id": str(rec["task_id"]), "task": rec.get("text") or rec.get("prompt") or f"Implement {fn}.",
+            "fn": fn, "signature": signature, "doctests": "\n".join(examples) or None,
+            "header": "", "test": (setup + "\n" if setup else "") + "\n".join(tests) + "\n"}
+
+
+def normalize(rec: Dict[str, Any]) -> Dict[str, Any]:
+    if "entry_point" in rec and "prompt" in rec:
+        return _from_humaneval(rec)
+    if "test_list" in rec:
+        return _from_mbpp(rec)
+    return {"task_id": str(rec["task_id"]), "task": rec["task"], "fn": rec.get("fn"), "signature": rec.get("signature"),
+            "doctests": rec.get("doctests"), "header": rec.get("header", ""), "test": rec.get("test", "")}
+
+
+def load_dataset(path: str, limit: int | None = None) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        tasks = [normalize(json.loads(line)) for line in f if line.strip()]
+    return tasks[:limit] if limit else tasks
+
+
+def shard_of(task_id: str, num_shards: int) -> int:
+    """Stable shard for a task id, independent of dataset order and machine."""
+    return zlib.crc32(task_id.encode("utf-8")) % num_shards
+
+
+# ------------------------------ checkpoints --------------------------------------
+
+def shard_path(out: Path, shard: int, num_shards: int) -> Path:
+    return out / f"shard-{shard:03d}-of-{num_shards:03d}.jsonl"
+
+
+def read_records(path: Path) -> Iterator[Dict[str, Any]]:
+    if not path.exists():
+        return
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # torn last line from a crash
+
+
+def append_record(path: Path, rec: Dict[str, Any]) -> None:
+    with path.open("a+b") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")  # terminate a torn line so this record parses
+        f.write((json.dumps(rec) + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ------------------------------ run ----------------------------------------------
+
+def eval_task(worker, task: Dict[str, Any], args) -> Dict[str, Any]:
+    from src.execution_sandbox.sandbox import run_check
+
+    samples = []
+    for _ in range(args.samples):
+        req = worker.RunRequest(
+            task=task["task"], fn=task.get("fn"), signature=task.get("signature"), doctests=task.get("doctests"),
+            iters=args.iters, timeout=args.timeout, max_new_tokens=args.max_new_tokens, decode=args.decode,
+            candidates=args.candidates, no_design=bool(task.get("signature")), deadline=args.task_deadline,
+            add_imports=True, preamble=task.get("header") or None,
+        )
+        t0 = time.perf_counter()
+        try:
+            res = worker.execute(req)
+            if task.get("test"):
+                # the engine returns the code with the header (preamble) it was tested with
+                check = run_check(res.code, task["test"], timeout_s=args.timeout)
+            else:
+                check = {"ok": res.ok}
+            done = next((e for e in res.plan if e.get("tag") == "cascade:done"), None)
+            samples.append({
+                "ok": bool(check["ok"]), "engine_ok": res.ok, "tier": done["tier"] if done else None,
+                "iterations": sum(1 for e in res.plan if e.get("tag") == "repair:start"),
+                "deadline_exceeded": res.deadline_exceeded, "seconds": round(time.perf_counter() - t0, 3),
+                "error": None if check["ok"] else (check.get("traceback") or "")[-500:], "code": res.code,
+            })
+        except Exception as e:
+            samples.append({"ok": False, "engine_ok": False, "iterations": 0, "deadline_exceeded": False,
+                            "seconds": round(time.perf_counter() - t0, 3), "error": f"{type(e).__name__}: {e}", "code": ""})
+    return {"task_id": task["task_id"], "fn": task.get("fn"), "samples": samples, "ts": time.time()}
+
+
+def run_shard(args) -> int:
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    meta = out / "run.json"
+    if not meta.exists():
+        meta.write_text(json.dumps({"dataset": args.dataset, "model": args.model, "num_shards": args.num_shards,
+                                    "limit": args.limit}), encoding="utf-8")
+    tasks = [t for t in load_dataset(args.dataset, args.limit) if shard_of(t["task_id"], args.num_shards) == args.shard]
+    path = shard_path(out, args.shard, args.num_shards)
+    done = {r["task_id"] for r in read_records(path)}
+    todo = [t for t in tasks if t["task_id"] not in done]
+    tag = f"[shard {args.shard}/{args.num_shards}]"
+    print(f"{tag} {len(tasks)} tasks, {len(done)} already done, {len(todo)} to run", flush=True)
+    if not todo:
+        return 0
+
+    import server.worker as worker
+    from src.backends.select import select_backend
+
+    if args.threads:
+        try:
+            import torch  # type: ignore
+            torch.set_num_threads(args.threads)
+        except ImportError:
+            pass
+    t0 = time.time()
+    worker.BACKEND = select_backend(args.model)
+    print(f"{tag} loaded {args.model} in {time.time() - t0:.1f}s", flush=True)
+    passed = 0
+    for i, task in enumerate(todo, 1):
+        rec = eval_task(worker, task, args)
+        append_record(path, rec)
+        passed += rec["samples"][0]["ok"]
+        print(f"{tag} {i}/{len(todo)} {task['task_id']}: {'PASS' if rec['samples'][0]['ok'] else 'FAIL'} "
+              f"({rec['samples'][0]['seconds']:.1f}s; {passed}/{i} so far)", flush=True)
+    return 0
+
+
+def forward_args(args) -> List[str]:
+    out = ["--dataset", args.dataset, "--model", args.model, "--out", args.out, "--num-shards", str(args.num_shards),
+           "--samples", str(args.samples), "--iters", str(args.iters), "--candidates", str(args.candidates),
+           "--max-new-tokens", str(args.max_new_tokens), "--timeout", str(args.timeout), "--decode", args.decode]
+    if args.task_deadline:
+        out += ["--task-deadline", str(args.task_deadline)]
+    if args.limit:
+        out += ["--limit", str(args.limit)]
+    if args.threads:
+        out += ["--threads", str(args.threads)]
+    return out
+
+
+def run_local(args) -> int:
+    """Run all shards as local processes, restarting crashed ones (they resume), then merge."""
+    args.num_shards = args.workers
+    if not args.threads:
+        args.threads = max(1, (os.cpu_count() or 1) // args.workers)
+    Path(args.out).mkdir(parents=True, exist_ok=True)
+    (Path(args.out) / "run.json").write_text(json.dumps({"dataset": args.dataset, "model": args.model,
+                                                          "num_shards": args.num_shards, "limit": args.limit}), encoding="utf-8")
+    cmd = [sys.executable, str(Path(__file__).resolve()), "run"] + forward_args(args)
+    procs = {i: subprocess.Popen(cmd + ["--shard", str(i)], cwd=str(BASE)) for i in range(args.workers)}
+    attempts = {i: 0 for i in procs}
+    while procs:
+        for i, p in list(procs.items()):
+            rc = p.poll()
+            if rc is None:
+                continue
+            del procs[i]
+            if rc != 0 and attempts[i] < args.retries:
+                attempts[i] += 1
+                print(f"[evaluate] shard {i} exited with {rc}; resuming (attempt {attempts[i]})", file=sys.stderr, flush=True)
+                procs[i] = subprocess.Popen(cmd + ["--shard", str(i)], cwd=str(BASE))
+        time.sleep(1)
+    return merge(Path(args.out), args.dataset, args.limit)
+
+
+# ------------------------------ merge --------------------------------------------
+
+def by_tier(samples: List[Dict[str, Any]]) -> Dict[str, Any] | None:
+    """Cascade runs: tasks finished on each tier, their pass rate and latency (None without a cascade)."""
+    groups: Dict[int, List[Dict[str, Any]]] = {}
+    for s in samples:
+        if s.get("tier") is not None:
+            groups.setdefault(s["tier"], []).append(s)
+    if not groups:
+        return None
+    return {str(t): {"tasks": len(g), "pass_rate": round(sum(s["ok"] for s in g) / len(g), 4),
+                     "seconds_p50": pct([s["seconds"] for s in g], 50), "seconds_mean": round(statistics.mean(s["seconds"] for s in g), 3)}
+            for t, g in sorted(groups.items())}
+
+
+def merge(out: Path, dataset: str | None = None, limit: int | None = None, ks: List[int] | None = None) -> int:
+    records: Dict[str, Dict[str, Any]] = {}
+    for path in sorted(out.glob("shard-*.jsonl")):
+        for rec in read_records(path):
+            records[rec["task_id"]] = rec  # a task re-run after re-sharding keeps its latest result
+    if not records:
+        print(f"No shard results under {out}")
+        return 1
+    meta_path = out / "run.json"
+    if dataset is None and meta_path.exists():
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        dataset, limit = meta.get("dataset"), meta.get("limit")
+    expected = [t["task_id"] for t in load_dataset(dataset, limit)] if dataset and Path(dataset).exists() else list(records)
+    missing = [tid for tid in expected if tid not in records]
+
+    n = min(len(r["samples"]) for r in records.values())
+    ks = [k for k in (ks or [1, 5, 10]) if k <= n]
+    firsts = [r["samples"][0] for r in records.values()]
+    seconds = [s["seconds"] for s in firsts]
+    iters = [s["iterations"] for s in firsts if s["ok"]]
+    report = {
+        "tasks": len(records), "expected": len(expected), "missing": missing[:50], "missing_count": len(missing),
+        "samples_per_task": n,
+        "pass_at": {str(k): round(statistics.mean(pass_at_k(len(r["samples"]), sum(s["ok"] for s in r["samples"]), k)
+                                                  for r in records.values()), 4) for k in ks},
+        "engine_doctest_pass_rate": round(sum(s["engine_ok"] for s in firsts) / len(firsts), 4),
+        "hidden_pass_when_doctests_pass": round(
+            sum(s["ok"] for s in firsts if s["engine_ok"]) / max(1, sum(s["engine_ok"] for s in firsts)), 4),
+        "iterations_to_green_mean": round(statistics.mean(iters), 2) if iters else None,
+        "deadline_exceeded": sum(s["deadline_exceeded"] for s in firsts),
+        "seconds": {"p50": pct(seconds, 50), "p95": pct(seconds, 95), "sum": round(sum(seconds), 1)},
+        "by_tier": by_tier(firsts),
+        "failed": sorted(tid for tid, r in records.items() if not r["samples"][0]["ok"]),
+    }
+    (out / "report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"{report['tasks']}/{report['expected']} tasks evaluated ({report['missing_count']} missing); "
+          f"pass@k {report['pass_at']}; doctests passed {report['engine_doctest_pass_rate']:.1%}; "
+          f"task time p50={report['seconds']['p50']}s p95={report['seconds']['p95']}s")
+    if report["by_tier"]:
+        print("by cascade tier: " + "; ".join(f"tier {t}: {v['tasks']} tasks, pass {v['pass_rate']:.1%}, "
+                                              f"p50 {v['seconds_p50']}s" for t, v in report["by_tier"].items()))
+    print(f"Report: {out / 'report.json'}")
+    return 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="Evaluate a dataset (all shards locally with --workers, or one with --shard)")
+    r.add_argument("--dataset", required=True, help="JSONL of HumanEval/MBPP-shaped tasks")
+    r.add_argument("--model", required=True)
+    r.add_argument("--out", required=True, help="Directory for shard checkpoints and the merged report")
+    r.add_argument("--workers", type=int, default=1, help="Local shard processes (each loads the model once)")
+    r.add_argument("--shard", type=int, default=None, help="Run only this shard (0-based); for multi-machine runs")
+    r.add_argument("--num-shards", type=int, default=None, help="Total shards when using --shard")
+    r.add_argument("--retries", type=int, default=2, help="Restarts of a crashed local shard")
+    r.add_argument("--threads", type=int, default=0, help="torch threads per shard (default: CPU count / workers)")
+    r.add_argument("--limit", type=int, default=None, help="Only the first N tasks of the dataset")
+    r.add_argument("--samples", type=int, default=1, help="Runs per task, for pass@k")
+    r.add_argument("--decode", choices=["greedy", "sample"], default="greedy")
+    r.add_argument("--iters", type=int, default=3)
+    r.add_argument("--candidates", type=int, default=1)
+    r.add_argument("--max-new-tokens", type=int, default=256)
+    r.add_argument("--timeout", type=int, default=30, help="Per sandbox run")
+    r.add_argument("--task-deadline", type=float, default=None, help="Wall-clock budget per task in seconds")
+    m = sub.add_parser("merge", help="Merge shard results into report.json")
+    m.add_argument("--out", required=True)
+    m.add_argument("--dataset", default=None, help="Default: the dataset recorded in <out>/run.json")
+    m.add_argument("--k", default="1,5,10")
+    args = ap.parse_args()
+    if args.cmd == "merge":
+        return merge(Path(args.out), args.dataset, ks=[int(k) for k in args.k.split(",") if k.strip()])
+    if args.shard is not None:
+        if not args.num_shards or not 0 <= args.shard < args.num_shards:
+            ap.error("--shard needs --num-shards N with 0 <= shard < N")
+        return run_shard(args)
+    return run_local(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Load generator for the codegen worker: throughput, tail latency, 429s and queue time.
+
+Drives ``POST /run`` (synchronous) or ``POST /jobs`` + ``GET /jobs/{id}`` (queued)
+with a task mix. Closed loop (default): ``--concurrency`` clients each send the next
+request as soon as the previous one returns. Open loop (``--rate``): requests arrive
+at a fixed average rate (Poisson or uniform), independent of how fast the worker
+answers; latency is measured from the scheduled arrival time, so a stalled worker
+shows up in the tail instead of silently lowering the offered load.
+
+``--url`` takes a comma-separated list of workers; requests are then routed through
+``server.pool.WorkerPool`` (least outstanding requests, health-checked), and the
+report breaks completions down per worker.
+
+Point it at a worker with a deterministic backend so runs are comparable, e.g.
+``CODEGEN_WORKER_MODEL=replay:outputs/replay/bench.jsonl uvicorn server.worker:app``.
+Greedy requests with identical payloads are coalesced by the worker; use
+``--decode sample`` (recorded the same way) to measure uncoalesced load.
+
+Usage:
+  python scripts/loadtest.py --url http://127.0.0.1:8000 --concurrency 8 --duration 60
+  python scripts/loadtest.py --rate 2 --arrival poisson --requests 200 --endpoint jobs --clients 4
+  python scripts/loadtest.py --mix tasks.jsonl --priority batch --json outputs/loadtest/run.json
+  python scripts/loadtest.py --url http://host-a:8000,http://host-b:8000 --concurrency 16 --duration 60
+"""
+from __future__ import annotations
+import argparse, json, random, statistics, sys, threading, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from scripts.benchmarks.harness import TASKS, pct  # noqa: E402
+from server.pool import NoWorkerAvailable, WorkerPool  # noqa: E402
+
+
+# ------------------------------ task mix -----------------------------------------
+
+def load_mix(path: str | None) -> List[Dict[str, Any]]:
+    """Tasks with an optional ``weight`` (default 1); the built-in benchmark suite without a file."""
+    if not path:
+        return [dict(t) for t in TASKS]
+    mix = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                mix.append(json.loads(line))
+    if not mix:
+        raise SystemExit(f"No tasks in {path}")
+    return mix
+
+
+def payload_for(task: Dict[str, Any], args) -> Dict[str, Any]:
+    body = {k: v for k, v in task.items() if k not in ("weight", "priority", "client")}
+    body.setdefault("iters", args.iters)
+    body.setdefault("decode", args.decode)
+    body.setdefault("max_new_tokens", args.max_new_tokens)
+    body.setdefault("timeout", args.timeout)
+    body.setdefault("no_design", True)
+    if args.deadline:
+        body.setdefault("deadline", args.deadline)
+    return body
+
+
+# ------------------------------ drivers ------------------------------------------
+
+def drive_run(pool: WorkerPool, body: Dict[str, Any], headers: Dict[str, str], args) -> Dict[str, Any]:
+    url, r = pool.request("POST", "/run", json=body, headers=headers, timeout=args.request_timeout)
+    out: Dict[str, Any] = {"status": r.status_code, "worker": url}
+    if r.status_code == 200:
+        out["ok"] = bool(r.json().get("ok"))
+        for h, k in (("X-Queue-Seconds", "queue_s"), ("X-Run-Seconds", "run_s")):
+            if h in r.headers:
+                out[k] = float(r.headers[h])
+    return out
+
+
+def drive_jobs(pool: WorkerPool, body: Dict[str, Any], headers: Dict[str, str], args) -> Dict[str, Any]:
+    url, r = pool.request("POST", "/jobs", resend=False, json=body, headers=headers, timeout=args.request_timeout)
+    if r.status_code != 202:
+        return {"status": r.status_code, "worker": url}
+    job_id = r.json()["id"]
+    end = time.monotonic() + args.request_timeout
+    while time.monotonic() < end:
+        time.sleep(args.poll)
+        g = pool.session.get(f"{url}/jobs/{job_id}", timeout=args.request_timeout)
+        if g.status_code != 200:
+            return {"status": g.status_code, "worker": url}
+        rec = g.json()
+        if rec["status"] in ("done", "failed", "cancelled"):
+            out: Dict[str, Any] = {"status": 200 if rec["status"] == "done" else 500, "worker": url,
+                                   "ok": bool((rec.get("result") or {}).get("ok"))}
+            if rec.get("started"):
+                out["queue_s"] = rec["started"] - rec["created"]
+                out["run_s"] = (rec.get("finished") or rec["started"]) - rec["started"]
+            return out
+    pool.session.delete(f"{url}/jobs/{job_id}", timeout=10)
+    return {"status": "timeout", "worker": url}
+
+
+DRIVERS: Dict[str, Callable[..., Dict[str, Any]]] = {"run": drive_run, "jobs": drive_jobs}
+
+
+# ------------------------------ load loop ----------------------------------------
+
+class Load:
+    def __init__(self, args):
+        self.args = args
+        self.mix = load_mix(args.mix)
+        self.weights = [float(t.get("weight", 1)) for t in self.mix]
+        self.driver = DRIVERS[args.endpoint]
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, args.concurrency))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self.pool = WorkerPool(args.url.split(","), session=session, retries=args.retries).start()
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.samples: List[Dict[str, Any]] = []
+        self.sent = 0
+
+    def _take(self) -> int | None:
+        """Claim the next request number, or None once the run is over."""
+        with self.lock:
+            if self.args.requests and self.sent >= self.args.requests:
+                return None
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                return None
+            self.sent += 1
+            return self.sent - 1
+
+    def _one(self, n: int, scheduled: float) -> None:
+        with self.lock:
+            task = self.rng.choices(self.mix, self.weights)[0]
+        headers = {"X-Client-Id": task.get("client") or f"loadtest-{n % self.args.clients}"}
+        if task.get("priority") or self.args.priority:
+            headers["X-Priority"] = task.get("priority") or self.args.priority
+        start = time.monotonic()
+        try:
+            res = self.driver(self.pool, payload_for(task, self.args), headers, self.args)
+        except (requests.RequestException, NoWorkerAvailable) as e:
+            res = {"status": type(e).__name__}
+        end = time.monotonic()
+        res.update(n=n, fn=task.get("fn"), t=end - self.t0, latency_s=end - scheduled, service_s=end - start)
+        if n >= self.args.warmup:
+            with self.lock:
+                self.samples.append(res)
+
+    def _closed_client(self) -> None:
+        while (n := self._take()) is not None:
+            self._one(n, time.monotonic())
+
+    def run(self) -> List[Dict[str, Any]]:
+        a = self.args
+        self.t0 = time.monotonic()
+        self.deadline = self.t0 + a.duration if a.duration else None
+        if not a.rate:
+            threads = [threading.Thread(target=self._closed_client, daemon=True) for _ in range(a.concurrency)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return self.samples
+        # open loop: arrivals on a schedule; the pool bounds in-flight requests
+        with ThreadPoolExecutor(max_workers=a.concurrency) as pool:
+            due = self.t0
+            while (n := self._take()) is not None:
+                gap = self.rng.expovariate(a.rate) if a.arrival == "poisson" else 1.0 / a.rate
+                due += gap
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                pool.submit(self._one, n, due)
+        return self.samples
+
+
+# ------------------------------ report -------------------------------------------
+
+def _dist(xs: List[float]) -> Dict[str, Any]:
+    if not xs:
+        return {}
+    return {"mean": round(statistics.fmean(xs), 4), **{f"p{p}": round(pct(xs, p), 4) for p in (50, 90, 95, 99)},
+            "max": round(max(xs), 4)}
+
+
+def summarize(samples: List[Dict[str, Any]], args) -> Dict[str, Any]:
+    codes = Counter(str(s["status"]) for s in samples)
+    done = [s for s in samples if s["status"] == 200]
+    span = (max(s["t"] for s in samples) - min(s["t"] - s["service_s"] for s in samples)) if samples else 0.0
+    n = len(samples)
+    return {
+        "endpoint": args.endpoint, "url": args.url, "concurrency": args.concurrency,
+        "rate": args.rate, "arrival": args.arrival if args.rate else "closed",
+        "requests": n, "completed": len(done), "seconds": round(span, 2),
+        "throughput_rps": round(len(done) / span, 3) if span else None,
+        "status": dict(codes),
+        "error_rate": round(1 - len(done) / n, 4) if n else None,
+        "rate_429": round(codes.get("429", 0) / n, 4) if n else None,
+        "ok_rate": round(sum(1 for s in done if s.get("ok")) / len(done), 4) if done else None,
+        "latency_s": _dist([s["latency_s"] for s in done]),
+        "queue_s": _dist([s["queue_s"] for s in done if "queue_s" in s]),
+        "run_s": _dist([s["run_s"] for s in done if "run_s" in s]),
+        "by_fn": {fn: _dist([s["latency_s"] for s in done if s["fn"] == fn])
+                  for fn in sorted({s["fn"] for s in done if s["fn"]})},
+        "by_worker": dict(Counter(s["worker"] for s in done)),
+    }
+
+
+def print_report(rep: Dict[str, Any]) -> None:
+    print(f"{rep['endpoint']} @ {rep['url']}  ({rep['arrival']}"
+          + (f", {rep['rate']}/s" if rep["rate"] else "") + f", concurrency {rep['concurrency']})")
+    print(f"requests {rep['requests']}  completed {rep['completed']}  in {rep['seconds']}s  "
+          f"-> {rep['throughput_rps']} req/s")
+    print(f"status {rep['status']}  error rate {rep['error_rate']}  429 rate {rep['rate_429']}  ok (passed) {rep['ok_rate']}")
+    if len(rep["by_worker"]) > 1:
+        print("completed per worker " + "  ".join(f"{url} {n}" for url, n in sorted(rep["by_worker"].items())))
+    for k in ("latency_s", "queue_s", "run_s"):
+        d = rep[k]
+        if d:
+            print(f"{k:<10} " + "  ".join(f"{name} {v:.3f}" for name, v in d.items()))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--url", default="http://127.0.0.1:8000", help="Worker URL, or a comma-separated list")
+    ap.add_argument("--endpoint", choices=sorted(DRIVERS), default="run")
+    ap.add_argument("--concurrency", type=int, default=4, help="Clients (closed loop) or max in-flight (open loop)")
+    ap.add_argument("--rate", type=float, default=None, help="Open loop: mean arrivals per second")
+    ap.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    ap.add_argument("--requests", type=int, default=None, help="Stop after N requests")
+    ap.add_argument("--duration", type=float, default=None, help="Stop sending after S seconds")
+    ap.add_argument("--warmup", type=int, default=0, help="Leave the first N requests out of the report")
+    ap.add_argument("--mix", default=None, help="JSONL of tasks (task, fn, signature, doctests, optional weight/priority/client)")
+    ap.add_argument("--clients", type=int, default=1, help="Spread requests over N X-Client-Id values")
+    ap.add_argument("--priority", choices=["interactive", "batch"], default=None)
+    ap.add_argument("--decode", choices=["greedy", "sample"], default="greedy")
+    ap.add_argument("--iters", type=int, default=2)
+    ap.add_argument("--max-new-tokens", type=int, default=160)
+    ap.add_argument("--timeout", type=int, default=60)
+    ap.add_argument("--deadline", type=float, default=None, help="Per-request end-to-end deadline sent to the worker")
+    ap.add_argument("--request-timeout", type=float, default=600.0)
+    ap.add_argument("--retries", type=int, default=0, help="Retry refused/unreachable requests on another worker")
+    ap.add_argument("--poll", type=float, default=0.2, help="Job status poll interval (--endpoint jobs)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", default=None, help="Also write the report (and raw samples) to this file")
+    args = ap.parse_args()
+    if not args.requests and not args.duration:
+        args.requests = 50
+
+    samples = Load(args).run()
+    rep = summarize(samples, args)
+    print_report(rep)
+    if args.json:
+        out = Path(args.json)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({**rep, "samples": samples}, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,494 @@
+"""Bounded job queue for the worker: a fixed number of runs execute concurrently,
+a bounded number wait, and every job's state/result is persisted for polling.
+
+Environment:
+- ``CODEGEN_WORKER_CONCURRENCY``: runs executing at once (default 1; one model per worker)
+- ``CODEGEN_WORKER_QUEUE_DEPTH``: jobs allowed to wait for a slot (default 16)
+- ``CODEGEN_JOBS_DIR``: where job records are written (default ``outputs/jobs``)
+- ``CODEGEN_JOBS_TTL``: seconds finished job records are kept (default 86400)
+- ``CODEGEN_COALESCE_TTL``: seconds a finished job's result is reused for identical
+  requests (default 60; 0 disables coalescing)
+
+- ``CODEGEN_PRIORITY_WEIGHTS``: share of each priority class (default ``interactive=8,batch=1``)
+- ``CODEGEN_CLIENT_WEIGHTS``: optional per-client shares, e.g. ``ci=1,ui=4`` (default 1)
+- ``CODEGEN_CLIENT_MAX_RUNNING``: runs one client may execute at once (default 0 = no cap)
+- ``CODEGEN_CLIENT_QUEUE_DEPTH``: jobs one client may have waiting (default 0 = no cap)
+
+Single-flight coalescing: a submission carrying a ``key`` (a canonical hash of a
+deterministic request) joins the queued/running job with the same key, or reuses its
+result for ``CODEGEN_COALESCE_TTL`` seconds after it finished, instead of starting a
+new run. Each joiner is a subscriber; ``DELETE`` only cancels once none are left.
+
+Live events: the runner gets an ``emit(type, data)`` callback; events (plan steps,
+generated text, status changes) are kept on the in-memory job so that any number of
+subscribers can follow a run with ``events_after`` (``GET /jobs/{id}/events``).
+
+Fair share: every (client, priority) pair has its own FIFO. A free slot goes to the
+flow with the lowest virtual start time (start-time fair queuing), and each dispatch
+advances that flow by ``1 / (priority weight * client weight)``. A client with 500
+batch jobs therefore gets one slot for every eight that interactive users get, and
+never more than ``CODEGEN_CLIENT_MAX_RUNNING`` at once. Sandbox runs execute inside
+their job's thread, so the running cap bounds a client's sandbox processes as well.
+"""
+
+from __future__ import annotations
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from server import metrics
+
+TERMINAL = ("done", "failed", "cancelled")
+MEMORY_TTL_S = 300
+PRIORITIES = ("interactive", "batch")
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def _parse_weights(raw: str) -> Dict[str, float]:
+    """``"a=2,b=1"`` -> ``{"a": 2.0, "b": 1.0}``; malformed or non-positive entries are ignored."""
+    out: Dict[str, float] = {}
+    for part in raw.split(","):
+        name, _, val = part.partition("=")
+        try:
+            if name.strip() and float(val) > 0:
+                out[name.strip()] = float(val)
+        except ValueError:
+            continue
+    return out
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"job queue is full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class _CancelFlag:
+    """``is_set()`` is true once the job was cancelled here or, via a marker file, by another worker process."""
+
+    def __init__(self, event: threading.Event, marker: Path | None):
+        self.event, self.marker = event, marker
+
+    def is_set(self) -> bool:
+        return self.event.is_set() or (self.marker is not None and self.marker.exists())
+
+
+class Job:
+    def __init__(self, job_id: str, request: Dict[str, Any], persist: bool, key: str | None = None,
+                 client: str = "anonymous", priority: str = "batch"):
+        self.id = job_id
+        self.key = key
+        self.client = client
+        self.priority = priority
+        self.subscribers = 1
+        self.owner = os.getpid()  # the worker process running it (pre-fork serving has several)
+        self.request = request
+        self.persist = persist
+        self.status = "queued"
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.result: Dict[str, Any] | None = None
+        self.error: str | None = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.events: list[Dict[str, Any]] = []
+        self._events_cond = threading.Condition()
+        self.save_lock = threading.Lock()
+
+    def emit(self, type_: str, data: Dict[str, Any] | None = None) -> None:
+        with self._events_cond:
+            evt = {"seq": len(self.events), "type": type_}
+            evt.update(data or {})
+            self.events.append(evt)
+            self._events_cond.notify_all()
+
+    def events_after(self, seq: int, timeout: float) -> list[Dict[str, Any]]:
+        """Events numbered ``seq`` and up; waits up to ``timeout`` for one unless the job is done."""
+        with self._events_cond:
+            self._events_cond.wait_for(lambda: len(self.events) > seq or self.done_event.is_set(), timeout)
+            return self.events[seq:]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id, "status": self.status, "created": self.created, "started": self.started,
+            "finished": self.finished, "result": self.result, "error": self.error, "request": self.request,
+            "cancel_requested": self.cancel_event.is_set(), "subscribers": self.subscribers,
+            "client": self.client, "priority": self.priority, "owner_pid": self.owner,
+        }
+
+
+class _Flow:
+    """Queued jobs of one (client, priority) pair plus its fair-share virtual time."""
+
+    def __init__(self, client: str, priority: str, weight: float):
+        self.client, self.priority, self.weight = client, priority, weight
+        self.queue: Deque[Job] = deque()
+        self.vfinish = 0.0
+
+
+class JobQueue:
+    def __init__(self, runner: Callable[[Dict[str, Any], Any, Callable[..., None]], Dict[str, Any]],
+                 concurrency: int | None = None, max_queue: int | None = None, jobs_dir: Path | None = None,
+                 ttl_s: int | None = None, coalesce_ttl_s: float | None = None):
+        self.runner = runner
+        self.concurrency = max(1, concurrency or int(os.getenv("CODEGEN_WORKER_CONCURRENCY", "1")))
+        self.max_queue = max(0, max_queue if max_queue is not None else int(os.getenv("CODEGEN_WORKER_QUEUE_DEPTH", "16")))
+        self.jobs_dir = Path(jobs_dir or os.getenv("CODEGEN_JOBS_DIR", "outputs/jobs"))
+        self.ttl_s = ttl_s if ttl_s is not None else int(os.getenv("CODEGEN_JOBS_TTL", "86400"))
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._threads: list[threading.Thread] = []
+        self._threads_pid = 0
+        self._flows: Dict[Tuple[str, str], _Flow] = {}
+        self._vtime = 0.0
+        self._running_by_client: Dict[str, int] = {}
+        self.priority_weights = {"interactive": 8.0, "batch": 1.0}
+        self.priority_weights.update(_parse_weights(os.getenv("CODEGEN_PRIORITY_WEIGHTS", "")))
+        self.client_weights = _parse_weights(os.getenv("CODEGEN_CLIENT_WEIGHTS", ""))
+        self.client_max_running = int(os.getenv("CODEGEN_CLIENT_MAX_RUNNING", "0"))
+        self.client_max_queue = int(os.getenv("CODEGEN_CLIENT_QUEUE_DEPTH", "0"))
+        self._jobs: Dict[str, Job] = {}
+        self._durations: list[float] = []
+        self.coalesce_ttl_s = coalesce_ttl_s if coalesce_ttl_s is not None else float(os.getenv("CODEGEN_COALESCE_TTL", "60"))
+        self._inflight: Dict[str, Job] = {}
+        self._recent: Dict[str, Job] = {}
+        self._coalesced = {"joined_inflight": 0, "reused_result": 0}
+        self._prune()
+
+    # ------------------------------ state ---------------------------------------
+
+    def _path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _marker(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.cancel"
+
+    def _write(self, path: Path, text: str) -> None:
+        """Atomically replace ``path``; each writer uses its own temp file."""
+        tmp = None
+        try:
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.jobs_dir, prefix=f".{path.stem}.",
+                                             suffix=".tmp", delete=False) as f:
+                tmp = f.name
+                f.write(text)
+            os.replace(tmp, path)
+        except BaseException:
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+            raise
+
+    def _save(self, job: Job) -> None:
+        if not job.persist:
+            return
+        try:
+            self.jobs_dir.mkdir(parents=True, exist_ok=True)
+            # the runner thread and a cancel/subscriber update may save at once: each writes its
+            # own temp file, and the lock makes the state serialized last the one that lands last
+            with job.save_lock:
+                self._write(self._path(job.id), json.dumps(job.to_dict(), default=str))
+        except Exception:
+            pass
+
+    def _prune(self) -> None:
+        """Drop expired records and mark jobs orphaned by a previous process as failed."""
+        if not self.jobs_dir.exists():
+            return
+        now = time.time()
+        for p in self.jobs_dir.glob("*.json"):
+            try:
+                rec = json.loads(p.read_text(encoding="utf-8"))
+                if rec.get("status") in TERMINAL:
+                    if now - (rec.get("finished") or rec.get("created") or now) > self.ttl_s:
+                        p.unlink()
+                    continue
+                rec.update(status="failed", error="worker restarted before the job finished", finished=now)
+                self._write(p, json.dumps(rec, default=str))
+            except Exception:
+                continue
+
+    def fail_orphans(self, pid: int) -> int:
+        """Mark queued/running records owned by the exited worker process ``pid`` as failed.
+
+        Called by the pre-fork parent when it reaps a child: the child's threads are gone,
+        so nothing else would ever finish those records. Returns how many were marked.
+        """
+        if not self.jobs_dir.exists():
+            return 0
+        now, marked = time.time(), 0
+        for p in self.jobs_dir.glob("*.json"):
+            try:
+                rec = json.loads(p.read_text(encoding="utf-8"))
+                if rec.get("owner_pid") != pid or rec.get("status") in TERMINAL:
+                    continue
+                rec.update(status="failed", error=f"worker process {pid} exited before the job finished", finished=now)
+                self._write(p, json.dumps(rec, default=str))
+                marked += 1
+            except Exception:
+                continue
+            try:
+                self._marker(p.stem).unlink()
+            except OSError:
+                pass
+        return marked
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status == "queued")
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status == "running")
+
+    def _retry_after(self, queued: int) -> int:
+        """Rough seconds until a queue slot frees up, from recent job durations."""
+        avg = sum(self._durations) / len(self._durations) if self._durations else 30.0
+        return max(1, math.ceil(avg * max(1, queued) / self.concurrency))
+
+    # ------------------------------ scheduling ----------------------------------
+
+    def _ensure_threads(self) -> None:
+        """Start the execution threads on first use (and again in a forked child, which inherits none)."""
+        if self._threads_pid == os.getpid():
+            return
+        self._threads_pid = os.getpid()
+        self._threads = [threading.Thread(target=self._loop, name=f"codegen-job-{i}", daemon=True)
+                         for i in range(self.concurrency)]
+        for t in self._threads:
+            t.start()
+
+    def _pick(self) -> Job | None:
+        """Next job by start-time fair queuing over flows whose client is under its running cap."""
+        best: _Flow | None = None
+        for fkey, flow in list(self._flows.items()):
+            while flow.queue and flow.queue[0].status != "queued":
+                flow.queue.popleft()  # cancelled while waiting
+            if not flow.queue:
+                if flow.vfinish <= self._vtime:
+                    del self._flows[fkey]  # idle and owed nothing; a new flow starts at the current vtime
+                continue
+            if self.client_max_running and self._running_by_client.get(flow.client, 0) >= self.client_max_running:
+                continue
+            start = max(flow.vfinish, self._vtime)
+            if best is None or (start, flow.queue[0].created) < (max(best.vfinish, self._vtime), best.queue[0].created):
+                best = flow
+        if best is None:
+            return None
+        start = max(best.vfinish, self._vtime)
+        best.vfinish = start + 1.0 / best.weight
+        self._vtime = start
+        job = best.queue.popleft()
+        job.status, job.started = "running", time.time()
+        self._running_by_client[job.client] = self._running_by_client.get(job.client, 0) + 1
+        return job
+
+    def _loop(self) -> None:
+        while True:
+            with self._ready:
+                job = self._pick()
+                while job is None:
+                    self._ready.wait()
+                    job = self._pick()
+            self._execute(job)
+
+    # ------------------------------ API -----------------------------------------
+
+    def submit(self, request: Dict[str, Any], persist: bool = True, key: str | None = None,
+               client: str = "anonymous", priority: str = "batch") -> Job:
+        """Queue a run for ``client`` in a priority class; with a ``key`` an identical
+        in-flight or just-finished job is returned instead."""
+        priority = priority if priority in PRIORITIES else "batch"
+        self._ensure_threads()
+        with self._lock:
+            # finished jobs stay in memory briefly for fast polling; their records remain on disk
+            now = time.time()
+            for jid in [j.id for j in self._jobs.values() if j.finished and now - j.finished > MEMORY_TTL_S]:
+                del self._jobs[jid]
+            for k in [k for k, j in self._recent.items() if now - (j.finished or now) > self.coalesce_ttl_s]:
+                del self._recent[k]
+            if key is not None and self.coalesce_ttl_s > 0:
+                shared = self._inflight.get(key) or self._recent.get(key)
+                if shared is not None:
+                    shared.subscribers += 1
+                    self._coalesced["joined_inflight" if not shared.finished else "reused_result"] += 1
+                    if persist and not shared.persist:
+                        shared.persist = True  # a sync /run job is now also polled through /jobs
+                    self._jobs.setdefault(shared.id, shared)
+                    join = shared
+                else:
+                    join = None
+            else:
+                join = None
+            if join is None:
+                queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+                running = sum(1 for j in self._jobs.values() if j.status == "running")
+                # a free execution slot takes the job right away; otherwise it must fit in the queue
+                if running + queued >= self.concurrency + self.max_queue:
+                    raise QueueFull(self._retry_after(queued))
+                mine = sum(1 for j in self._jobs.values() if j.status == "queued" and j.client == client)
+                if self.client_max_queue and mine >= self.client_max_queue:
+                    raise QueueFull(self._retry_after(mine))
+                job = Job(uuid.uuid4().hex, request, persist, key if self.coalesce_ttl_s > 0 else None,
+                          client=client, priority=priority)
+                self._jobs[job.id] = job
+                if job.key is not None:
+                    self._inflight[job.key] = job
+        if join is not None:
+            self._save(join)
+            return join
+        self._save(job)
+        with self._ready:
+            flow = self._flows.get((client, priority))
+            if flow is None:
+                weight = self.priority_weights.get(priority, 1.0) * self.client_weights.get(client, 1.0)
+                flow = self._flows[(client, priority)] = _Flow(client, priority, weight)
+            flow.queue.append(job)
+            self._ready.notify()
+        self.publish()
+        return job
+
+    def _execute(self, job: Job) -> None:
+        """Run a job picked by ``_pick`` (already marked running)."""
+        flag = _CancelFlag(job.cancel_event, self._marker(job.id) if job.persist else None)
+        metrics.QUEUE_WAIT.observe(job.started - job.created, priority=job.priority)
+        job.emit("status", {"status": "running", "queue_seconds": round(job.started - job.created, 4)})
+        self.publish()
+        self._save(job)
+        try:
+            if flag.is_set():
+                raise JobCancelled()
+            job.result = self.runner(job.request, flag, job.emit)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+        job.finished = time.time()
+        with self._ready:
+            self._running_by_client[job.client] -= 1
+            if not self._running_by_client[job.client]:
+                del self._running_by_client[job.client]
+            self._ready.notify()  # the client may be back under its cap
+            self._durations = (self._durations + [job.finished - (job.started or job.finished)])[-20:]
+            if job.key is not None:
+                self._inflight.pop(job.key, None)
+                # a result cut short by its deadline is not handed to later identical requests
+                if job.status == "done" and not (job.result or {}).get("deadline_exceeded"):
+                    self._recent[job.key] = job
+            if not job.persist:
+                self._jobs.pop(job.id, None)
+        self._save(job)
+        try:
+            self._marker(job.id).unlink()
+        except OSError:
+            pass
+        self.publish(force=True)
+        job.emit("status", {"status": job.status})
+        job.done_event.set()
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                out = job.to_dict()
+                flow = self._flows.get((job.client, job.priority))
+                if job.status == "queued" and flow is not None:
+                    # position within the client's own queue for this class; fair share decides across queues
+                    queued = [j.id for j in flow.queue if j.status == "queued"]
+                    out["queue_position"] = queued.index(job.id) if job.id in queued else 0
+                return out
+        try:
+            return json.loads(self._path(job_id).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def live(self, job_id: str) -> Job | None:
+        """The in-memory job (queued, running or recently finished in this process), for event streaming."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Dict[str, Any] | None:
+        """Cancel a queued job, ask a running one to stop, or delete a finished job's record."""
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            active = job is not None and job.status in ("queued", "running")
+            shared = job is not None and job.subscribers > 1
+            if shared:
+                job.subscribers -= 1  # other clients still wait for (or read) this run
+            elif active:
+                if job.key is not None:
+                    self._inflight.pop(job.key, None)
+                if job.status == "queued":
+                    job.status, job.finished = "cancelled", time.time()  # _pick drops it from its flow
+                    job.emit("status", {"status": "cancelled"})
+                    job.done_event.set()
+                else:
+                    job.cancel_event.set()  # honoured between generation/repair steps
+        if active or shared:
+            self._save(job)
+            return job.to_dict()
+        rec = self.get(job_id)
+        if rec is None:
+            return None
+        if job is None and rec.get("status") in ("queued", "running"):
+            # owned by another worker process (pre-fork serving): it polls for this marker
+            try:
+                self._marker(job_id).touch()
+            except OSError:
+                pass
+            rec["cancel_requested"] = True
+            return rec
+        try:
+            self._path(job_id).unlink()
+        except OSError:
+            pass
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            if job is not None and job.key is not None and self._recent.get(job.key) is job:
+                del self._recent[job.key]
+        rec["deleted"] = True
+        return rec
+
+    def wait(self, job: Job, timeout: float | None = None) -> Job:
+        job.done_event.wait(timeout)
+        return job
+
+    def publish(self, force: bool = False) -> None:
+        """Update the queue gauges and this process's metrics snapshot (see ``server/metrics.py``)."""
+        with self._lock:
+            for prio in PRIORITIES:
+                metrics.QUEUE_DEPTH.set(sum(1 for j in self._jobs.values() if j.status == "queued" and j.priority == prio),
+                                        priority=prio)
+            metrics.RUNNING.set(sum(1 for j in self._jobs.values() if j.status == "running"))
+        metrics.write_snapshot(force)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            clients: Dict[str, Dict[str, int]] = {}
+            for j in self._jobs.values():
+                if j.status in ("queued", "running"):
+                    c = clients.setdefault(j.client, {"queued": 0, "running": 0})
+                    c[j.status] += 1
+        return {"concurrency": self.concurrency, "max_queue": self.max_queue,
+                "running": self.running(), "queued": self.pending(), "coalesced": dict(self._coalesced),
+                "clients": clients, "priority_weights": self.priority_weights,
+                "client_max_running": self.client_max_running, "client_max_queue": self.client_max_queue}
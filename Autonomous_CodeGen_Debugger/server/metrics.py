@@ -0,0 +1,322 @@
+"""Prometheus metrics for the worker (text exposition format, no client library).
+
+Metrics are fed from the same plan events the worker records (``add_plan``), plus
+timings of sandbox runs and model completions. With pre-fork serving every process
+writes a snapshot to ``CODEGEN_METRICS_DIR`` and ``/metrics`` sums the snapshots of
+all workers, so a scrape through the shared socket reports the whole server.
+"""
+
+from __future__ import annotations
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+ITER_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 10)
+TPS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _key(labels: Dict[str, Any] | None) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def _fmt_labels(key: Iterable[Tuple[str, str]], extra: Dict[str, str] | None = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name, self.help = name, help_text
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        k = _key(labels)
+        with self._lock:
+            self.values[k] = self.values.get(k, 0.0) + amount
+
+    def samples(self) -> List[Tuple[str, LabelKey, Dict[str, str], float]]:
+        return [(self.name, k, {}, v) for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self.values[_key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float]):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values: Dict[LabelKey, List[float]] = {}  # bucket counts..., sum, count
+
+    def observe(self, value: float, **labels) -> None:
+        k = _key(labels)
+        with self._lock:
+            row = self.values.setdefault(k, [0.0] * (len(self.buckets) + 2))
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def samples(self) -> List[Tuple[str, LabelKey, Dict[str, str], float]]:
+        out = []
+        for k, row in self.values.items():
+            for i, b in enumerate(self.buckets):
+                out.append((self.name + "_bucket", k, {"le": _fmt_num(b)}, row[i]))
+            out.append((self.name + "_sum", k, {}, row[-2]))
+            out.append((self.name + "_count", k, {}, row[-1]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help_text))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, help_text))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float]) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help_text, buckets))  # type: ignore[return-value]
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"_pid": os.getpid()}
+        for name, m in self.metrics.items():
+            with m._lock:
+                vals = [[list(map(list, k)), list(v) if isinstance(v, list) else v] for k, v in m.values.items()]  # type: ignore[attr-defined]
+            out[name] = {"kind": m.kind, "values": vals}
+        return out
+
+    def render(self, snapshots: List[Dict[str, Any]] | None = None) -> str:
+        """Text exposition of this registry, or of the element-wise sum of ``snapshots``."""
+        lines: List[str] = []
+        for name, m in self.metrics.items():
+            lines.append(f"# HELP {name} {m.help}")
+            lines.append(f"# TYPE {name} {m.kind}")
+            if snapshots is None:
+                with m._lock:
+                    samples = m.samples()  # type: ignore[attr-defined]
+            else:
+                merged = type(m).__new__(type(m))
+                merged.__dict__.update(m.__dict__)
+                merged.values = {}
+                for snap in snapshots:
+                    if m.kind == "gauge" and not _alive(snap.get("_pid")):
+                        continue  # a dead worker's counters still count; its gauges do not
+                    for k, v in snap.get(name, {}).get("values", []):
+                        k = tuple(tuple(p) for p in k)
+                        if isinstance(v, list):
+                            cur = merged.values.setdefault(k, [0.0] * len(v))
+                            merged.values[k] = [a + b for a, b in zip(cur, v)]
+                        else:
+                            merged.values[k] = merged.values.get(k, 0.0) + v
+                samples = merged.samples()
+            for sname, key, extra, v in samples:
+                lines.append(f"{sname}{_fmt_labels(key, extra)} {_fmt_num(v)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("codegen_requests_total", "Codegen runs by outcome (done/failed/cancelled, or rejected when the queue is full)")
+PASSED = REGISTRY.counter("codegen_requests_passed_total", "Runs whose final code passed its doctests")
+REPAIR_ITERS = REGISTRY.histogram("codegen_repair_iterations", "Repair iterations used per run", ITER_BUCKETS)
+STAGE_SECONDS = REGISTRY.histogram("codegen_stage_seconds", "Latency of pipeline stages", STAGE_BUCKETS)
+QUEUE_WAIT = REGISTRY.histogram("codegen_queue_wait_seconds", "Time jobs waited for an execution slot, by priority class", STAGE_BUCKETS)
+PROMPT_TOKENS = REGISTRY.counter("codegen_prompt_tokens_total", "Prompt tokens sent to the model by stage")
+GEN_TOKENS = REGISTRY.counter("codegen_generated_tokens_total", "Tokens generated by the model by stage")
+CONTEXT_SAVED = REGISTRY.counter("codegen_repair_context_saved_tokens_total", "Repair prompt tokens saved by context compaction")
+CASCADE_RUNS = REGISTRY.counter("codegen_cascade_runs_total", "Cascade runs by the tier they finished on and outcome (solved/unsolved)")
+CASCADE_SECONDS = REGISTRY.histogram("codegen_cascade_run_seconds", "Cascade run latency by the tier that finished it", STAGE_BUCKETS)
+CASCADE_SWITCHES = REGISTRY.counter("codegen_cascade_switches_total", "Cascade escalations by target tier and reason")
+TOKENS_PER_S = REGISTRY.histogram("codegen_generation_tokens_per_second", "Generated tokens per second per completion", TPS_BUCKETS)
+SANDBOX_RUNS = REGISTRY.counter("codegen_sandbox_runs_total", "Doctest sandbox runs by result (pass/fail/timeout/oom/deadline)")
+CACHE_LOOKUPS = REGISTRY.counter("codegen_cache_lookups_total", "Cache lookups by cache")
+CACHE_HITS = REGISTRY.counter("codegen_cache_hits_total", "Cache hits by cache")
+QUEUE_DEPTH = REGISTRY.gauge("codegen_queue_depth", "Jobs waiting for an execution slot, by priority class")
+RUNNING = REGISTRY.gauge("codegen_jobs_running", "Jobs currently executing")
+EVENTS = REGISTRY.counter("codegen_plan_events_total", "Plan events by tag")
+
+# start/done plan event pairs that delimit a timed stage
+_STAGES = {"design": "design", "generate": "generate", "repair": "repair"}
+
+
+class RunMetrics:
+    """Per-run adapter: feed it the run's plan events and completion/sandbox timings.
+
+    Besides updating the process-wide metrics it keeps this run's totals
+    (``stage_seconds``, ``tokens``, ``model_seconds``) for the benchmark harness.
+    """
+
+    def __init__(self):
+        self._started: Dict[str, float] = {}
+        self.stage = "generate"
+        self.stage_seconds: Dict[str, float] = {}
+        self.tokens = {"prompt": 0, "generated": 0}
+        self.model_seconds = 0.0
+
+    def timed(self, stage: str, seconds: float) -> None:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def event(self, tag: str, data: Dict[str, Any] | None = None) -> None:
+        EVENTS.inc(tag=tag)
+        if tag == "repair:context" and data:
+            CONTEXT_SAVED.inc(max(0, data.get("saved", 0)))
+        elif tag == "cascade:switch" and data:
+            CASCADE_SWITCHES.inc(tier=data.get("tier"), reason=str(data.get("reason", "")).split(":")[0])
+        elif tag == "cascade:done" and data:
+            CASCADE_RUNS.inc(tier=data.get("tier"), outcome="solved" if data.get("ok") else "unsolved")
+            CASCADE_SECONDS.observe(data.get("seconds", 0.0), tier=data.get("tier"))
+        prefix, _, phase = tag.partition(":")
+        stage = _STAGES.get(prefix)
+        if stage is None:
+            return
+        if phase == "start":
+            self.stage = stage
+            self._started[stage] = time.perf_counter()
+        elif phase == "done" and stage in self._started:
+            self.timed(stage, time.perf_counter() - self._started.pop(stage))
+
+    def completion(self, seconds: float, usage: Dict[str, Any] | None) -> None:
+        self.timed(f"{self.stage}_model", seconds)
+        if not usage:
+            return
+        PROMPT_TOKENS.inc(usage.get("prompt_tokens", 0), stage=self.stage)
+        gen = usage.get("completion_tokens", 0)
+        GEN_TOKENS.inc(gen, stage=self.stage)
+        secs = usage.get("seconds") or seconds
+        self.tokens["prompt"] += usage.get("prompt_tokens", 0)
+        self.tokens["generated"] += gen
+        self.model_seconds += secs
+        if gen and secs > 0:
+            TOKENS_PER_S.observe(gen / secs)
+
+    def sandbox(self, seconds: float, res: Dict[str, Any], stage: str = "sandbox") -> None:
+        CACHE_LOOKUPS.inc(cache="sandbox")
+        if res.get("cached"):
+            CACHE_HITS.inc(cache="sandbox")
+        else:
+            self.timed(stage, seconds)
+        if res.get("stderr") == "TIMEOUT":
+            outcome = "timeout"
+        elif res.get("deadline_exceeded"):
+            outcome = "deadline"
+        elif (res.get("usage") or {}).get("oom_killed"):
+            outcome = "oom"
+        else:
+            outcome = "pass" if res.get("ok") else "fail"
+        SANDBOX_RUNS.inc(result=outcome)
+
+    def finished(self, status: str, ok: bool, plan: List[Dict[str, Any]]) -> None:
+        REQUESTS.inc(status=status)
+        if ok:
+            PASSED.inc()
+        if status == "done":
+            REPAIR_ITERS.observe(sum(1 for e in plan if e.get("tag") == "repair:start"))
+
+
+class MeteredBackend:
+    """Wraps a backend so each ``complete`` is timed and its token usage (``last_usage()``) recorded."""
+
+    def __init__(self, backend, run: RunMetrics):
+        self._backend, self._run = backend, run
+
+    def __getattr__(self, name: str):
+        return getattr(self._backend, name)
+
+    def complete(self, prompt: str, *args, **kwargs) -> str:
+        t0 = time.perf_counter()
+        text = self._backend.complete(prompt, *args, **kwargs)
+        usage_fn = getattr(self._backend, "last_usage", None)
+        self._run.completion(time.perf_counter() - t0, usage_fn() if callable(usage_fn) else None)
+        return text
+
+
+# ------------------------------ multi-process ------------------------------------
+
+_snapshot_lock = threading.Lock()
+_last_snapshot = 0.0
+
+
+def _alive(pid: Any) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (TypeError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def metrics_dir() -> Path | None:
+    raw = os.getenv("CODEGEN_METRICS_DIR", "").strip()
+    return Path(raw) if raw else None
+
+
+def write_snapshot(force: bool = False) -> None:
+    """Persist this process's values for aggregation (pre-fork serving); at most once a second."""
+    global _last_snapshot
+    d = metrics_dir()
+    if d is None:
+        return
+    with _snapshot_lock:
+        now = time.time()
+        if not force and now - _last_snapshot < 1.0:
+            return
+        _last_snapshot = now
+        try:
+            d.mkdir(parents=True, exist_ok=True)
+            tmp = d / f"{os.getpid()}.json.tmp"
+            tmp.write_text(json.dumps(REGISTRY.snapshot()), encoding="utf-8")
+            os.replace(tmp, d / f"{os.getpid()}.json")
+        except OSError:
+            pass
+
+
+def render() -> str:
+    d = metrics_dir()
+    if d is None:
+        return REGISTRY.render()
+    write_snapshot(force=True)
+    snaps = []
+    for p in d.glob("*.json"):
+        try:
+            snaps.append(json.loads(p.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return REGISTRY.render(snaps)
@@ -0,0 +1,284 @@
+"""Client-side pool of codegen workers: health checks, least-outstanding routing, failover.
+
+Used by the UI, the load generator and scripts to spread runs over several worker
+hosts (``CODEGEN_WORKER_URLS=http://a:8000,http://b:8000``; a single
+``CODEGEN_WORKER_URL`` also works).
+
+- Health: a daemon thread polls ``GET /health`` on every worker every
+  ``CODEGEN_POOL_HEALTH_INTERVAL`` seconds (default 5) and records its model and
+  queue load. A worker that fails a request or a check leaves the rotation until it
+  answers a health check again.
+- Routing: a request goes to the healthy worker with the lowest load, i.e. requests
+  this client has in flight there plus the jobs the worker last reported as running
+  or queued (so load from other clients counts too). Ties go round-robin.
+- Model affinity: with ``model=...`` only workers serving that model (same spec or
+  same directory name) are used; each worker serves the one model it loaded. With
+  ``strict_model=False`` they are only preferred, and any worker is used when none
+  serves it.
+- Failover: connection errors, 502/503/504 and 429 responses are retried on a
+  different worker (``CODEGEN_POOL_RETRIES``, default 2). A timed-out ``/run`` is not retried,
+  since the first worker may still be executing it. ``POST /jobs`` is not idempotent, so
+  ``submit`` fails over only when the request never reached a worker (connection
+  refused, name resolution, connect timeout) or was refused with 429/503; a read
+  timeout, a dropped connection or a 502/504 may mean the job was accepted and is
+  raised or returned instead of being queued a second time elsewhere.
+
+Jobs stay on the worker that accepted them; ``submit`` returns a ``PoolJob`` whose
+``url`` is used for polling, events and cancellation.
+"""
+
+from __future__ import annotations
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import Any, Dict, Iterable, List
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+
+# gateway/unavailable answers mean "try elsewhere"; a 500 is the run itself failing and is returned
+_UNAVAILABLE = (502, 503, 504)
+
+
+class NoWorkerAvailable(RuntimeError):
+    pass
+
+
+def _not_sent(e: requests.RequestException) -> bool:
+    """True when the request cannot have reached the worker (no connection was made)."""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(e, requests.ConnectionError) and isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+@dataclass
+class PoolJob:
+    url: str
+    id: str
+
+
+class _Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = False
+        self.checked = 0.0
+        self.model: str | None = None
+        self.server_load = 0
+        self.outstanding = 0
+        self.failures = 0
+        self.requests = 0
+        self.error: str | None = None
+
+    def load(self) -> int:
+        return self.outstanding + self.server_load
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"url": self.url, "healthy": self.healthy, "model": self.model, "outstanding": self.outstanding,
+                "server_load": self.server_load, "requests": self.requests, "failures": self.failures,
+                "error": self.error}
+
+
+def _same_model(served: str | None, wanted: str) -> bool:
+    if not served:
+        return False
+    if served == wanted:
+        return True
+    return PurePath(served.rstrip("/")).name == PurePath(wanted.rstrip("/")).name
+
+
+class WorkerPool:
+    def __init__(self, urls: Iterable[str], session: requests.Session | None = None,
+                 health_interval: float | None = None, retries: int | None = None, health_timeout: float = 5.0):
+        self.endpoints = [_Endpoint(u.strip().rstrip("/")) for u in urls if u.strip()]
+        if not self.endpoints:
+            raise ValueError("WorkerPool needs at least one worker URL")
+        self.session = session or requests.Session()
+        self.health_interval = health_interval if health_interval is not None else float(os.getenv("CODEGEN_POOL_HEALTH_INTERVAL", "5"))
+        self.retries = retries if retries is not None else int(os.getenv("CODEGEN_POOL_RETRIES", "2"))
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._rr = itertools.count()
+        self._checker: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "WorkerPool":
+        raw = os.getenv("CODEGEN_WORKER_URLS", "").strip() or os.getenv("CODEGEN_WORKER_URL", "").strip()
+        if not raw:
+            raise NoWorkerAvailable("Set CODEGEN_WORKER_URLS (or CODEGEN_WORKER_URL) to the worker address(es).")
+        return cls(raw.split(","), **kwargs)
+
+    # ------------------------------ health ---------------------------------------
+
+    def check(self, ep: _Endpoint) -> bool:
+        try:
+            r = self.session.get(ep.url + "/health", timeout=self.health_timeout)
+            r.raise_for_status()
+            info = r.json()
+            jobs = info.get("jobs") or {}
+            with self._lock:
+                ep.healthy = info.get("status") == "ok"
+                ep.model = info.get("model")
+                ep.server_load = int(jobs.get("running", 0)) + int(jobs.get("queued", 0))
+                ep.error = None
+        except (requests.RequestException, ValueError) as e:
+            with self._lock:
+                ep.healthy, ep.error = False, f"{type(e).__name__}: {e}"
+        ep.checked = time.monotonic()
+        return ep.healthy
+
+    def check_all(self) -> None:
+        threads = [threading.Thread(target=self.check, args=(ep,), daemon=True) for ep in self.endpoints]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            self.check_all()
+
+    def start(self) -> "WorkerPool":
+        """Check every worker once, then keep checking in the background."""
+        with self._start_lock:
+            if self._checker is None:
+                self.check_all()
+                self._checker = threading.Thread(target=self._health_loop, name="worker-pool-health", daemon=True)
+                self._checker.start()
+        return self
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def healthy(self, model: str | None = None) -> List[str]:
+        self.start()
+        with self._lock:
+            return [ep.url for ep in self.endpoints if ep.healthy and (model is None or _same_model(ep.model, model))]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [ep.to_dict() for ep in self.endpoints]
+
+    # ------------------------------ routing --------------------------------------
+
+    def _acquire(self, model: str | None, exclude: set, strict_model: bool = True) -> _Endpoint:
+        self.start()
+        with self._lock:
+            live = [ep for ep in self.endpoints if ep.healthy and ep.url not in exclude]
+            if model is not None:
+                serving = [ep for ep in live if _same_model(ep.model, model)]
+                live = serving if serving or strict_model else live
+            if not live:
+                what = f" serving {model}" if model else ""
+                raise NoWorkerAvailable(f"no healthy worker{what} (tried {len(exclude)})")
+            low = min(ep.load() for ep in live)
+            best = [ep for ep in live if ep.load() == low]
+            ep = best[next(self._rr) % len(best)]
+            ep.outstanding += 1
+            ep.requests += 1
+            return ep
+
+    def _release(self, ep: _Endpoint, failed: bool = False, error: str | None = None) -> None:
+        with self._lock:
+            ep.outstanding -= 1
+            if failed:
+                # out of rotation until the next successful health check
+                ep.healthy, ep.failures, ep.error = False, ep.failures + 1, error
+
+    def request(self, method: str, path: str, model: str | None = None, strict_model: bool = True,
+                resend: bool = True, **kwargs) -> tuple[str, requests.Response]:
+        """Send to the least-loaded healthy worker, failing over to others; returns (worker url, response).
+
+        A 429 from every worker is returned as is (the caller decides whether to back off).
+        With ``resend=False`` (non-idempotent requests) only failures that prove the worker
+        never took the request are retried elsewhere; anything else is raised or returned.
+        """
+        tried: set = set()
+        last: requests.Response | None = None
+        last_url = ""
+        error: Exception | None = None
+        rechecked = False
+        for attempt in range(self.retries + 1):
+            try:
+                ep = self._acquire(model, tried, strict_model)
+            except NoWorkerAvailable:
+                if not tried and not rechecked:
+                    # every worker is out of rotation: re-check now rather than wait for the next round
+                    rechecked = True
+                    self.check_all()
+                    ep = self._acquire(model, tried, strict_model)
+                elif last is not None:
+                    return last_url, last
+                elif error is not None:
+                    raise NoWorkerAvailable(f"no worker could take the request: {error}") from error
+                else:
+                    raise
+            tried.add(ep.url)
+            try:
+                r = self.session.request(method, ep.url + path, **kwargs)
+            except requests.Timeout as e:
+                if not isinstance(e, requests.ConnectTimeout):
+                    self._release(ep)
+                    raise
+                self._release(ep, failed=True, error=f"{type(e).__name__}: {e}")
+                error = e
+                continue
+            except requests.RequestException as e:
+                self._release(ep, failed=True, error=f"{type(e).__name__}: {e}")
+                if not resend and not _not_sent(e):
+                    raise
+                error = e
+                continue
+            unavailable = r.status_code in _UNAVAILABLE
+            self._release(ep, failed=unavailable, error=f"HTTP {r.status_code}")
+            if r.status_code == 429 or (unavailable and (resend or r.status_code == 503)):
+                last, last_url = r, ep.url
+                continue
+            return ep.url, r
+        if last is not None:
+            return last_url, last
+        raise NoWorkerAvailable(f"no worker could take the request: {error}")
+
+    # ------------------------------ API ------------------------------------------
+
+    def run(self, payload: Dict[str, Any], model: str | None = None, headers: Dict[str, str] | None = None,
+            timeout: float = 600.0, strict_model: bool = True) -> requests.Response:
+        """``POST /run`` on the best worker (synchronous)."""
+        return self.request("POST", "/run", model=model, strict_model=strict_model, json=payload, headers=headers,
+                            timeout=timeout)[1]
+
+    def submit(self, payload: Dict[str, Any], model: str | None = None, headers: Dict[str, str] | None = None,
+               timeout: float = 30.0, strict_model: bool = True) -> PoolJob:
+        """``POST /jobs`` on the best worker; raises ``requests.HTTPError`` if every worker refused.
+
+        Not retried elsewhere once a worker may have accepted the job (see ``resend``), so a
+        task is never queued twice; a ``requests.Timeout`` means the outcome is unknown.
+        """
+        url, r = self.request("POST", "/jobs", model=model, strict_model=strict_model, resend=False,
+                              json=payload, headers=headers, timeout=timeout)
+        r.raise_for_status()
+        return PoolJob(url, r.json()["id"])
+
+    def job(self, job: PoolJob, timeout: float = 30.0) -> Dict[str, Any]:
+        r = self.session.get(f"{job.url}/jobs/{job.id}", timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def events(self, job: PoolJob, timeout: float = 600.0, after: int | None = None) -> requests.Response:
+        """The job's server-sent event stream (``GET /jobs/{id}/events``), opened with ``stream=True``."""
+        params = {"after": after} if after is not None else None
+        r = self.session.get(f"{job.url}/jobs/{job.id}/events", params=params, stream=True, timeout=(10, timeout))
+        r.raise_for_status()
+        return r
+
+    def cancel(self, job: PoolJob, headers: Dict[str, str] | None = None) -> None:
+        try:
+            self.session.delete(f"{job.url}/jobs/{job.id}", headers=headers, timeout=5)
+        except requests.RequestException:
+            pass
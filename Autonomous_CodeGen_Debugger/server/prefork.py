@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Pre-fork serving: load the model once, then fork N uvicorn workers that share it.
+
+The parent loads the backend, moves CPU weights into shared memory
+(``Module.share_memory()``), freezes the GC so collections in the children do not
+touch (and copy) the parent's objects, and binds one listening socket. Each forked
+child runs its own uvicorn server, job queue and sandbox runs on that socket; the
+kernel spreads connections across them. The weights exist once in RAM however many
+workers run.
+
+Usage::
+
+    CODEGEN_WORKER_MODEL=/path/to/model python -m server.prefork --workers 4 --port 8000
+
+CUDA/MPS models cannot be forked once initialised; use a single ``uvicorn`` worker there.
+Per-process state (in-memory job table, coalescing, sandbox LRU) is not shared; job
+records and the sandbox disk cache are, so any child can answer ``GET /jobs/{id}``.
+Each record carries the ``owner_pid`` of the child running it; when the parent reaps a
+crashed child it marks that child's queued and running jobs failed.
+Metrics are aggregated through per-process snapshots in ``CODEGEN_METRICS_DIR``.
+
+Forking after threads exist is fragile: a child inherits only the forking thread, so
+a torch intra-op pool (OpenMP/MKL) that ran in the parent can leave the child hanging
+in its first parallel op with GNU OpenMP. The parent therefore loads the model with
+one torch thread and never runs inference; each child sets ``--threads`` after the fork.
+Anything else that starts threads or pools in the parent (a tokenizers Rust pool,
+metrics exporters) carries the same risk.
+
+A ``cascade:`` model loads its tiers lazily, which here would mean once per child
+with nothing shared. The parent loads every tier before forking (all of them are
+then resident for the life of the server) and shares each tier's weights.
+"""
+
+from __future__ import annotations
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+
+def _share_weights(backend) -> str:
+    """Put a torch model's parameters/buffers in shared memory; return the device type."""
+    tiers = getattr(backend, "tiers", None)
+    if tiers is not None:
+        # cascade: load every tier now so the children share them instead of each loading its own
+        devices = {_share_weights(backend.backend(i)) for i in range(len(tiers))}
+        gpu = sorted(devices - {"cpu", "none"})
+        return gpu[0] if gpu else ("cpu" if "cpu" in devices else "none")
+    model = getattr(backend, "model", None)
+    if model is None:
+        return "none"
+    try:
+        device = next(model.parameters()).device.type
+    except (StopIteration, AttributeError):
+        return "none"
+    if device != "cpu":
+        return device
+    model.eval()
+    model.requires_grad_(False)
+    model.share_memory()
+    return device
+
+
+def _bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _child(sock: socket.socket, args) -> None:
+    import uvicorn
+    import server.worker as worker
+
+    if args.threads:
+        try:
+            import torch  # type: ignore
+            torch.set_num_threads(args.threads)
+        except ImportError:
+            pass
+    config = uvicorn.Config(worker.app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Serve the CodeGen worker from N forked processes sharing one model")
+    ap.add_argument("--host", default=os.getenv("CODEGEN_WORKER_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("CODEGEN_WORKER_PORT", "8000")))
+    ap.add_argument("--workers", type=int, default=int(os.getenv("CODEGEN_PREFORK_WORKERS", "0")) or (os.cpu_count() or 1),
+                    help="Worker processes (default: CODEGEN_PREFORK_WORKERS or the CPU count)")
+    ap.add_argument("--threads", type=int, default=int(os.getenv("CODEGEN_PREFORK_THREADS", "0")),
+                    help="torch intra-op threads per worker (default: CPU count / workers)")
+    ap.add_argument("--log-level", default="info")
+    ap.add_argument("--keep-alive", type=int, default=5)
+    args = ap.parse_args()
+    args.workers = max(1, args.workers)
+    if not args.threads:
+        args.threads = max(1, (os.cpu_count() or 1) // args.workers)
+
+    import server.worker as worker
+    from src.backends.select import select_backend
+
+    if not worker.MODEL_SPEC:
+        print("Set CODEGEN_WORKER_MODEL or CODEGEN_MODEL_PATH before starting the worker", file=sys.stderr)
+        return 2
+    try:
+        import torch  # type: ignore
+        torch.set_num_threads(1)  # no OpenMP pool may exist at fork time (see the module docstring)
+    except ImportError:
+        pass
+    t0 = time.time()
+    worker.BACKEND = select_backend(worker.MODEL_SPEC)
+    device = _share_weights(worker.BACKEND)
+    if device not in ("cpu", "none") and args.workers > 1:
+        print(f"Model is on {device}; forked workers cannot share it. Use --workers 1.", file=sys.stderr)
+        return 2
+    print(f"[prefork] loaded {worker.MODEL_SPEC} on {device} in {time.time() - t0:.1f}s; "
+          f"forking {args.workers} workers x {args.threads} threads on {args.host}:{args.port}", flush=True)
+
+    # each worker writes its metrics here; GET /metrics on any of them sums the lot
+    mdir = os.environ.setdefault("CODEGEN_METRICS_DIR", os.path.join("outputs", "metrics"))
+    os.makedirs(mdir, exist_ok=True)
+    for name in os.listdir(mdir):
+        if name.endswith(".json"):
+            os.unlink(os.path.join(mdir, name))
+
+    sock = _bind(args.host, args.port)
+    gc.collect()
+    gc.freeze()
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                _child(sock, args)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = slot
+
+    def stop(signum, _frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for slot in range(args.workers):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        orphans = worker.JOBS.fail_orphans(pid)
+        if orphans:
+            print(f"[prefork] marked {orphans} job(s) of worker {pid} failed", file=sys.stderr, flush=True)
+        if slot is None or stopping:
+            continue
+        print(f"[prefork] worker {pid} exited (status {status}); restarting", file=sys.stderr, flush=True)
+        time.sleep(1)
+        spawn(slot)
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
 import os
+import time
 from typing import Any, Dict
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
 from src.backends.select import select_backend
+from src.backends.cascade import CascadeBackend
+from src.execution_sandbox.cache import SandboxCache, normalize_code
+from src.execution_sandbox.perf import check_performance
+from src.execution_sandbox.cgroups import sandbox_parent, unavailable_reason
+from src.debugging_loop.deadline import Deadline
+from server.jobs import JobCancelled, JobQueue, QueueFull
+from server import metrics
 from src.debugging_loop.debugger import (
     _design_signature_and_doctests_backend,
     seed_prefix_header_only,
@@ -17,6 +29,7 @@ from src.debugging_loop.debugger import (
     is_bad,
     _add_imports_only,
     _to_standalone,
+    _first_doctest_call,
 )
 
 app = FastAPI(title="CodeGen Worker", version="0.1.0")
@@ -38,22 +51,32 @@ class RunRequest(BaseModel):
     standalone: bool = False
     clean_doc: bool = False
     coverage_repair: bool = False
+    repair_budget: int | None = None  # max repair prompt tokens; None uses CODEGEN_REPAIR_BUDGET, 0 is unbounded
+    perf_check: bool = False
+    perf_budget: float = 1.5
+    deadline: float | None = None  # seconds for the whole run; the best code so far is returned once it passes
+    preamble: str | None = None  # module-level code the function needs (imports, helpers); in prompts, sandbox runs and the result
 
 
 class RunResponse(BaseModel):
     ok: bool
     code: str
+    deadline_exceeded: bool = False
     plan: list[dict] = []
     logs: list[str] = []
 
 
 MODEL_SPEC = os.getenv("CODEGEN_WORKER_MODEL") or os.getenv("CODEGEN_MODEL_PATH")
 BACKEND = None
+# Shared across requests so duplicate candidates from different clients are also short-circuited
+SANDBOX_CACHE = None if os.getenv("CODEGEN_SANDBOX_CACHE", "1") == "0" else SandboxCache()
 
 
 @app.on_event("startup")
 def _load_backend():
     global BACKEND
+    if BACKEND is not None:
+        return  # loaded by the pre-fork parent (server/prefork.py) and shared with this process
     if not MODEL_SPEC:
         raise RuntimeError("Set CODEGEN_WORKER_MODEL or CODEGEN_MODEL_PATH before starting the worker")
     BACKEND = select_backend(MODEL_SPEC)
@@ -61,18 +84,286 @@ def _load_backend():
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "model": MODEL_SPEC}
+    out = {"status": "ok", "model": MODEL_SPEC, "pid": os.getpid()}
+    out["sandbox_backend"] = "cgroup" if sandbox_parent() is not None else f"rlimit ({unavailable_reason()})"
+    if SANDBOX_CACHE is not None:
+        out["sandbox_cache"] = SANDBOX_CACHE.stats()
+    out["jobs"] = JOBS.stats()
+    if isinstance(BACKEND, CascadeBackend):
+        out["cascade"] = BACKEND.stats()
+    return out
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text exposition; summed over all workers when pre-fork serving."""
+    JOBS.publish()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def coalesce_key(req: RunRequest) -> str | None:
+    """Canonical hash of a deterministic request; None when two runs may legitimately differ.
+
+    The ``deadline`` is part of the hash, so only runs under the same time budget are shared.
+    """
+    if req.decode != "greedy":
+        return None
+    payload = req.model_dump()
+    for f in ("task", "signature", "doctests", "fn"):
+        if isinstance(payload.get(f), str):
+            payload[f] = payload[f].strip()
+    blob = json.dumps({"model": MODEL_SPEC, "request": payload}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def client_identity(request: Request, default_priority: str) -> tuple[str, str]:
+    """(client, priority class) for fair scheduling.
+
+    The client is a hash of the API key (``X-API-Key`` or ``Authorization: Bearer``), else
+    the ``X-Client-Id`` header, else the peer address. ``X-Priority: interactive|batch``
+    overrides the endpoint's default class.
+    """
+    auth = request.headers.get("authorization", "")
+    api_key = request.headers.get("x-api-key") or (auth[7:].strip() if auth.lower().startswith("bearer ") else "")
+    if api_key:
+        client = "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    elif request.headers.get("x-client-id"):
+        client = request.headers["x-client-id"].strip()[:64]
+    else:
+        client = "ip:" + (request.client.host if request.client else "unknown")
+    priority = request.headers.get("x-priority", default_priority).strip().lower()
+    return client, priority
+
+
+def _submit(req: RunRequest, persist: bool, request: Request, default_priority: str):
+    key = coalesce_key(req)
+    client, priority = client_identity(request, default_priority)
+    try:
+        job = JOBS.submit(req.model_dump(), persist=persist, key=key, client=client, priority=priority)
+    except QueueFull as e:
+        metrics.REQUESTS.inc(status="rejected")
+        raise _queue_full(e)
+    if key is not None:
+        metrics.CACHE_LOOKUPS.inc(cache="coalesce")
+        if job.subscribers > 1:
+            metrics.CACHE_HITS.inc(cache="coalesce")
+    return job
+
+
+def _queue_full(e: QueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
 
 @app.post("/run", response_model=RunResponse)
-def run(req: RunRequest):
+async def run(req: RunRequest, request: Request, response: Response):
+    """Run synchronously; shares the job executor's concurrency limit and queue.
+
+    If the client disconnects first, the job is cancelled (or, when coalesced, the
+    client's subscription dropped), which stops in-flight generation and sandbox runs.
+    ``X-Queue-Seconds`` / ``X-Run-Seconds`` report the job's wait and execution time.
+    """
+    job = _submit(req, persist=False, request=request, default_priority="interactive")
+    while not await asyncio.to_thread(job.done_event.wait, 0.5):
+        if await request.is_disconnected():
+            JOBS.cancel(job.id)
+            raise HTTPException(status_code=499, detail="client disconnected")
+    if job.status != "done":
+        raise HTTPException(status_code=500, detail=job.error or job.status)
+    if job.started is not None:
+        response.headers["X-Queue-Seconds"] = f"{job.started - job.created:.4f}"
+        response.headers["X-Run-Seconds"] = f"{(job.finished or job.started) - job.started:.4f}"
+    return job.result
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(req: RunRequest, request: Request, response: Response):
+    """Queue a run and return its id at once; poll ``GET /jobs/{id}`` for the result."""
+    job = _submit(req, persist=True, request=request, default_priority="batch")
+    response.headers["Location"] = f"/jobs/{job.id}"
+    # subscribers > 1: attached to an identical in-flight (or just finished) greedy run
+    return {"id": job.id, "status": job.status, "subscribers": job.subscribers}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    rec = JOBS.get(job_id)
+    if rec is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return rec
+
+
+def _sse(event: str, data: Dict[str, Any], seq: int | None = None) -> str:
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str, request: Request, after: int | None = None):
+    """Server-sent events for one job: ``status``, ``plan`` and ``token`` events as they happen, then ``result``.
+
+    ``after`` (or ``Last-Event-ID``) resumes after that event id. A job owned by another
+    pre-fork worker has no live events here; its status is polled from disk instead.
+    """
+    rec = JOBS.get(job_id)
+    if rec is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    job = JOBS.live(job_id)
+    if after is None:
+        last = request.headers.get("last-event-id", "")
+        after = int(last) if last.isdigit() else -1
+
+    def stream():
+        if job is None or rec["status"] == "queued":
+            yield _sse("status", {"status": rec["status"], "queue_position": rec.get("queue_position")})
+        if job is not None:
+            seq = after + 1
+            while True:
+                batch = job.events_after(seq, timeout=15.0)
+                for evt in batch:
+                    yield _sse(evt["type"], evt, evt["seq"])
+                seq += len(batch)
+                if job.done_event.is_set() and seq >= len(job.events):
+                    break
+                if not batch:
+                    yield ": keep-alive\n\n"
+            final = JOBS.get(job_id) or job.to_dict()
+        else:
+            final, status = rec, rec["status"]
+            while final.get("status") not in ("done", "failed", "cancelled"):
+                time.sleep(0.5)
+                final = JOBS.get(job_id) or dict(final, status="failed", error="job record disappeared")
+                if final["status"] != status:
+                    status = final["status"]
+                    yield _sse("status", {"status": status})
+        yield _sse("result", final)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.delete("/jobs/{job_id}")
+def delete_job(job_id: str):
+    """Cancel a queued or running job; for a finished job, delete its stored record."""
+    rec = JOBS.cancel(job_id)
+    if rec is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return rec
+
+
+def _run_job(payload: Dict[str, Any], cancel, emit=None) -> Dict[str, Any]:
+    meter = metrics.RunMetrics()
+    try:
+        res = execute(RunRequest(**payload), cancel, meter, emit)
+    except JobCancelled:
+        meter.finished("cancelled", False, [])
+        raise
+    except Exception:
+        meter.finished("failed", False, [])
+        raise
+    meter.finished("done", res.ok, res.plan)
+    return res.model_dump()
+
+
+JOBS = JobQueue(_run_job)
+
+
+class _StreamingBackend:
+    """Forwards generated text to ``emit("token", ...)`` while a completion is produced."""
+
+    def __init__(self, backend, emit):
+        self._backend, self._emit = backend, emit
+
+    def __getattr__(self, name: str):
+        return getattr(self._backend, name)
+
+    def complete(self, prompt: str, *args, **kwargs) -> str:
+        self._emit("completion", {"state": "start"})
+        text = self._backend.complete(prompt, *args, on_text=lambda t: self._emit("token", {"text": t}), **kwargs)
+        self._emit("completion", {"state": "done", "chars": len(text)})
+        return text
+
+
+def _shift_coverage(cov: Dict[str, Any], offset: int) -> Dict[str, Any]:
+    """Coverage of a preamble-prefixed run in the candidate's own line numbers (preamble lines dropped)."""
+    executed = [ln - offset for ln in cov.get("executed", []) if ln > offset]
+    missed = [ln - offset for ln in cov.get("missed", []) if ln > offset]
+    total = len(executed) + len(missed)
+    return {"executed": executed, "missed": missed,
+            "percent": round(100.0 * len(executed) / total, 1) if total else 100.0}
+
+
+def execute(req: RunRequest, cancel=None, meter: metrics.RunMetrics | None = None, emit=None) -> RunResponse:
+    """Design, generate, test and repair for one request; raises JobCancelled once ``cancel`` is set.
+
+    ``cancel`` and ``req.deadline`` also interrupt in-flight generation and sandbox runs.
+    Past the deadline the remaining stages are skipped and the best code so far is
+    returned with ``deadline_exceeded``. ``emit(type, data)``, when given, receives plan
+    events and generated text as they happen.
+    """
     assert BACKEND is not None, "Backend not initialized"
+    meter = meter or metrics.RunMetrics()
+    deadline = Deadline(req.deadline, cancel)
+    # a cascade escalates per run, so each run gets its own tier state
+    cascade = BACKEND.start_run() if isinstance(BACKEND, CascadeBackend) else None
+    backend = metrics.MeteredBackend(cascade or BACKEND, meter)
+    if emit is not None:
+        backend = _StreamingBackend(backend, emit)
     logs: list[str] = []
     plan: list[dict] = []
 
     def add_plan(tag: str, data: dict | None = None):
         evt = {"tag": tag}; evt.update(data or {})
         plan.append(evt)
+        meter.event(tag, data)
+        if emit is not None:
+            emit("plan", evt)
+
+    def check_cancel():
+        if cancel is not None and cancel.is_set():
+            raise JobCancelled()
+
+    def escalate(res: dict, stage: str) -> bool:
+        switch = cascade.observe(res, stage) if cascade is not None else None
+        if switch:
+            add_plan("cascade:switch", switch)
+        return bool(switch)
+
+    deadline_hit: list[str] = []
+
+    def out_of_time(stage: str) -> bool:
+        check_cancel()
+        if not deadline.expired():
+            return False
+        if not deadline_hit:
+            deadline_hit.append(stage)
+            add_plan("deadline:exceeded", {"stage": stage, "deadline": req.deadline})
+        return True
+
+    sandbox_runs = {"lookups": 0, "hits": 0}
+    preamble = req.preamble.strip("\n") + "\n\n\n" if req.preamble and req.preamble.strip() else ""
+
+    def doctest_run(src: str) -> dict:
+        t0 = time.perf_counter()
+        res = run_doctest(preamble + src, timeout_s=req.timeout, cache=SANDBOX_CACHE, coverage=req.coverage_repair,
+                          deadline=deadline)
+        if preamble and res.get("coverage"):
+            res = dict(res, coverage=_shift_coverage(res["coverage"], preamble.count("\n")))
+        meter.sandbox(time.perf_counter() - t0, res)
+        sandbox_runs["lookups"] += 1
+        sandbox_runs["hits"] += int(bool(res.get("cached")))
+        return res
+
+    def perf_gate(src: str, res: dict) -> dict:
+        if not req.perf_check or not res.get("ok"):
+            return res
+        t0 = time.perf_counter()
+        perf = check_performance(preamble + src, fn_name, _first_doctest_call(doctests, fn_name), signature,
+                                 budget=req.perf_budget, timeout_s=req.timeout, deadline=deadline)
+        meter.timed("perf", time.perf_counter() - t0)
+        add_plan("perf:check", {"ok": perf["ok"], "complexity": perf.get("complexity"), "exponent": perf.get("exponent"),
+                                "skipped": perf.get("skipped")})
+        if perf["ok"]:
+            return res
+        return dict(res, ok=False, traceback=perf["summary"], perf=perf, perf_failed=True)
 
     fn_name = req.fn or "solution"
     # signature/doctests
@@ -82,8 +373,9 @@ def run(req: RunRequest):
     elif not req.no_design:
         add_plan("design:start", {"fn": fn_name})
         signature, doctests = _design_signature_and_doctests_backend(
-            BACKEND, req.task, fn_name, max_new_tokens=200, decode=req.decode
+            backend, req.task, fn_name, max_new_tokens=200, decode=req.decode, deadline=deadline
         )
+        out_of_time("design")
         add_plan("design:done", {"signature": signature, "doctests_present": bool(doctests)})
     else:
         signature = f"def {fn_name}(x)"
@@ -93,9 +385,12 @@ def run(req: RunRequest):
     add_plan("generate:start", {"candidates": int(req.candidates), "decode": req.decode})
     code = None
     first_result = None
+    slow_pass = None
     # generation loop
     for k in range(max(1, int(req.candidates))):
-        gen_body = _complete_backend(BACKEND, prefix, max_new_tokens=req.max_new_tokens, decode=req.decode)
+        if out_of_time("generate"):
+            break
+        gen_body = _complete_backend(backend, preamble + prefix, max_new_tokens=req.max_new_tokens, decode=req.decode, deadline=deadline)
         cand = sanitize_to_function(prefix + gen_body, fn_name)
         if is_bad(cand):
             cand = extract_function(prefix + "    return False\n", fn_name)
@@ -103,47 +398,75 @@ def run(req: RunRequest):
             code = cand
             result = {"ok": True}
             break
-        res = run_doctest(cand, timeout_s=req.timeout)
+        res = perf_gate(cand, doctest_run(cand))
+        check_cancel()
         if first_result is None:
             first_result = (cand, res)
+        if res.get("perf_failed"):
+            slow_pass = slow_pass or (cand, res)
         if res.get("ok"):
             code, result = cand, res
             break
     if code is None:
-        code, result = first_result
+        code, result = slow_pass or first_result or ("", {"ok": False, "traceback": "DEADLINE"})
     add_plan("generate:done", {"passed_doctest": bool(result and result.get("ok"))})
+    if not req.no_test:
+        escalate(result, "generate")
 
     # simple repair loop (optional coverage-guided)
     i = 0
-    while not req.no_test and not result.get("ok") and i < req.iters:
+    while not req.no_test and not result.get("ok") and i < req.iters and not out_of_time("repair"):
         i += 1
         add_plan("repair:start", {"iter": i})
-        from src.error_analysis.error_parser import summarize_trace
-        err = summarize_trace(result.get("traceback", ""))
-        if req.coverage_repair:
-            try:
-                from pathlib import Path
-                tmp = Path("outputs/.tools"); tmp.mkdir(parents=True, exist_ok=True)
-                covp = tmp / f"{fn_name}_cov.py"
-                covp.write_text(code, encoding="utf-8")
-                from src.tools.adapters import run_coverage_doctest
-                cov = run_coverage_doctest(covp)
-                if cov and cov.get("stdout"):
-                    err += "\n\n[Coverage]\n" + cov.get("stdout", "")
-            except Exception:
-                pass
-        from src.codegen.prompts import REPAIR_PROMPT
-        prompt = REPAIR_PROMPT.format(task=req.task, prev_code=extract_function(code, fn_name), error=err)
-        fix = _complete_backend(BACKEND, prompt, max_new_tokens=req.max_new_tokens, decode=req.decode)
+        from src.codegen.context import build_repair_prompt
+        prompt, ctx = build_repair_prompt(backend, req.task, preamble + extract_function(code, fn_name),
+                                          result.get("traceback") or result.get("stderr", ""),
+                                          coverage=result.get("coverage") if req.coverage_repair else None,
+                                          code=code, budget=req.repair_budget)
+        add_plan("repair:context", dict(ctx, iter=i))
+        fix = _complete_backend(backend, prompt, max_new_tokens=req.max_new_tokens, decode=req.decode, deadline=deadline)
+        if out_of_time("repair"):
+            break  # the fix was cut off mid-generation; keep the previous candidate
+        prev_code = code
         code = sanitize_to_function(fix, fn_name)
         if is_bad(code):
             code = extract_function(prefix + "    return False\n", fn_name)
-        result = run_doctest(code, timeout_s=req.timeout)
+        new_result = perf_gate(code, doctest_run(code))
+        if new_result.get("deadline_exceeded") and not new_result.get("ok"):
+            out_of_time("repair")
+            code = prev_code
+            break
+        result = new_result
+        if result.get("perf_failed"):
+            slow_pass = (code, result)
+        if result.get("cached"):
+            add_plan("repair:duplicate", {"iter": i})
         add_plan("repair:done", {"iter": i, "ok": bool(result.get("ok"))})
+        if not result.get("ok") and req.decode == "greedy" and normalize_code(code) == normalize_code(prev_code):
+            add_plan("repair:stuck", {"iter": i})
+            if not escalate(result, "stuck"):
+                break
+        elif not result.get("ok"):
+            escalate(result, "repair")
+
+    if SANDBOX_CACHE is not None and sandbox_runs["lookups"]:
+        add_plan("sandbox:cache", dict(sandbox_runs, duplicate_rate=round(sandbox_runs["hits"] / sandbox_runs["lookups"], 3)))
+
+    if not req.no_test and not result.get("ok") and slow_pass:
+        code, result = slow_pass[0], dict(slow_pass[1], ok=True)
+        add_plan("perf:budget_exceeded", {"complexity": result["perf"].get("complexity"), "budget": req.perf_budget})
+    if cascade is not None:
+        add_plan("cascade:done", cascade.finish(bool(result and result.get("ok"))))
 
-    final_code = code or ""
+    if not code:
+        # the deadline passed before any candidate was generated
+        code = signature.rstrip() + ":\n    \"\"\"" + req.task.strip() + "\"\"\"\n    pass\n"
+    final_code = code
     if req.add_imports and not req.standalone:
         final_code = _add_imports_only(final_code)
     if req.standalone:
         final_code = _to_standalone(final_code, fn_name, req.task, doctests)
-    return RunResponse(ok=bool(result and result.get("ok")), code=final_code, plan=plan, logs=logs)
+    if preamble:
+        final_code = preamble + final_code
+    return RunResponse(ok=bool(result and result.get("ok")), code=final_code, plan=plan, logs=logs,
+                       deadline_exceeded=bool(deadline_hit))
@@ -5,6 +5,10 @@ from typing import Protocol
 class LLMBackend(Protocol):
     name: str
 
-    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy") -> str:
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
+        """``deadline`` (``src.debugging_loop.deadline.Deadline``): stop early, returning partial text, once it expires.
+
+        ``on_text``: called with each new piece of decoded text while generating (streaming).
+        """
         ...
 
@@ -0,0 +1,188 @@
+"""Cost-aware model cascade: start each run on the cheapest model, escalate when it fails.
+
+``select_backend("cascade:santacoder,codellama-7b")`` builds a ``CascadeBackend``
+over tiers ordered cheapest first; each tier is any model spec ``select_backend``
+accepts and is loaded on first use (``CODEGEN_CASCADE_PRELOAD=1`` loads all up front).
+
+The pipeline calls ``start_run()`` per task and uses the returned ``CascadeRun`` as
+its backend. It reports every failed doctest result with ``observe``, which moves
+the run to the next tier when a rule fires:
+
+- ``after``: the tier has used up its failed repairs (``CODEGEN_CASCADE_AFTER``,
+  default 2; per tier with ``spec@N``, e.g. ``cascade:santacoder@1,codellama-7b``)
+- ``error``: the failure matches an escalating error (``CODEGEN_CASCADE_ON``,
+  comma-separated substrings of the traceback; default ``SyntaxError,IndentationError``)
+- ``stuck``: greedy repair produced the same candidate again
+
+``--iters`` stays the total repair budget across tiers. ``finish`` records which tier
+solved the task; ``stats()`` has per-tier solve counts and mean run latency, so the
+average latency can be read against task difficulty.
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+DEFAULT_ON = "SyntaxError,IndentationError"
+
+
+def parse_tiers(raw: str, default_after: int) -> List[tuple[str, int]]:
+    """``"a@1,b"`` -> ``[("a", 1), ("b", default_after)]``."""
+    tiers = []
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        spec, sep, n = part.rpartition("@")
+        if sep and n.isdigit():
+            tiers.append((spec, int(n)))
+        else:
+            tiers.append((part, default_after))
+    return tiers
+
+
+class CascadeBackend:
+    name = "cascade"
+
+    def __init__(self, tiers: List[tuple[str, int]], escalate_on: List[str] | None = None,
+                 loader: Callable[[str], Any] | None = None, preload: bool | None = None):
+        if not tiers:
+            raise ValueError("cascade needs at least one model")
+        self.tiers = tiers
+        self.escalate_on = escalate_on if escalate_on is not None else [
+            s.strip() for s in os.getenv("CODEGEN_CASCADE_ON", DEFAULT_ON).split(",") if s.strip()]
+        if loader is None:
+            from src.backends.select import select_backend as loader
+        self._loader = loader
+        self._backends: List[Any] = [None] * len(tiers)
+        self._load_locks = [threading.Lock() for _ in tiers]
+        self._lock = threading.Lock()
+        self._stats = [{"model": spec, "runs": 0, "solved": 0, "solved_seconds": 0.0, "escalations": 0,
+                        "completions": 0, "model_seconds": 0.0} for spec, _ in tiers]
+        self._unsolved = {"runs": 0, "seconds": 0.0}
+        if preload if preload is not None else os.getenv("CODEGEN_CASCADE_PRELOAD", "0") == "1":
+            for i in range(len(tiers)):
+                self.backend(i)
+
+    @classmethod
+    def from_spec(cls, raw: str, **kwargs) -> "CascadeBackend":
+        after = int(os.getenv("CODEGEN_CASCADE_AFTER", "2"))
+        return cls(parse_tiers(raw, after), **kwargs)
+
+    def backend(self, tier: int):
+        """The tier's backend, loading it on first use."""
+        if self._backends[tier] is None:
+            with self._load_locks[tier]:
+                if self._backends[tier] is None:
+                    self._backends[tier] = self._loader(self.tiers[tier][0])
+        return self._backends[tier]
+
+    def start_run(self) -> "CascadeRun":
+        return CascadeRun(self)
+
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
+        """Outside a run (no escalation state) the first tier answers."""
+        return self.backend(0).complete(prompt, max_new_tokens=max_new_tokens, decode=decode, deadline=deadline,
+                                        on_text=on_text)
+
+    def _record(self, tier: int, **inc) -> None:
+        with self._lock:
+            for k, v in inc.items():
+                self._stats[tier][k] += v
+
+    def _finish(self, tier: int, ok: bool, seconds: float) -> None:
+        with self._lock:
+            if ok:
+                self._stats[tier]["solved"] += 1
+                self._stats[tier]["solved_seconds"] += seconds
+            else:
+                self._unsolved["runs"] += 1
+                self._unsolved["seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        """Per tier: runs that reached it, tasks it solved and their mean latency, escalations out of it."""
+        with self._lock:
+            tiers = []
+            for i, s in enumerate(self._stats):
+                row = {k: v for k, v in s.items() if k != "solved_seconds"}
+                row.update(tier=i, loaded=self._backends[i] is not None,
+                           mean_solved_seconds=round(s["solved_seconds"] / s["solved"], 3) if s["solved"] else None,
+                           model_seconds=round(s["model_seconds"], 3))
+                tiers.append(row)
+            unsolved = self._unsolved["runs"]
+            return {"tiers": tiers, "unsolved": unsolved,
+                    "mean_unsolved_seconds": round(self._unsolved["seconds"] / unsolved, 3) if unsolved else None}
+
+
+class CascadeRun:
+    """One task's view of the cascade: the current tier and its failed-repair count."""
+
+    def __init__(self, cascade: CascadeBackend):
+        self.cascade = cascade
+        self.tier = 0
+        self.failures = 0
+        self.switches: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter()
+        self._last = None
+        cascade._record(0, runs=1)
+
+    @property
+    def name(self) -> str:
+        return f"cascade[{self.cascade.tiers[self.tier][0]}]"
+
+    @property
+    def model(self) -> str:
+        return self.cascade.tiers[self.tier][0]
+
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
+        backend = self.cascade.backend(self.tier)
+        self._last = backend
+        t0 = time.perf_counter()
+        text = backend.complete(prompt, max_new_tokens=max_new_tokens, decode=decode, deadline=deadline, on_text=on_text)
+        self.cascade._record(self.tier, completions=1, model_seconds=time.perf_counter() - t0)
+        return text
+
+    def last_usage(self) -> dict | None:
+        fn = getattr(self._last, "last_usage", None)
+        return fn() if callable(fn) else None
+
+    @property
+    def count_tokens(self):
+        """The current tier's tokenizer count, or None when it has none (callers then estimate)."""
+        return getattr(self.cascade.backend(self.tier), "count_tokens", None)
+
+    def observe(self, result: Dict[str, Any], stage: str = "repair") -> Dict[str, Any] | None:
+        """Feed a test result (``stage``: generate/repair/stuck); returns the switch when escalating."""
+        if result.get("ok") or self.tier + 1 >= len(self.cascade.tiers):
+            return None
+        reason = None
+        if stage == "stuck":
+            reason = "stuck"
+        # import-time errors (e.g. a SyntaxError) come back in stderr with an empty traceback
+        tb = result.get("traceback") or result.get("stderr") or ""
+        matched = next((p for p in self.cascade.escalate_on if p in tb), None)
+        if reason is None and matched:
+            reason = f"error:{matched}"
+        if stage in ("repair", "stuck"):
+            self.failures += 1
+        if reason is None and self.failures >= self.cascade.tiers[self.tier][1]:
+            reason = "after"
+        if reason is None:
+            return None
+        switch = {"from": self.model, "to": self.cascade.tiers[self.tier + 1][0], "tier": self.tier + 1,
+                  "reason": reason, "failures": self.failures, "stage": stage}
+        self.cascade._record(self.tier, escalations=1)
+        self.tier += 1
+        self.failures = 0
+        self.cascade._record(self.tier, runs=1)
+        self.switches.append(switch)
+        return switch
+
+    def finish(self, ok: bool) -> Dict[str, Any]:
+        """Record the outcome; returns the run summary for a ``cascade:done`` plan event."""
+        seconds = time.perf_counter() - self._t0
+        self.cascade._finish(self.tier, ok, seconds)
+        return {"ok": ok, "tier": self.tier, "model": self.model, "switches": len(self.switches),
+                "seconds": round(seconds, 3)}
@@ -1,9 +1,11 @@
 from __future__ import annotations
 import os
+import threading
+import time
 from typing import Optional
 import os, glob
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, TextStreamer
 from src.security.guard import assert_read_allowed
 
 
@@ -22,6 +24,30 @@ def _resolve_model_dir(p: str) -> str:
     return os.path.dirname(hits[0])
 
 
+class _DeadlineCriteria(StoppingCriteria):
+    """Stops ``generate`` between tokens once the run's deadline expires (or the run is cancelled)."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.hit = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.hit = self.hit or self.deadline.expired()
+        return torch.full((input_ids.shape[0],), self.hit, dtype=torch.bool, device=input_ids.device)
+
+
+class _CallbackStreamer(TextStreamer):
+    """Hands decoded text to a callback (word by word) instead of printing it."""
+
+    def __init__(self, tok, on_text):
+        super().__init__(tok, skip_prompt=True, skip_special_tokens=True)
+        self.on_text = on_text
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.on_text(text)
+
+
 class HFBackend:
     name = "hf-local"
 
@@ -41,8 +67,17 @@ class HFBackend:
             tok.pad_token_id = tok.eos_token_id
         self.tok = tok
         self.model = model
+        self._usage = threading.local()
+
+    def count_tokens(self, text: str) -> int:
+        """Prompt tokens ``text`` costs with this model's tokenizer (used to budget prompts)."""
+        return len(self.tok(text, add_special_tokens=False)["input_ids"])
+
+    def last_usage(self) -> dict | None:
+        """Token counts and wall time of this thread's last ``complete`` call."""
+        return getattr(self._usage, "value", None)
 
-    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy") -> str:
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
         tok = self.tok; model = self.model
         enc = tok(prompt, return_tensors="pt", return_attention_mask=True, add_special_tokens=True)
         enc = {k: v.to(model.device) for k, v in enc.items()}
@@ -51,8 +86,16 @@ class HFBackend:
             gen_kwargs.update(dict(do_sample=True, temperature=0.2, top_p=0.95))
         else:
             gen_kwargs.update(dict(do_sample=False))
+        stop = _DeadlineCriteria(deadline) if deadline is not None else None
+        if stop is not None:
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList([stop])
+        if on_text is not None:
+            gen_kwargs["streamer"] = _CallbackStreamer(tok, on_text)
+        t0 = time.perf_counter()
         with torch.no_grad():
             out = model.generate(**enc, **gen_kwargs)
         gen = out[0, enc["input_ids"].shape[1]:]
         text = tok.decode(gen, skip_special_tokens=True)
+        self._usage.value = {"prompt_tokens": int(enc["input_ids"].shape[1]), "completion_tokens": int(gen.shape[0]),
+                             "seconds": time.perf_counter() - t0, "deadline_exceeded": bool(stop and stop.hit)}
         return text
@@ -12,7 +12,7 @@ class OpenAIBackend:
             raise RuntimeError("OPENAI_API_KEY is not set. Set it to enable OpenAI backend.")
         # Network use is disabled in some environments; this backend is a stub here.
 
-    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy") -> str:
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
         raise RuntimeError("OpenAI backend not enabled in this environment. Implement API call and enable network to use it.")
 
 
@@ -25,6 +25,6 @@ class GeminiBackend:
         if not key:
             raise RuntimeError("GOOGLE_API_KEY (or GEMINI_API_KEY) is not set. Set it to enable Gemini backend.")
 
-    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy") -> str:
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
         raise RuntimeError("Gemini backend not enabled in this environment. Implement API call and enable network to use it.")
 
@@ -0,0 +1,153 @@
+"""Record/replay backend: model-free, reproducible runs of the rest of the pipeline.
+
+Record mode wraps any backend and appends one JSON line per ``complete`` call
+(prompt, max_new_tokens, decode, completion, wall time and token usage) to a
+log. Replay mode (``select_backend("replay:<file>")``) serves those completions
+back without loading a model, so sanitization, import inference, the sandbox,
+tools, memory and the worker scheduler can be benchmarked on a CPU-only box.
+
+Lookups are by (prompt, max_new_tokens, decode), falling back to the prompt
+alone. A prompt recorded several times (sampling, repeated runs) is served in
+recorded order, cycling. ``CODEGEN_REPLAY_LATENCY`` simulates generation time:
+unset/0 returns at once, ``recorded`` sleeps for the recorded time, and a number
+scales it (``0.5`` = twice as fast). ``CODEGEN_REPLAY_MISS=empty`` returns ""
+for unrecorded prompts instead of raising.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+from src.security.guard import assert_read_allowed, assert_write_allowed
+
+
+def prompt_key(prompt: str, max_new_tokens: int | None = None, decode: str | None = None) -> str:
+    parts = [prompt] if max_new_tokens is None else [prompt, int(max_new_tokens), decode or "greedy"]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _latency_scale() -> float:
+    raw = os.getenv("CODEGEN_REPLAY_LATENCY", "").strip().lower()
+    if raw in ("", "0", "off", "none"):
+        return 0.0
+    if raw == "recorded":
+        return 1.0
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        return 0.0
+
+
+class RecordingBackend:
+    """Wraps ``backend`` and appends every prompt/completion pair to ``path``."""
+
+    def __init__(self, backend, path: str | Path):
+        self.backend = backend
+        self.path = Path(path)
+        self.name = f"record({getattr(backend, 'name', 'backend')})"
+        assert_write_allowed(self.path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
+        t0 = time.perf_counter()
+        text = self.backend.complete(prompt, max_new_tokens=max_new_tokens, decode=decode, deadline=deadline, on_text=on_text)
+        seconds = time.perf_counter() - t0
+        usage_fn = getattr(self.backend, "last_usage", None)
+        usage = usage_fn() if callable(usage_fn) else None
+        if usage and usage.get("deadline_exceeded"):
+            # a cut-off completion would be replayed as if it were the model's full answer
+            return text
+        rec = {"key": prompt_key(prompt, max_new_tokens, decode), "prompt": prompt,
+               "max_new_tokens": max_new_tokens, "decode": decode, "completion": text,
+               "seconds": round(seconds, 4), "usage": usage, "backend": getattr(self.backend, "name", None)}
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+        return text
+
+
+class ReplayBackend:
+    name = "replay"
+
+    def __init__(self, path: str | Path, latency: float | None = None, strict: bool | None = None):
+        self.path = Path(path)
+        assert_read_allowed(self.path)
+        if not self.path.is_file():
+            raise FileNotFoundError(f"No replay log at: {self.path}")
+        self.latency = _latency_scale() if latency is None else latency
+        self.strict = (os.getenv("CODEGEN_REPLAY_MISS", "error").strip().lower() != "empty") if strict is None else strict
+        self._by_key: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_prompt: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._usage = threading.local()
+        self.hits = self.misses = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of an interrupted recording
+                if not isinstance(rec, dict) or "prompt" not in rec or "completion" not in rec:
+                    continue
+                key = rec.get("key") or prompt_key(rec["prompt"], rec.get("max_new_tokens", 160), rec.get("decode"))
+                self._by_key.setdefault(key, []).append(rec)
+                self._by_prompt.setdefault(prompt_key(rec["prompt"]), []).append(rec)
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._by_key.values())
+
+    def last_usage(self) -> dict | None:
+        """Recorded token counts of this thread's last ``complete`` call, with the replayed wall time."""
+        return getattr(self._usage, "value", None)
+
+    def _next(self, prompt: str, max_new_tokens: int, decode: str) -> Dict[str, Any] | None:
+        for index, key in ((self._by_key, prompt_key(prompt, max_new_tokens, decode)), (self._by_prompt, prompt_key(prompt))):
+            recs = index.get(key)
+            if recs:
+                with self._lock:
+                    i = self._served.get(key, 0)
+                    self._served[key] = i + 1
+                    self.hits += 1
+                return recs[i % len(recs)]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def complete(self, prompt: str, max_new_tokens: int = 160, decode: str = "greedy", deadline=None, on_text=None) -> str:
+        t0 = time.perf_counter()
+        rec = self._next(prompt, max_new_tokens, decode)
+        if rec is None:
+            if self.strict:
+                raise RuntimeError(f"Prompt not in replay log {self.path} (key {prompt_key(prompt, max_new_tokens, decode)[:12]}). "
+                                   "Re-record with CODEGEN_RECORD_TO, or set CODEGEN_REPLAY_MISS=empty.")
+            self._usage.value = {"prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0, "deadline_exceeded": False}
+            return ""
+        text, cut = rec["completion"], False
+        delay = float(rec.get("seconds") or 0.0) * self.latency
+        if delay > 0:
+            end = time.monotonic() + delay
+            while True:
+                left = end - time.monotonic()
+                if left <= 0:
+                    break
+                if deadline is not None and deadline.expired():
+                    text, cut = "", True
+                    break
+                time.sleep(min(left, 0.05) if deadline is not None else left)
+        usage = dict(rec.get("usage") or {})
+        usage.update(seconds=time.perf_counter() - t0, deadline_exceeded=cut)
+        if cut:
+            usage["completion_tokens"] = 0
+        self._usage.value = usage
+        if on_text is not None and text:
+            on_text(text)
+        return text
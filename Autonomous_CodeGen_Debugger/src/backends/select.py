@@ -1,24 +1,44 @@
 from __future__ import annotations
 import os
 from pathlib import Path
-from src.backends.hf import HFBackend
 from src.backends.openai_stub import OpenAIBackend, GeminiBackend
+from src.backends.replay import ReplayBackend, RecordingBackend
+from src.backends.snapshot import check_before_load
+from src.backends.cascade import CascadeBackend
 
 
 def select_backend(model_spec: str):
+    if model_spec.lower().startswith("cascade:"):
+        # each tier goes through select_backend itself (so recording applies per tier)
+        return CascadeBackend.from_spec(model_spec.split(":", 1)[1])
+    backend = _select(model_spec)
+    # Record every completion for later replay (model-free benchmarks / CI)
+    record_to = os.getenv("CODEGEN_RECORD_TO", "").strip()
+    if record_to and not isinstance(backend, ReplayBackend):
+        backend = RecordingBackend(backend, record_to)
+    return backend
+
+
+def _select(model_spec: str):
+    # torch/transformers are only imported when a local model is actually loaded
+    lower = model_spec.lower()
+    if lower.startswith("replay:"):
+        return ReplayBackend(model_spec.split(":", 1)[1])
     # Path-based local HF model
     p = Path(model_spec)
     if p.exists():
         # Resolve to directory with config.json
         if p.is_file():
             p = p.parent
+        # Refuse snapshots that failed verification (CODEGEN_VERIFY_SNAPSHOT)
+        check_before_load(p)
+        from src.backends.hf import HFBackend
         return HFBackend(str(p))
     # API model aliases
-    lower = model_spec.lower()
     if lower.startswith("openai:") or lower.startswith("gpt-"):
         return OpenAIBackend(model_spec.split(":", 1)[-1])
     if lower.startswith("gemini:") or lower.startswith("google:"):
         return GeminiBackend(model_spec.split(":", 1)[-1])
     # Default to local HF attempt
+    from src.backends.hf import HFBackend
     return HFBackend(model_spec)
-
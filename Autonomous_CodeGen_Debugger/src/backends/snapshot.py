@@ -0,0 +1,298 @@
+"""Integrity checks for local HF model snapshots, before minutes are spent loading them.
+
+For each snapshot (a directory with ``config.json``) the weight shards are taken from
+its index (``*.safetensors.index.json`` / ``pytorch_model.bin.index.json``), or the
+shard files themselves when unsharded, and checked:
+
+- layout: every shard named in the index exists; a safetensors shard's header parses
+  and its size equals header + the end of the last tensor (catches truncated
+  downloads); the index's ``metadata.total_size`` matches the tensors' bytes
+- digest: SHA-256 of each shard, compared with the HF cache blob it links to (blobs of
+  LFS files are named by their SHA-256)
+
+Digests are cached in ``outputs/.model_digests.json`` keyed by (real path, size,
+mtime), so re-checking an unchanged snapshot does no hashing. The same file keeps
+each snapshot's last verdict, which ``select_backend`` consults
+(``CODEGEN_VERIFY_SNAPSHOT``):
+
+- ``known`` (default): refuse a snapshot whose last verification failed and whose files
+  have not changed since (same listing, index and shard stamps, so a missing shard that
+  reappears clears it); costs a directory listing and one ``stat`` per shard
+- ``layout``: also run the layout checks before loading (reads headers only)
+- ``full``: layout plus digests (instant when cached)
+- ``off``: no checks
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+from src.security.guard import PROJECT_ROOT, assert_write_allowed
+
+CACHE_FILE = PROJECT_ROOT / "outputs" / ".model_digests.json"
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+_WEIGHTS = ("*.safetensors", "pytorch_model*.bin", "model*.bin")
+
+
+class SnapshotError(RuntimeError):
+    pass
+
+
+# ------------------------------ discovery ----------------------------------------
+
+def find_snapshots(root: str | Path) -> List[Path]:
+    """Directories with a ``config.json`` at or under ``root`` (HF cache layouts included)."""
+    root = Path(root)
+    if (root / "config.json").is_file():
+        return [root]
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in ("blobs", ".git") and not d.startswith("."))
+        if "config.json" in filenames:
+            found.append(Path(dirpath))
+            dirnames[:] = []
+    return found
+
+
+def index_files(snapshot: Path) -> List[Path]:
+    return sorted(snapshot.glob("*.safetensors.index.json")) or sorted(snapshot.glob("pytorch_model*.bin.index.json"))
+
+
+def expected_shards(snapshot: Path) -> List[str]:
+    """Names of the weight files a snapshot should have: those in its index, else those present."""
+    indexes = index_files(snapshot)
+    if indexes:
+        try:
+            index = json.loads(indexes[0].read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+        return sorted(set(index.get("weight_map", {}).values()))
+    names: List[str] = []
+    for pattern in _WEIGHTS:
+        names += [p.name for p in sorted(snapshot.glob(pattern)) if p.name not in names]
+    return names
+
+
+def shard_files(snapshot: Path) -> tuple[List[Path], List[str], Dict[str, Any]]:
+    """(weight shards, errors, index metadata) for one snapshot."""
+    errors: List[str] = []
+    indexes = index_files(snapshot)
+    if indexes:
+        try:
+            index = json.loads(indexes[0].read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            return [], [f"{indexes[0].name}: unreadable index ({e})"], {}
+        names = sorted(set(index.get("weight_map", {}).values()))
+        shards = [snapshot / n for n in names]
+        errors += [f"{p.name}: listed in {indexes[0].name} but missing" for p in shards if not p.exists()]
+        return [p for p in shards if p.exists()], errors, index.get("metadata") or {}
+    shards: List[Path] = []
+    for pattern in _WEIGHTS:
+        shards += [p for p in sorted(snapshot.glob(pattern)) if p not in shards]
+    if not shards:
+        errors.append("no weight files")
+    return shards, errors, {}
+
+
+# ------------------------------ checks -------------------------------------------
+
+def safetensors_layout(path: Path) -> tuple[int | None, str | None]:
+    """(tensor bytes, error) from a safetensors header, without reading the tensors."""
+    try:
+        size = path.stat().st_size
+        with open(path, "rb") as f:
+            head = f.read(8)
+            if len(head) < 8:
+                return None, "truncated (no header)"
+            (n,) = struct.unpack("<Q", head)
+            if n > size - 8:
+                return None, f"truncated (header of {n} bytes, file of {size})"
+            header = json.loads(f.read(n))
+    except (OSError, ValueError) as e:
+        return None, f"unreadable header ({e})"
+    ends = [t["data_offsets"][1] for k, t in header.items() if k != "__metadata__"]
+    data = max(ends, default=0)
+    if 8 + n + data != size:
+        return data, f"size {size} != {8 + n + data} expected from its header (truncated or padded)"
+    return data, None
+
+
+def expected_digest(path: Path) -> str | None:
+    """SHA-256 implied by the HF cache: the name of the blob an LFS file links to."""
+    try:
+        if path.is_symlink():
+            name = Path(os.path.realpath(path)).name
+            return name if _SHA256.fullmatch(name) else None
+    except OSError:
+        pass
+    return None
+
+
+def sha256_file(path: Path) -> str:
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        h = hashlib.sha256()
+        for chunk in iter(lambda: f.read(8 << 20), b""):
+            h.update(chunk)
+        return h.hexdigest()
+
+
+# ------------------------------ cache --------------------------------------------
+
+class DigestCache:
+    """Shard digests keyed by (real path, size, mtime_ns) plus each snapshot's last verdict."""
+
+    def __init__(self, path: Path = CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        self.files: Dict[str, Dict[str, Any]] = data.get("files", {})
+        self.snapshots: Dict[str, Dict[str, Any]] = data.get("snapshots", {})
+
+    @staticmethod
+    def stamp(path: Path) -> Dict[str, Any]:
+        st = os.stat(path)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def digest(self, path: Path) -> tuple[str, bool]:
+        """(sha256, from cache)."""
+        real = os.path.realpath(path)
+        stamp = self.stamp(Path(real))
+        with self._lock:
+            hit = self.files.get(real)
+        if hit and hit.get("size") == stamp["size"] and hit.get("mtime_ns") == stamp["mtime_ns"]:
+            return hit["sha256"], True
+        digest = sha256_file(Path(real))
+        with self._lock:
+            self.files[real] = dict(stamp, sha256=digest)
+        return digest, False
+
+    def fingerprint(self, snapshot: Path) -> Dict[str, Any]:
+        """Directory listing, expected shard names, and the stamps of the index and every expected
+        shard (``None`` while missing), so a file appearing, vanishing or changing is noticed."""
+        try:
+            listing = sorted(os.listdir(snapshot))
+        except OSError:
+            listing = []
+        expected = expected_shards(snapshot)
+        stamps = []
+        for p in index_files(snapshot) + [snapshot / n for n in expected]:
+            try:
+                s = self.stamp(p)
+                stamps.append([p.name, s["size"], s["mtime_ns"]])
+            except OSError:
+                stamps.append([p.name, None, None])
+        return {"listing": listing, "expected": expected, "files": stamps}
+
+    def record(self, snapshot: Path, report: Dict[str, Any]) -> None:
+        fingerprint = self.fingerprint(snapshot)
+        with self._lock:
+            self.snapshots[str(snapshot.resolve())] = {
+                "ok": report["ok"], "level": report["level"], "errors": report["errors"][:20],
+                "checked": time.time(), "fingerprint": fingerprint,
+            }
+
+    def verdict(self, snapshot: Path) -> Dict[str, Any] | None:
+        """The last verdict, if the snapshot's files are unchanged since."""
+        rec = self.snapshots.get(str(snapshot.resolve()))
+        if rec is None:
+            return None
+        return rec if self.fingerprint(snapshot) == rec.get("fingerprint") else None
+
+    def save(self) -> None:
+        assert_write_allowed(self.path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(f".tmp{os.getpid()}")
+        with self._lock:
+            tmp.write_text(json.dumps({"files": self.files, "snapshots": self.snapshots}), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+# ------------------------------ verification -------------------------------------
+
+def _check_file(path: Path, level: str, cache: DigestCache) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"file": path.name, "size": None, "ok": True, "error": None}
+    try:
+        out["size"] = path.stat().st_size
+    except OSError as e:
+        return dict(out, ok=False, error=f"unreadable ({e})")
+    if path.suffix == ".safetensors":
+        out["tensor_bytes"], err = safetensors_layout(path)
+        if err:
+            return dict(out, ok=False, error=err)
+    if level == "full":
+        expected = expected_digest(path)
+        try:
+            out["sha256"], out["cached"] = cache.digest(path)
+        except OSError as e:
+            return dict(out, ok=False, error=f"unreadable ({e})")
+        out["expected"] = expected
+        if expected and out["sha256"] != expected:
+            return dict(out, ok=False, error=f"sha256 {out['sha256'][:12]} != {expected[:12]} (corrupt blob)")
+    return out
+
+
+def verify_snapshots(snapshots: List[Path], level: str = "full", workers: int | None = None,
+                     cache: DigestCache | None = None) -> List[Dict[str, Any]]:
+    """Check many snapshots at once; every shard of every snapshot is one task in a shared pool.
+
+    ``hashlib`` releases the GIL while hashing, so threads hash shards in parallel.
+    """
+    cache = cache or DigestCache()
+    plans = []
+    for snap in snapshots:
+        shards, errors, meta = shard_files(snap)
+        plans.append((snap, shards, errors, meta))
+    workers = workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [[pool.submit(_check_file, p, level, cache) for p in shards] for _, shards, _, _ in plans]
+        reports = []
+        for (snap, shards, errors, meta), futs in zip(plans, futures):
+            t0 = time.perf_counter()
+            files = [f.result() for f in futs]
+            errors = errors + [f"{f['file']}: {f['error']}" for f in files if not f["ok"]]
+            total = meta.get("total_size")
+            tensor_bytes = [f.get("tensor_bytes") for f in files if f["file"].endswith(".safetensors")]
+            if total and tensor_bytes and None not in tensor_bytes and sum(tensor_bytes) != int(total):
+                errors.append(f"index total_size {total} != {sum(tensor_bytes)} bytes of tensors in the shards")
+            report = {"snapshot": str(snap), "ok": not errors, "level": level, "errors": errors, "files": files,
+                      "bytes": sum(f["size"] or 0 for f in files), "wait_s": round(time.perf_counter() - t0, 3)}
+            cache.record(snap, report)
+            reports.append(report)
+    try:
+        cache.save()
+    except OSError:
+        pass  # best-effort: an unwritable cache only costs re-hashing next time
+    return reports
+
+
+def check_before_load(model_dir: str | Path, mode: str | None = None) -> None:
+    """Raise ``SnapshotError`` if the snapshot(s) at ``model_dir`` are known or found to be bad."""
+    mode = (mode or os.getenv("CODEGEN_VERIFY_SNAPSHOT", "known")).strip().lower()
+    if mode in ("off", "0", "none", ""):
+        return
+    snaps = find_snapshots(model_dir)
+    if not snaps:
+        return  # nothing recognisable; let the loader report it
+    cache = DigestCache()
+    if mode == "known":
+        bad = [(s, v) for s in snaps if (v := cache.verdict(s)) is not None and not v["ok"]]
+    else:
+        reports = verify_snapshots(snaps, level="full" if mode == "full" else "layout", cache=cache)
+        bad = [(Path(r["snapshot"]), r) for r in reports if not r["ok"]]
+    if bad:
+        snap, rec = bad[0]
+        raise SnapshotError(f"Model snapshot failed verification: {snap}: " + "; ".join(rec["errors"][:3])
+                            + " (re-download it, re-run scripts/check_models.py, or set CODEGEN_VERIFY_SNAPSHOT=off)")
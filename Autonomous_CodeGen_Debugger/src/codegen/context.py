@@ -0,0 +1,200 @@
+"""Token-budgeted error context for repair prompts.
+
+``REPAIR_PROMPT`` used to receive the whole trace summary (plus, with coverage
+repair, the coverage report) whatever its size; on CPU every prompt token costs
+prefill time. ``build_repair_prompt`` parses the doctest output into facts, ranks
+them and keeps as many as fit the budget, measured with the backend's tokenizer
+(``backend.count_tokens``) or, for backends without one, a word/punctuation estimate:
+
+1. the first failing example: call, expected vs. got, or the exception line and the
+   line of the candidate that raised it
+2. how many examples failed, and the line numbers coverage never reached
+3. the other failures, one line each; failures with the same error are merged
+4. the source of the missed lines, then the raw traceback tail (non-doctest errors)
+
+Doctest chatter (``Trying:``/``Expecting:``, sandbox paths, doctest-internal frames)
+is dropped. The task and previous code are always kept, so the budget bounds only the
+error context. ``CODEGEN_REPAIR_BUDGET`` (or ``--repair-budget``) sets the budget in
+prompt tokens; 0 means unbounded (the compaction still applies).
+"""
+
+from __future__ import annotations
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+from src.codegen.prompts import REPAIR_PROMPT
+from src.error_analysis.error_parser import coverage_headline, missed_source, summarize_coverage, summarize_trace
+
+_SEP = re.compile(r"^\*{20,}\s*$", re.M)
+_WORDS = re.compile(r"\w+|[^\w\s]")
+_FRAME = re.compile(r'File "([^"]+)", line (\d+), in (\S+)')
+
+
+def default_budget() -> int:
+    try:
+        return max(0, int(os.getenv("CODEGEN_REPAIR_BUDGET", "0")))
+    except ValueError:
+        return 0
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE-like count (words and punctuation) for backends without a tokenizer."""
+    return len(_WORDS.findall(text))
+
+
+def token_counter(backend):
+    """(count function, name) using the backend tokenizer when it exposes ``count_tokens``."""
+    fn = getattr(backend, "count_tokens", None) if backend is not None else None
+    if callable(fn):
+        return fn, "tokenizer"
+    return estimate_tokens, "estimate"
+
+
+# ------------------------------- parsing ----------------------------------------
+
+def _indented(lines: List[str], start: int) -> Tuple[List[str], int]:
+    """Lines from ``start`` while they are indented (a doctest output section)."""
+    out = []
+    i = start
+    while i < len(lines) and (lines[i].startswith("    ") or not lines[i].strip()):
+        if lines[i].strip():
+            out.append(lines[i])
+        i += 1
+    return [ln[4:] if ln.startswith("    ") else ln for ln in out], i
+
+
+def parse_doctest_failures(tb: str) -> List[Dict[str, Any]]:
+    """Failures from doctest output: ``example`` plus ``expected``/``got`` or ``exception``/``where``."""
+    failures = []
+    for block in _SEP.split(tb or "")[1:]:
+        lines = block.splitlines()
+        try:
+            i = next(k for k, ln in enumerate(lines) if ln.startswith("Failed example:"))
+        except StopIteration:
+            continue
+        example, i = _indented(lines, i + 1)
+        fail: Dict[str, Any] = {"example": " ".join(s.strip() for s in example)}
+        if i < len(lines) and lines[i].startswith("Expected"):
+            expected, i = _indented(lines, i + 1) if lines[i].startswith("Expected:") else ([], i + 1)
+            fail["expected"] = "\n".join(expected) or "nothing"
+            if i < len(lines) and lines[i].startswith("Got"):
+                got, i = _indented(lines, i + 1) if lines[i].startswith("Got:") else ([], i + 1)
+                fail["got"] = "\n".join(got) or "nothing"
+        elif i < len(lines) and lines[i].startswith("Exception raised:"):
+            trace, i = _indented(lines, i + 1)
+            body = [ln for ln in trace if ln.strip() and not set(ln.strip()) <= set("~^ ")]
+            fail["exception"] = body[-1].strip() if body else "exception"
+            # innermost frame in the candidate itself (not doctest internals or the <doctest> call)
+            for k, ln in enumerate(trace):
+                m = _FRAME.search(ln)
+                if m and not m.group(1).startswith("<") and "doctest.py" not in m.group(1):
+                    src = trace[k + 1].strip() if k + 1 < len(trace) and not _FRAME.search(trace[k + 1]) else ""
+                    fail["where"] = f"line {m.group(2)} in {m.group(3)}" + (f": {src}" if src else "")
+        failures.append(fail)
+    return failures
+
+
+def _outcome(f: Dict[str, Any]) -> str:
+    if "exception" in f:
+        return f"raised {f['exception']}"
+    return f"expected {f.get('expected', '?')!s} but got {f.get('got', '?')!s}".replace("\n", " ")
+
+
+def _first_failure(f: Dict[str, Any]) -> str:
+    out = [f"First failing example: {f['example']}"]
+    if "exception" in f:
+        out.append(f"  Error: {f['exception']}")
+        if f.get("where"):
+            out.append(f"  At {f['where']}")
+    else:
+        out.append("  Expected: " + f.get("expected", "?").replace("\n", "\n            "))
+        out.append("  Got: " + f.get("got", "?").replace("\n", "\n       "))
+    return "\n".join(out)
+
+
+def error_facts(tb: str, coverage: Dict[str, Any] | None = None, code: str = "") -> List[Tuple[int, str]]:
+    """(priority, text) facts about a failed run, most useful first (lower priority = keep longer)."""
+    facts: List[Tuple[int, str]] = []
+    failures = parse_doctest_failures(tb)
+    if failures:
+        facts.append((0, _first_failure(failures[0])))
+        m = re.search(r"(\d+) passed and (\d+) failed", tb)
+        if m:
+            facts.append((1, f"{m.group(2)} of {int(m.group(1)) + int(m.group(2))} examples failed."))
+        # merge the remaining failures that share an outcome
+        merged: Dict[str, List[str]] = {}
+        first = _outcome(failures[0])
+        for f in failures[1:]:
+            merged.setdefault(_outcome(f), []).append(f["example"])
+        for outcome, examples in merged.items():
+            same = " (same error)" if outcome == first else ""
+            facts.append((2, f"Also failing: {'; '.join(examples)} -> {outcome}{same}"))
+    else:
+        summary = summarize_trace(tb)
+        body = summary.splitlines()
+        if body and body[0].endswith(":") and len(body) > 1:
+            # "Last traceback lines:" form: the last line is usually the exception
+            facts.append((0, body[-1].strip()))
+            tail = [ln for ln in body[1:-1] if "/.sandbox/" not in ln]
+            if tail:
+                facts.append((3, "Traceback tail:\n" + "\n".join(tail)))
+        else:
+            facts.append((0, summary))
+    if coverage:
+        if coverage.get("missed"):
+            facts.append((1, coverage_headline(coverage)))
+            shown = missed_source(coverage, code)
+            if shown:
+                facts.append((3, "Missed lines:\n" + "\n".join(shown)))
+        else:
+            facts.append((3, coverage_headline(coverage)))
+    return facts
+
+
+# ------------------------------- building ---------------------------------------
+
+def legacy_error(tb: str, coverage: Dict[str, Any] | None = None, code: str = "") -> str:
+    """The error block repair prompts used before compaction (for savings reports)."""
+    err = summarize_trace(tb)
+    if coverage:
+        err += "\n\n[Coverage]\n" + summarize_coverage(coverage, code)
+    return err
+
+
+def build_repair_prompt(backend, task: str, prev_code: str, tb: str, coverage: Dict[str, Any] | None = None,
+                        code: str = "", budget: int | None = None) -> Tuple[str, Dict[str, Any]]:
+    """(repair prompt, stats) with the error context cut to ``budget`` prompt tokens.
+
+    ``code`` is the full candidate the coverage line numbers refer to. Stats hold the
+    prompt's token count, what the uncompacted prompt would have cost, and what was dropped.
+    """
+    budget = default_budget() if budget is None else budget
+    count, counter = token_counter(backend)
+    facts = error_facts(tb, coverage, code)
+    order = sorted(range(len(facts)), key=lambda k: (facts[k][0], k))
+
+    def render(keep: List[int]) -> str:
+        return "\n".join(facts[k][1] for k in sorted(keep))
+
+    def prompt_for(error: str) -> str:
+        return REPAIR_PROMPT.format(task=task, prev_code=prev_code, error=error)
+
+    keep = list(order)
+    if budget:
+        base = count(prompt_for(""))
+        used, keep = base, []
+        for k in order:
+            cost = count(facts[k][1]) + 1
+            if used + cost <= budget or not keep:  # the first failure is always kept
+                keep.append(k)
+                used += cost
+        # per-fact counts can differ slightly from the joined text: trim until the whole fits
+        while len(keep) > 1 and count(prompt_for(render(keep))) > budget:
+            keep.remove(max(keep, key=lambda k: (facts[k][0], k)))
+    prompt = prompt_for(render(keep))
+    tokens = count(prompt)
+    baseline = count(prompt_for(legacy_error(tb, coverage, code)))
+    stats = {"tokens": tokens, "baseline_tokens": baseline, "saved": baseline - tokens, "budget": budget,
+             "facts": len(facts), "dropped": len(facts) - len(keep), "counter": counter}
+    return prompt, stats
@@ -0,0 +1,44 @@
+"""End-to-end time budget for one debug-loop run.
+
+A ``Deadline`` is handed down to every stage: backends stop generating once it
+expires (``HFBackend`` via a stopping criterion), sandbox and perf runs clip
+their timeouts to ``remaining()`` and kill the child early, and the loop skips
+the stages that are left and returns the best code found so far.
+
+A cancel flag (anything with ``is_set()``, e.g. a worker job's) expires the
+deadline at once, so cancelling a job also interrupts in-flight generation and
+sandbox runs.
+"""
+
+from __future__ import annotations
+import time
+from typing import Any
+
+
+class Deadline:
+    def __init__(self, seconds: float | None = None, cancel: Any = None):
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.at = time.monotonic() + self.seconds if self.seconds else None
+        self.cancel = cancel
+
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def remaining(self) -> float | None:
+        """Seconds left (0 once cancelled), or None without a time limit."""
+        if self.cancelled():
+            return 0.0
+        if self.at is None:
+            return None
+        return max(0.0, self.at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.cancelled() or (self.at is not None and time.monotonic() >= self.at)
+
+    # usable wherever a cancel flag is expected
+    is_set = expired
+
+    def clip(self, timeout_s: float) -> float:
+        """``timeout_s`` shortened to the time left."""
+        left = self.remaining()
+        return timeout_s if left is None else min(timeout_s, left)
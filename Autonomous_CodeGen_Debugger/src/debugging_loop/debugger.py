@@ -1,16 +1,18 @@
 import os
 os.environ["TOKENIZERS_PARALLELISM"] = "false"  # avoid fork warnings
 
-import argparse, re
+import argparse, re, uuid
 from pathlib import Path
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
 
 from src.execution_sandbox.sandbox import run_doctest
+from src.execution_sandbox.cache import SandboxCache, normalize_code
+from src.execution_sandbox.perf import check_performance
 from src.error_analysis.error_parser import summarize_trace
-from src.codegen.prompts import REPAIR_PROMPT, DESIGN_PROMPT
-from src.codegen.generate import _resolve_model_dir, _load  # your loader
+from src.codegen.prompts import DESIGN_PROMPT
+from src.codegen.context import build_repair_prompt, default_budget
 from src.backends.select import select_backend
+from src.backends.cascade import CascadeBackend
+from src.debugging_loop.deadline import Deadline
 from src.security.guard import assert_write_allowed
 
 
@@ -26,6 +28,7 @@ def is_bad(code_text: str) -> bool:
     return any(tok in code_text for tok in FORBID) or len(code_text) > 4000
 
 def _complete(tok, model, prompt, max_new_tokens=160, decode="greedy"):
+    import torch
     enc = tok(prompt, return_tensors="pt", return_attention_mask=True, add_special_tokens=True)
     enc = {k: v.to(model.device) for k, v in enc.items()}
     gen_kwargs = dict(max_new_tokens=max_new_tokens, eos_token_id=tok.eos_token_id, pad_token_id=tok.pad_token_id)
@@ -116,14 +119,16 @@ def sanitize_to_function(text: str, fn_name: str) -> str:
 def filename_for(fn_name: str) -> str:
     return f"{fn_name}_autofixed.py"
 
-def _complete_backend(backend, prompt: str, max_new_tokens=160, decode="greedy") -> str:
-    text = backend.complete(prompt, max_new_tokens=max_new_tokens, decode=decode)
+def _complete_backend(backend, prompt: str, max_new_tokens=160, decode="greedy", deadline: Deadline | None = None) -> str:
+    kwargs = {"deadline": deadline} if deadline is not None else {}
+    text = backend.complete(prompt, max_new_tokens=max_new_tokens, decode=decode, **kwargs)
     cut = re.split(r"\n\s*\n(def |class |if __name__)", text, maxsplit=1)
     return (cut[0] if cut else text).strip()
 
-def _design_signature_and_doctests_backend(backend, task: str, fn_name: str, max_new_tokens=200, decode="greedy") -> tuple[str, str | None]:
+def _design_signature_and_doctests_backend(backend, task: str, fn_name: str, max_new_tokens=200, decode="greedy",
+                                           deadline: Deadline | None = None) -> tuple[str, str | None]:
     prompt = DESIGN_PROMPT.format(task=task, fn_name=fn_name)
-    text = _complete_backend(backend, prompt, max_new_tokens=max_new_tokens, decode=decode)
+    text = _complete_backend(backend, prompt, max_new_tokens=max_new_tokens, decode=decode, deadline=deadline)
     m = re.search(r"```\s*(.*?)```", text, re.S)
     block = m.group(1) if m else text
     sig = None
@@ -489,6 +494,7 @@ def main():
     ap.add_argument("--no-design", action="store_true", help="Skip signature/doctest design stage")
     ap.add_argument("--tools", default="", help="Comma-separated tools: ruff,mypy,bandit,coverage,pytest")
     ap.add_argument("--tools-on-each-iter", action="store_true", help="Run selected tools after each attempt (slower)")
+    ap.add_argument("--no-tool-server", action="store_true", help="Cold-start every tool run instead of keeping dmypy/bandit warm for the session")
     ap.add_argument("--early-stop-on-tools", action="store_true", help="Stop early if tools report OK (even if no tests)")
     ap.add_argument("--planner", action="store_true", help="Print planner/event log lines (PLAN:/EVENT:)")
     ap.add_argument("--save-run", action="store_true", help="Save run JSON (code + logs + results) under outputs/logs/")
@@ -497,6 +503,8 @@ def main():
     ap.add_argument("--doctests", default=None, help="Doctest lines to embed in the docstring (one string; can be multiline)")
     ap.add_argument("--no-test", action="store_true", help="Skip doctest execution and repair (generate only)")
     ap.add_argument("--coverage-repair", action="store_true", help="Use coverage report to guide repairs when tests fail")
+    ap.add_argument("--repair-budget", type=int, default=default_budget(),
+                    help="Max prompt tokens for a repair prompt; lower-priority error context is dropped to fit (0 = unbounded)")
     ap.add_argument("--no-save", action="store_true", help="Do not write output file")
     ap.add_argument("--print-only", action="store_true", help="Print final code to stdout")
     ap.add_argument("--clean-doc", action="store_true", help="Replace doctest docstring with Args/Returns")
@@ -507,6 +515,15 @@ def main():
     ap.add_argument("--standalone", action="store_true", help="Emit a runnable script with needed imports and a simple CLI main()")
     ap.add_argument("--add-imports", action="store_true", help="Augment the function with required imports (no CLI main)")
     ap.add_argument("--no-memory-hints", action="store_true", help="Disable retrieval hints in prompts")
+    ap.add_argument("--memory-mode", choices=["lexical", "semantic"], default=os.getenv("CODEGEN_MEMORY_MODE", "lexical"),
+                    help="How past cases are matched for hints: BM25 over tokens or vector similarity "
+                         "(paraphrase matching needs an HF encoder in CODEGEN_MEMORY_ENCODER; the default "
+                         "hash encoder only matches shared words and word parts)")
+    ap.add_argument("--no-sandbox-cache", action="store_true", help="Re-run doctests even for previously tested (identical) candidates")
+    ap.add_argument("--perf-check", action="store_true", help="After doctests pass, benchmark on scaled inputs and repair if growth exceeds --perf-budget")
+    ap.add_argument("--perf-budget", type=float, default=1.5, help="Max allowed time growth exponent for --perf-check (1.0 = linear, 2.0 = quadratic)")
+    ap.add_argument("--deadline", type=float, default=None,
+                    help="Wall-clock budget in seconds for the whole run; remaining stages are skipped and the best code so far is returned")
     args = ap.parse_args()
     assert args.model, "Set --model or CODEGEN_MODEL_PATH"
 
@@ -550,6 +567,10 @@ def main():
             print(f"Thinking: {msg}")
 
     backend = select_backend(args.model)
+    # A cascade tracks this task's tier; the run object is the backend for the rest of the pipeline
+    cascade = backend.start_run() if isinstance(backend, CascadeBackend) else None
+    if cascade is not None:
+        backend = cascade
 
     def vprint(*a):
         if args.verbose:
@@ -566,6 +587,29 @@ def main():
         if args.planner:
             print(f"PLAN: {tag} {data or {}}")
 
+    def escalate(res: dict, stage: str) -> bool:
+        """Move a cascade run to the next model if ``res`` trips an escalation rule."""
+        switch = cascade.observe(res, stage) if cascade is not None else None
+        if switch:
+            think(f"Escalating to {switch['to']} ({switch['reason']}).")
+            plan("cascade:switch", switch)
+        return bool(switch)
+
+    sandbox_cache = None if args.no_sandbox_cache else SandboxCache()
+
+    deadline = Deadline(args.deadline)
+    deadline_hit: list[str] = []
+
+    def out_of_time(stage: str) -> bool:
+        """True once the deadline has passed; the first stage to notice records it."""
+        if not deadline.expired():
+            return False
+        if not deadline_hit:
+            deadline_hit.append(stage)
+            plan("deadline:exceeded", {"stage": stage})
+            think(f"Deadline reached; skipping {stage} and keeping the best code so far.")
+        return True
+
     fn_name = args.fn or detect_func_name(args.task)
     # Codex-like: choose signature/doctests (explicit > design > stub)
     # Helper: doctest validation and synthesis
@@ -604,7 +648,9 @@ def main():
     elif not args.no_design:
         think("Designing signature and doctests...")
         plan("design:start", {"fn": fn_name})
-        signature, doctests = _design_signature_and_doctests_backend(backend, args.task, fn_name, max_new_tokens=200, decode=args.decode)
+        signature, doctests = _design_signature_and_doctests_backend(backend, args.task, fn_name, max_new_tokens=200,
+                                                                     decode=args.decode, deadline=deadline)
+        out_of_time("design")
         # Validate doctests; synthesize if insufficient
         if _count_pairs(doctests) < 2:
             synth = _synthesize_doctests(args.task, fn_name, signature)
@@ -623,7 +669,7 @@ def main():
     if not getattr(args, 'no_memory_hints', False):
         try:
             from src.memory.store import retrieve_hints
-            _h = retrieve_hints(args.task, top_k=1)
+            _h = retrieve_hints(args.task, top_k=1, mode=args.memory_mode)
             if _h:
                 task_for_prefix += "\n\nHint: A similar task was previously solved; use a robust approach."
         except Exception:
@@ -631,15 +677,32 @@ def main():
     prefix = seed_prefix_header_only(task_for_prefix, signature, doctests)
     vprint("[PREFIX]\n" + _trim(prefix))
 
+    def perf_gate(src: str, res: dict) -> dict:
+        """Benchmark a doctest-passing candidate; a too-slow one becomes a failing result for repair."""
+        if not args.perf_check or not res.get("ok"):
+            return res
+        think("Checking performance on scaled inputs...")
+        perf = check_performance(src, fn_name, _first_doctest_call(doctests, fn_name), signature,
+                                 budget=args.perf_budget, timeout_s=args.timeout, deadline=deadline)
+        plan("perf:check", {"ok": perf["ok"], "complexity": perf.get("complexity"), "exponent": perf.get("exponent"),
+                            "skipped": perf.get("skipped")})
+        vprint("[PERF] " + (perf.get("summary") or f"{perf.get('complexity')} ok={perf['ok']}"))
+        if perf["ok"]:
+            return dict(res, perf=perf)
+        return dict(res, ok=False, traceback=perf["summary"], perf=perf, perf_failed=True)
+
     # GEN-0
     think("Generating initial candidate...")
     plan("generate:start", {"candidates": int(args.candidates), "decode": args.decode})
     code = None
     best_code = None
     first_result = None
+    slow_pass = None  # last (code, result) that passed doctests but not the perf budget
     n = max(1, int(args.candidates))
     for k in range(n):
-        gen_body = _complete_backend(backend, prefix, max_new_tokens=args.max_new_tokens, decode=args.decode)
+        if out_of_time("generate"):
+            break
+        gen_body = _complete_backend(backend, prefix, max_new_tokens=args.max_new_tokens, decode=args.decode, deadline=deadline)
         cand = sanitize_to_function(prefix + gen_body, fn_name)
         if is_bad(cand):
             cand = extract_function(prefix + "    return False\n", fn_name)
@@ -648,15 +711,19 @@ def main():
             code = cand
             result = {"ok": True, "traceback": "", "stdout": "", "stderr": ""}
             break
-        res = run_doctest(cand, timeout_s=args.timeout)
+        res = perf_gate(cand, run_doctest(cand, timeout_s=args.timeout, cache=sandbox_cache, coverage=args.coverage_repair,
+                                          deadline=deadline))
         if first_result is None:
             first_result = (cand, res)
+        if res.get("perf_failed"):
+            slow_pass = slow_pass or (cand, res)
         if res["ok"]:
             code, result = cand, res
             best_code = cand
             break
     if code is None:
-        code, result = first_result
+        # nothing generated at all when the deadline passed first; the stub fallback below applies
+        code, result = slow_pass or first_result or ("", {"ok": False, "traceback": "DEADLINE", "stdout": "", "stderr": ""})
     plan("generate:done", {"passed_doctest": bool(result and result.get("ok"))})
 
     if not args.no_test:
@@ -666,23 +733,31 @@ def main():
             if not result["ok"]:
                 print("\n[SNIPPET]\n" + "\n".join(code.splitlines()[:60]))
         plan("test:gen0", {"ok": bool(result.get("ok"))})
+        escalate(result, "generate")
 
     # Optionally run external tools on the current candidate
     tools = [t for t in args.tools.split(",") if t.strip()]
     tools_results = None
     code_path_for_tools = None
-    if tools:
-        # Save the current code to outputs/tmp for tooling
+    tool_session = None
+    if tools and not out_of_time("tools"):
+        # Save the current code for tooling; a per-run name keeps concurrent runs of the same function apart
         tmp_dir = Path("outputs/.tools"); tmp_dir.mkdir(parents=True, exist_ok=True)
-        code_path_for_tools = tmp_dir / f"{fn_name}_current.py"
+        code_path_for_tools = tmp_dir / f"{fn_name}_{os.getpid()}_{uuid.uuid4().hex[:8]}.py"
         code_path_for_tools.write_text(code, encoding="utf-8")
         from src.tools.adapters import run_selected_tools
-        tools_results = run_selected_tools(code_path_for_tools, tools, cwd=None)
-        plan("tools:gen0", {"ok": tools_results.get("ok", False), "tools": list((tools_results.get("tools") or {}).keys())})
+        if not args.no_tool_server:
+            import atexit
+            from src.tools.session import ToolSession
+            tool_session = ToolSession(tmp_dir)
+            atexit.register(tool_session.close)  # also stops dmypy if the run aborts
+        tools_results = run_selected_tools(code_path_for_tools, tools, cwd=None, session=tool_session)
+        plan("tools:gen0", {"ok": tools_results.get("ok", False), "tools": list((tools_results.get("tools") or {}).keys()),
+                            "timing": tools_results.get("timing")})
         if args.verbose:
             vprint("[TOOLS:gen0] results:")
             for t, res in (tools_results.get("tools") or {}).items():
-                vprint(f"  - {t}: ok={res.get('ok')} rc={res.get('returncode')}\n    cmd: {res.get('cmd')}\n    stdout:\n{_trim(res.get('stdout',''))}\n    stderr:\n{_trim(res.get('stderr',''))}")
+                vprint(f"  - {t}: ok={res.get('ok')} rc={res.get('returncode')} wall={res.get('wall_s')}s cached={res.get('cached')}\n    cmd: {res.get('cmd')}\n    stdout:\n{_trim(res.get('stdout',''))}\n    stderr:\n{_trim(res.get('stderr',''))}")
         if args.early_stop_on_tools and tools_results.get("ok") and (args.no_test or result.get("ok")):
             # Early stop: tools are happy and either tests are disabled or passed
             plan("early-stop", {"reason": "tools_ok"})
@@ -691,34 +766,36 @@ def main():
     # FIX loop (only if testing enabled)
     if not args.no_test:
         i = 0
-        while not result["ok"] and i < args.iters:
+        while not result["ok"] and i < args.iters and not out_of_time("repair"):
             i += 1
             think(f"Attempting fix iteration {i}...")
             plan("repair:start", {"iter": i})
-            err = summarize_trace(result["traceback"])
-            if args.coverage_repair:
-                try:
-                    tmp_dir = Path("outputs/.tools"); tmp_dir.mkdir(parents=True, exist_ok=True)
-                    cov_path = tmp_dir / f"{fn_name}_cov.py"
-                    cov_path.write_text(code, encoding="utf-8")
-                    from src.tools.adapters import run_coverage_doctest
-                    cov = run_coverage_doctest(cov_path)
-                    if cov and cov.get("stdout"):
-                        err += "\n\n[Coverage]\n" + _trim(cov.get("stdout", ""))
-                except Exception:
-                    pass
-            vprint("[ERROR] Summary:\n" + _trim(err))
-            prompt = REPAIR_PROMPT.format(
-                task=args.task,
-                prev_code=extract_function(code, fn_name),
-                error=err
-            )
-            fix = _complete_backend(backend, prompt, max_new_tokens=args.max_new_tokens, decode=args.decode)
+            # coverage is collected by the sandbox in the same doctest run
+            prompt, ctx = build_repair_prompt(backend, args.task, extract_function(code, fn_name),
+                                              result["traceback"] or result.get("stderr", ""),
+                                              coverage=result.get("coverage") if args.coverage_repair else None,
+                                              code=code, budget=args.repair_budget)
+            plan("repair:context", dict(ctx, iter=i))
+            vprint(f"[REPAIR] prompt: {ctx['tokens']} tokens ({ctx['saved']} saved, {ctx['dropped']} facts dropped)\n" + _trim(prompt))
+            fix = _complete_backend(backend, prompt, max_new_tokens=args.max_new_tokens, decode=args.decode, deadline=deadline)
+            if out_of_time("repair"):
+                break  # the fix was cut off mid-generation; keep the previous candidate
+            prev_code = code
             code = sanitize_to_function(fix, fn_name)
             vprint(f"[FIX-{i}] candidate:\n" + _trim(code))
             if is_bad(code):
                 code = extract_function(prefix + "    return False\n", fn_name)
-            result = run_doctest(code, timeout_s=args.timeout)
+            new_result = perf_gate(code, run_doctest(code, timeout_s=args.timeout, cache=sandbox_cache,
+                                                     coverage=args.coverage_repair, deadline=deadline))
+            if new_result.get("deadline_exceeded") and not new_result.get("ok"):
+                out_of_time("repair")
+                code = prev_code  # untested; the previous candidate's result still stands
+                break
+            result = new_result
+            if result.get("perf_failed"):
+                slow_pass = (code, result)
+            if result.get("cached"):
+                plan("repair:duplicate", {"iter": i})
             if not getattr(args, 'final_only', False):
                 print(f"[FIX-{i}] pass=", result["ok"])
                 if not result["ok"]:
@@ -726,18 +803,44 @@ def main():
             plan("repair:done", {"iter": i, "ok": bool(result.get("ok"))})
             if result.get("ok"):
                 best_code = code
-            if args.tools_on_each_iter and tools:
+            elif args.decode == "greedy" and normalize_code(code) == normalize_code(prev_code):
+                # Same code + same error => same greedy prompt; further iterations would repeat this one
+                plan("repair:stuck", {"iter": i})
+                if not escalate(result, "stuck"):
+                    think("Repair loop is stuck on the same candidate; stopping early.")
+                    break
+            else:
+                escalate(result, "repair")
+            if args.tools_on_each_iter and tools and code_path_for_tools is not None and not out_of_time("tools"):
                 code_path_for_tools.write_text(code, encoding="utf-8")
-                tools_results = run_selected_tools(code_path_for_tools, tools, cwd=None)
-                plan("tools:fix", {"iter": i, "ok": tools_results.get("ok", False)})
+                tools_results = run_selected_tools(code_path_for_tools, tools, cwd=None, session=tool_session)
+                plan("tools:fix", {"iter": i, "ok": tools_results.get("ok", False), "timing": tools_results.get("timing")})
                 if args.verbose:
                     vprint(f"[TOOLS:fix-{i}] results:")
                     for t, res in (tools_results.get("tools") or {}).items():
-                        vprint(f"  - {t}: ok={res.get('ok')} rc={res.get('returncode')}\n    cmd: {res.get('cmd')}\n    stdout:\n{_trim(res.get('stdout',''))}\n    stderr:\n{_trim(res.get('stderr',''))}")
+                        vprint(f"  - {t}: ok={res.get('ok')} rc={res.get('returncode')} wall={res.get('wall_s')}s cached={res.get('cached')}\n    cmd: {res.get('cmd')}\n    stdout:\n{_trim(res.get('stdout',''))}\n    stderr:\n{_trim(res.get('stderr',''))}")
                 if args.early_stop_on_tools and tools_results.get("ok") and (args.no_test or result.get("ok")):
                     plan("early-stop", {"reason": "tools_ok", "iter": i})
                     break
 
+    if tool_session is not None:
+        tool_session.close()
+    if code_path_for_tools is not None:
+        for leftover in (code_path_for_tools, code_path_for_tools.with_suffix(".coverage")):
+            leftover.unlink(missing_ok=True)
+    if sandbox_cache is not None:
+        plan("sandbox:cache", sandbox_cache.stats())
+
+    if not result["ok"] and slow_pass:
+        # Repairs did not meet the perf budget; a correct but slow function beats a broken one
+        code = slow_pass[0]
+        result = dict(slow_pass[1], ok=True, traceback="")
+        best_code = code
+        plan("perf:budget_exceeded", {"complexity": result["perf"].get("complexity"), "budget": args.perf_budget})
+        think("Could not meet the performance budget; keeping the correct but slower version.")
+    if cascade is not None:
+        plan("cascade:done", cascade.finish(bool(result.get("ok"))))
+
     # No hardcoded fallbacks in Codex-like mode
 
     if not result["ok"] and not code.lstrip().startswith("def "):
@@ -778,7 +881,7 @@ def main():
         has_def_dup = re.search(r"^\s*def\s+", body, re.M) is not None
         return has_return and has_math and not has_def_dup and len(body.strip()) > 20
 
-    if (args.no_test or not (doctests and ">>>" in doctests)) and not _nontrivial(code):
+    if (args.no_test or not (doctests and ">>>" in doctests)) and not _nontrivial(code) and not out_of_time("improve"):
         think("Improving body for non-trivial implementation...")
         improve_prompt = (
             f"# Task: {args.task}\n"
@@ -787,8 +890,9 @@ def main():
             f"{signature}:\n\n\"\"\"{args.task}\"\"\"\n"
         )
         tries = 0
-        while tries < 3:
-            improved = _complete_backend(backend, improve_prompt, max_new_tokens=max(args.max_new_tokens, 200), decode="sample")
+        while tries < 3 and not out_of_time("improve"):
+            improved = _complete_backend(backend, improve_prompt, max_new_tokens=max(args.max_new_tokens, 200), decode="sample",
+                                         deadline=deadline)
             cand = sanitize_to_function(signature + ":\n" + improved, fn_name)
             if _nontrivial(cand):
                 code = cand
@@ -833,9 +937,12 @@ def main():
                 "decode": args.decode,
                 "candidates": args.candidates,
                 "tools": tools,
+                "deadline": args.deadline,
             },
-            "result": {"ok": bool(result.get("ok")) if isinstance(result, dict) else None},
+            "result": {"ok": bool(result.get("ok")) if isinstance(result, dict) else None,
+                       "deadline_exceeded": bool(deadline_hit)},
             "plan": plan_events,
+            "sandbox_cache": sandbox_cache.stats() if sandbox_cache is not None else None,
             "tools": tools_results,
             "code": code,
         }
@@ -851,6 +958,8 @@ def main():
     except Exception:
         pass
 
+    if deadline_hit and not getattr(args, 'final_only', False):
+        print(f"[DEADLINE] exceeded {args.deadline}s during {deadline_hit[0]}; returned the best code so far")
     if not result["ok"] and not getattr(args, 'final_only', False):
         print("\n[FINAL ERROR]\n" + summarize_trace(result["traceback"]))
 
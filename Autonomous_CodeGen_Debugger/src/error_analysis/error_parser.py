@@ -1,8 +1,12 @@
 import re
+import textwrap
 
 def summarize_trace(tb: str) -> str:
     if not tb or tb == "TIMEOUT":
         return "Execution timed out."
+    if tb.startswith("Too slow:"):
+        # perf-check summary is already concise
+        return tb
     # doctest failure summary lines
     m = re.findall(r"Failed example:\s*(.+?)\nException raised:\n(.+?)\n", tb, re.S)
     if m:
@@ -14,3 +18,40 @@ def summarize_trace(tb: str) -> str:
     # generic assertion/error lines
     last = tb.strip().splitlines()[-5:]
     return "Last traceback lines:\n" + "\n".join(last)
+
+
+def line_ranges(lines: list[int]) -> str:
+    """Collapse sorted line numbers into ranges: ``[3, 4, 5, 9]`` -> ``"3-5, 9"``."""
+    if not lines:
+        return ""
+    ranges: list[str] = []
+    start = prev = lines[0]
+    for ln in lines[1:] + [None]:
+        if ln is not None and ln == prev + 1:
+            prev = ln
+            continue
+        ranges.append(str(start) if start == prev else f"{start}-{prev}")
+        if ln is not None:
+            start = prev = ln
+    return ", ".join(ranges)
+
+
+def coverage_headline(cov: dict) -> str:
+    """One line: the coverage percentage and the missed line ranges."""
+    missed = cov.get("missed") or []
+    if not missed:
+        return f"Line coverage {cov.get('percent', 100.0)}%: every line ran."
+    return f"Line coverage {cov.get('percent')}%; never executed by the doctests: {line_ranges(missed)}"
+
+
+def missed_source(cov: dict, code_text: str, max_lines: int = 8) -> list[str]:
+    """``"  <line>: <source>"`` for the first ``max_lines`` missed lines of ``code_text``."""
+    src = textwrap.dedent(code_text).splitlines()
+    return [f"  {ln}: {src[ln - 1].strip()}" for ln in (cov.get("missed") or [])[:max_lines] if 0 < ln <= len(src)]
+
+
+def summarize_coverage(cov: dict, code_text: str, max_lines: int = 8) -> str:
+    """Render sandbox line coverage as missed line numbers plus the source of those lines."""
+    if not cov.get("missed"):
+        return coverage_headline(cov)
+    return coverage_headline(cov) + "\n" + "\n".join(missed_source(cov, code_text, max_lines))
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import ast
+import hashlib
+import json
+import os
+import sys
+import textwrap
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict
+
+from src.security.guard import PROJECT_ROOT, assert_write_allowed
+
+
+CACHE_DIR = PROJECT_ROOT / "outputs" / ".sandbox_cache"
+
+
+def normalize_code(code_text: str) -> str:
+    """Return a formatting-insensitive form of the candidate.
+
+    The AST dump drops comments, blank lines and indentation differences but keeps
+    docstrings verbatim, so the doctest block stays part of the identity.
+    Unparseable code falls back to whitespace-stripped source.
+    """
+    src = textwrap.dedent(code_text)
+    try:
+        return ast.dump(ast.parse(src))
+    except SyntaxError:
+        return "\n".join(ln.rstrip() for ln in src.strip().splitlines())
+
+
+def cache_key(code_text: str, timeout_s: int, mem_mb: int, **extra: Any) -> str:
+    h = hashlib.sha256()
+    h.update(normalize_code(code_text).encode("utf-8"))
+    limits = {"timeout_s": timeout_s, "mem_mb": mem_mb, "python": sys.version}
+    limits.update(extra)
+    h.update(b"\0" + json.dumps(limits, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class SandboxCache:
+    """In-memory LRU of sandbox results backed by one JSON file per key on disk.
+
+    Timeouts are only kept in memory: they depend on machine load and should not
+    poison later runs.
+    """
+
+    def __init__(self, cache_dir: Path | None = CACHE_DIR, max_entries: int = 512):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._mem: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def _disk_path(self, key: str) -> Path | None:
+        return self.cache_dir / f"{key}.json" if self.cache_dir else None
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        with self._lock:
+            self.lookups += 1
+            rec = self._mem.get(key)
+            if rec is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return dict(rec)
+        path = self._disk_path(key)
+        if path is None or not path.exists():
+            return None
+        try:
+            rec = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, rec)
+        return dict(rec)
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        rec = {k: v for k, v in result.items() if k not in ("path", "cached")}
+        with self._lock:
+            self._remember(key, rec)
+        path = self._disk_path(key)
+        if path is None or rec.get("traceback") == "TIMEOUT":
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            assert_write_allowed(path)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(rec), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception:
+            pass
+
+    def _remember(self, key: str, rec: Dict[str, Any]) -> None:
+        self._mem[key] = rec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups, hits = self.lookups, self.hits
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "misses": lookups - hits,
+            "duplicate_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,191 @@
+"""Optional cgroup-v2 limits for sandbox runs.
+
+Layout under a delegated subtree (``CODEGEN_CGROUP_ROOT``, e.g. a systemd unit
+with ``Delegate=yes``)::
+
+    <root>/worker               the worker process(es), moved here at setup
+    <root>/sandboxes            shared quota for all runs (memory.max / cpu.max)
+    <root>/sandboxes/run-*      one leaf per sandbox run (memory.max / cpu.max)
+
+cgroup v2 forbids enabling controllers for the children of a group that has
+processes of its own, and under ``Delegate=yes`` the worker starts in ``<root>``, so
+setup first moves every process in ``<root>`` into the ``worker`` leaf.
+
+Environment:
+- ``CODEGEN_SANDBOX_BACKEND``: ``auto`` (default), ``cgroup`` or ``rlimit``
+- ``CODEGEN_CGROUP_ROOT``: delegated, writable cgroup-v2 directory
+- ``CODEGEN_CGROUP_MEM_MAX``: shared memory quota, e.g. ``8G`` (default: unlimited)
+- ``CODEGEN_CGROUP_CPUS``: shared CPU quota in cores, e.g. ``4`` (default: unlimited)
+- ``CODEGEN_CGROUP_RUN_CPUS``: per-run CPU quota in cores (default: 1)
+
+When cgroups are unavailable the sandbox falls back to per-process rlimits; the
+reason is printed to stderr once and reported by ``/health``.
+"""
+
+from __future__ import annotations
+import itertools
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+CPU_PERIOD_US = 100_000
+
+_lock = threading.Lock()
+_counter = itertools.count()
+_state: Dict[str, Any] = {"checked": False, "parent": None, "reason": ""}
+
+
+def _parse_bytes(v: str) -> int:
+    v = v.strip().upper()
+    mult = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(v[-1:], 1)
+    return int(float(v[:-1] if mult > 1 else v) * mult)
+
+
+def _cpu_max(cores: float) -> str:
+    return f"{int(cores * CPU_PERIOD_US)} {CPU_PERIOD_US}"
+
+
+def _write(path: Path, value: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(value)
+
+
+def _warn(msg: str) -> None:
+    print(f"[sandbox] {msg}", file=sys.stderr)
+
+
+def _vacate(root: Path) -> None:
+    """Move the processes living directly in ``root`` into ``root/worker`` (no-internal-process rule)."""
+    pids = (root / "cgroup.procs").read_text().split()
+    if not pids:
+        return
+    leaf = root / "worker"
+    leaf.mkdir(exist_ok=True)
+    for pid in pids:
+        try:
+            _write(leaf / "cgroup.procs", pid)
+        except ProcessLookupError:
+            pass  # exited meanwhile
+
+
+def _enable_controllers(group: Path) -> None:
+    available = set((group / "cgroup.controllers").read_text().split())
+    missing = {"cpu", "memory"} - available
+    if missing:
+        raise RuntimeError(f"controllers not delegated to {group}: {', '.join(sorted(missing))}")
+    _write(group / "cgroup.subtree_control", "+cpu +memory")
+
+
+def _setup() -> Path:
+    mode = os.getenv("CODEGEN_SANDBOX_BACKEND", "auto").strip().lower()
+    if mode == "rlimit":
+        raise RuntimeError("disabled by CODEGEN_SANDBOX_BACKEND=rlimit")
+    raw = os.getenv("CODEGEN_CGROUP_ROOT", "").strip()
+    if not raw:
+        raise RuntimeError("CODEGEN_CGROUP_ROOT is not set")
+    root = Path(raw)
+    if not (root / "cgroup.controllers").exists():
+        raise RuntimeError(f"{root} is not a cgroup-v2 directory")
+    _vacate(root)
+    _enable_controllers(root)
+    parent = root / "sandboxes"
+    parent.mkdir(exist_ok=True)
+    mem = os.getenv("CODEGEN_CGROUP_MEM_MAX", "").strip()
+    _write(parent / "memory.max", str(_parse_bytes(mem)) if mem else "max")
+    cpus = os.getenv("CODEGEN_CGROUP_CPUS", "").strip()
+    _write(parent / "cpu.max", _cpu_max(float(cpus)) if cpus else f"max {CPU_PERIOD_US}")
+    _enable_controllers(parent)
+    return parent
+
+
+def sandbox_parent() -> Path | None:
+    """Return the shared parent cgroup, setting it up on first use; None if unavailable."""
+    with _lock:
+        if not _state["checked"]:
+            _state["checked"] = True
+            try:
+                _state["parent"] = _setup()
+            except Exception as e:
+                _state["reason"] = str(e)
+                if os.getenv("CODEGEN_SANDBOX_BACKEND", "auto").strip().lower() == "cgroup" or os.getenv("CODEGEN_CGROUP_ROOT"):
+                    _warn(f"cgroup backend disabled, using rlimits: {e}")
+        return _state["parent"]
+
+
+def unavailable_reason() -> str:
+    return _state["reason"]
+
+
+class RunCgroup:
+    """Leaf cgroup for a single sandbox run."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def attach_self(self) -> None:
+        # Called in the child between fork and exec (preexec_fn)
+        _write(self.path / "cgroup.procs", str(os.getpid()))
+
+    def usage(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"backend": "cgroup"}
+        try:
+            stat = dict(ln.split() for ln in (self.path / "cpu.stat").read_text().splitlines() if ln.strip())
+            out["cpu_ms"] = int(stat.get("usage_usec", 0)) // 1000
+            out["cpu_throttled_ms"] = int(stat.get("throttled_usec", 0)) // 1000
+        except Exception:
+            pass
+        # memory.peak needs Linux 5.19+
+        for name in ("memory.peak", "memory.current"):
+            try:
+                out["mem_peak_mb"] = round(int((self.path / name).read_text()) / 1024 ** 2, 1)
+                break
+            except Exception:
+                continue
+        try:
+            events = dict(ln.split() for ln in (self.path / "memory.events").read_text().splitlines() if ln.strip())
+            out["oom_killed"] = int(events.get("oom_kill", 0)) > 0
+        except Exception:
+            pass
+        return out
+
+    def attached(self) -> bool:
+        """Whether a process ever ran in this leaf (false when ``attach_self`` failed in the child)."""
+        try:
+            stat = dict(ln.split() for ln in (self.path / "cpu.stat").read_text().splitlines() if ln.strip())
+            return int(stat.get("usage_usec", 0)) > 0
+        except Exception:
+            return True  # cannot tell; assume the limits applied
+
+    def remove(self, attempts: int = 5) -> None:
+        # the reaped child can take a moment to leave the group; rmdir fails with EBUSY until then
+        for i in range(attempts):
+            try:
+                self.path.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                if i == attempts - 1:
+                    _warn(f"could not remove {self.path}: {e}")
+                    return
+                time.sleep(0.05 * (i + 1))
+
+
+def create_run_cgroup(mem_mb: int) -> RunCgroup | None:
+    parent = sandbox_parent()
+    if parent is None:
+        return None
+    path = parent / f"run-{os.getpid()}-{next(_counter)}"
+    try:
+        path.mkdir()
+        _write(path / "memory.max", str(mem_mb * 1024 * 1024))
+        if (path / "memory.swap.max").exists():
+            _write(path / "memory.swap.max", "0")
+        _write(path / "cpu.max", _cpu_max(float(os.getenv("CODEGEN_CGROUP_RUN_CPUS", "1"))))
+    except OSError:
+        RunCgroup(path).remove()
+        return None
+    return RunCgroup(path)
@@ -0,0 +1,345 @@
+"""Scaled-input benchmarking of a candidate that already passes its doctests.
+
+The function is called on inputs grown from its first doctest call (or from
+placeholders derived from the signature) in a resource-limited child process.
+Per-size call time and peak RSS come back as JSON lines; a log-log fit of time
+against input size gives the observed growth exponent.
+
+Sizes grow until ``MIN_FIT_POINTS`` calls took longer than the timing noise floor
+and span at least ``MIN_FIT_SPAN`` times in size, so slowly growing work such as an
+O(sqrt(n)) loop still produces a measurable curve. Int arguments grow in steps of a
+quarter (4, 6, 8, 10, 12, 15, ...) so exponential recursion yields several points
+before a call hits ``MAX_POINT_S``, and stop at ``INT_MAX``, so the cost of ever
+larger big-int values is not billed as algorithmic growth. A run stopped by the
+per-call limit before a fit was possible is judged by its last jump in time and
+counts as too slow; with no measurable time at all the complexity is "inconclusive".
+"""
+
+from __future__ import annotations
+import ast
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import textwrap
+from typing import Any, Dict, List
+
+from src.security.guard import safe_tempdir_root, assert_write_allowed
+from src.execution_sandbox.sandbox import SandboxLimits, communicate
+
+
+# Sizes are the value of an int argument or the length of a sequence argument
+INT_MAX = 2 ** 20
+
+
+def _int_sizes(start: int = 4, stop: int = INT_MAX) -> List[int]:
+    sizes, n = [], start
+    while n <= stop:
+        sizes.append(n)
+        n += max(2, n // 4)
+    return sizes
+
+
+INT_SIZES = _int_sizes()
+SEQ_SIZES = [2 ** k for k in range(8, 21)]
+NOISE_FLOOR_S = 1e-5
+MAX_POINT_S = 0.5
+# sizes stop growing once this many points are above the noise floor and the largest
+# of them is this many times the smallest
+MIN_FIT_POINTS = 4
+MIN_FIT_SPAN = 4.0
+
+_CHILD = r'''
+import ast, copy, gc, importlib.util, json, resource, sys, time
+
+path, fn_name, base_src, idx, sizes, max_point_s = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]), json.loads(sys.argv[5]), float(sys.argv[6])
+floor_s, min_points, min_span = float(sys.argv[7]), int(sys.argv[8]), float(sys.argv[9])
+spec = importlib.util.spec_from_file_location("candidate", path)
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+fn = getattr(mod, fn_name)
+base = ast.literal_eval(base_src)
+rss_div = 1024 if sys.platform == "darwin" else 1  # ru_maxrss is bytes on macOS, KiB elsewhere
+
+def is_prime(n):
+    if n < 2:
+        return False
+    for p in (2, 3, 5, 7, 11, 13, 17):
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for a in (2, 3, 5, 7, 11, 13, 17):  # deterministic for n < 3.4e14
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def grow(v, n):
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, int):
+        # the largest prime <= n: a power of two would let divisor loops (is_prime) stop at once
+        while n > 2 and not is_prime(n):
+            n -= 1
+        return n
+    if isinstance(v, str):
+        return ((v or "a") * (n // max(1, len(v)) + 1))[:n]
+    if isinstance(v, (list, tuple)):
+        items = list(v) or [1]
+        out = [items[i % len(items)] for i in range(n)]
+        return tuple(out) if isinstance(v, tuple) else out
+    if isinstance(v, set):
+        return set(range(n))
+    return v
+
+first_timed, last_n, prev_best, best = None, None, None, None
+timed = 0
+for n in sizes:
+    args = list(base)
+    args[idx] = grow(base[idx], n)
+    if isinstance(args[idx], int) and not isinstance(args[idx], bool):
+        n = args[idx]
+        if n == last_n:
+            continue  # two sizes rounded down to the same prime
+    last_n, prev_best = n, best
+    best, total, reps = float("inf"), 0.0, 0
+    wall0 = time.perf_counter()
+    try:
+        # repetitions are bounded by wall time too: copying a large argument can cost far more than the call
+        while reps < 3 or (total < 0.02 and reps < 50 and time.perf_counter() - wall0 < max_point_s):
+            call_args = copy.deepcopy(args)
+            gc.disable()  # as timeit does: a collection of the copies must not be billed to the call
+            try:
+                t0 = time.perf_counter()
+                fn(*call_args)
+                dt = time.perf_counter() - t0
+            finally:
+                gc.enable()
+            best, total, reps = min(best, dt), total + dt, reps + 1
+            if dt > max_point_s:
+                break
+    except BaseException as e:
+        print(json.dumps({"n": n, "error": f"{type(e).__name__}: {e}"[:200]}), flush=True)
+        break
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // rss_div
+    print(json.dumps({"n": n, "t": best, "reps": reps, "rss_kb": rss_kb}), flush=True)
+    if best >= floor_s:
+        timed += 1
+        first_timed = first_timed or n
+    if timed >= min_points and n >= min_span * first_timed:
+        break
+    # the next size is predicted to exceed the per-call limit, or preparing its arguments already takes that long
+    if best > max_point_s or (prev_best and best * best / prev_best > max_point_s) or time.perf_counter() - wall0 > max_point_s:
+        print(json.dumps({"stop": "limit", "n": n}), flush=True)
+        break
+'''
+
+
+def _literal(node: ast.expr) -> Any:
+    """``ast.literal_eval`` plus ``set(...)``/``frozenset(...)`` calls (as sets: only the size matters here)."""
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ("set", "frozenset")
+            and len(node.args) <= 1 and not node.keywords):
+        return set(ast.literal_eval(node.args[0])) if node.args else set()
+    return ast.literal_eval(node)
+
+
+def _literal_args(call_src: str | None, fn_name: str) -> List[Any] | None:
+    if not call_src:
+        return None
+    try:
+        node = ast.parse(call_src.strip(), mode="eval").body
+    except SyntaxError:
+        return None
+    # unwrap e.g. print(fn(...)) or sorted(fn(...))
+    while isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id == fn_name):
+        if not node.args:
+            return None
+        node = node.args[0]
+    if not isinstance(node, ast.Call):
+        return None
+    try:
+        return [_literal(a) for a in node.args]
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None  # not a literal call (names, expressions, unhashable set items)
+
+
+def _placeholder_args(signature: str) -> List[Any] | None:
+    m = re.search(r"\((.*)\)", signature or "", re.S)
+    if not m:
+        return None
+    out: List[Any] = []
+    for spec in [p.strip() for p in m.group(1).split(",") if p.strip()]:
+        name = spec.split(":", 1)[0].split("=", 1)[0].strip()
+        if name in ("self", "cls") or name.startswith("*"):
+            continue
+        ann = spec.split(":", 1)[1].split("=", 1)[0].strip().lower() if ":" in spec else ""
+        if "list" in ann or "sequence" in ann or "iterable" in ann:
+            out.append(["a", "b"] if "str" in ann else [1, 2, 3])
+        elif "tuple" in ann:
+            out.append((1, 2, 3))
+        elif "str" in ann:
+            out.append("ab")
+        elif "int" in ann:
+            out.append(8)
+        else:
+            return None
+    return out
+
+
+def _scaled_index(args: List[Any]) -> tuple[int, List[int]] | None:
+    """Pick the size-like argument: the first sequence, else the first int."""
+    for i, v in enumerate(args):
+        if isinstance(v, (str, list, tuple, set)):
+            return i, SEQ_SIZES
+    for i, v in enumerate(args):
+        if isinstance(v, int) and not isinstance(v, bool):
+            return i, INT_SIZES
+    return None
+
+
+def fit_exponent(points: List[Dict[str, Any]]) -> float | None:
+    """Least-squares slope of log(time) over log(n) for points above the noise floor."""
+    pts = [(math.log(p["n"]), math.log(p["t"])) for p in points if p.get("t", 0) >= NOISE_FLOOR_S]
+    if len(pts) < 2:
+        return None
+    mx = sum(x for x, _ in pts) / len(pts)
+    my = sum(y for _, y in pts) / len(pts)
+    var = sum((x - mx) ** 2 for x, _ in pts)
+    if var == 0:
+        return None
+    return sum((x - mx) * (y - my) for x, y in pts) / var
+
+
+def jump_exponent(points: List[Dict[str, Any]]) -> float | None:
+    """Slope between the last two points, noise floor ignored (for runs cut short by the per-call limit)."""
+    if len(points) < 2:
+        return None
+    a, b = points[-2], points[-1]
+    if b["n"] <= a["n"] or a["t"] <= 0 or b["t"] <= 0:
+        return None
+    return math.log(b["t"] / a["t"]) / math.log(b["n"] / a["n"])
+
+
+def complexity_label(exponent: float | None, timed_out: bool = False) -> str:
+    if exponent is None:
+        # no sizes took measurable time (or too few did): nothing can be said about growth
+        return "O(2^n)" if timed_out else "inconclusive"
+    if exponent < 0.3:
+        return "O(1)"
+    if exponent < 0.75:
+        return "O(sqrt(n))"
+    if exponent < 1.25:
+        return "O(n)"
+    if exponent < 1.6:
+        return "O(n log n)"
+    if exponent < 2.5:
+        return "O(n^2)"
+    if exponent < 3.5:
+        return "O(n^3)"
+    return "O(2^n)"
+
+
+def check_performance(code_text: str, fn_name: str, doctest_call: str | None = None, signature: str | None = None,
+                      budget: float = 1.5, timeout_s: int = 30, mem_mb: int = 2048, deadline=None) -> Dict[str, Any]:
+    """Benchmark ``fn_name`` on scaled inputs; return dict with ok, exponent, complexity, points, summary.
+
+    ``ok`` is False when the fitted time exponent exceeds ``budget`` or the largest
+    input does not finish within ``timeout_s``. Candidates without a scalable
+    argument are reported as skipped (and ok), as are runs cut short by ``deadline``.
+    """
+    args = _literal_args(doctest_call, fn_name) or _placeholder_args(signature or "")
+    picked = _scaled_index(args) if args else None
+    if not picked:
+        return {"ok": True, "skipped": "no scalable argument", "points": [], "summary": ""}
+    idx, sizes = picked
+    run_s = deadline.clip(timeout_s) if deadline is not None else timeout_s
+    skipped_deadline = {"ok": True, "skipped": "deadline", "deadline_exceeded": True, "points": [], "summary": ""}
+    if run_s <= 0:
+        return skipped_deadline
+
+    safe_root = safe_tempdir_root()
+    with tempfile.TemporaryDirectory(dir=str(safe_root)) as td:
+        path = os.path.join(td, "candidate.py")
+        runner = os.path.join(td, "perf_runner.py")
+        for p, text in ((path, textwrap.dedent(code_text)), (runner, _CHILD)):
+            assert_write_allowed(p)
+            with open(p, "w", encoding="utf-8") as f:
+                f.write(text)
+        cmd = [sys.executable, runner, path, fn_name, repr(args), str(idx), json.dumps(sizes), str(MAX_POINT_S),
+               str(NOISE_FLOOR_S), str(MIN_FIT_POINTS), str(MIN_FIT_SPAN)]
+        timed_out = False
+        with SandboxLimits(mem_mb, max(1, math.ceil(run_s))) as limits:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                    preexec_fn=limits.preexec_fn)
+            out, _, stopped = communicate(proc, run_s, deadline)
+            out = out or ""
+            if stopped == "deadline" or (stopped == "timeout" and run_s < timeout_s):
+                return skipped_deadline  # cut short by the run's budget, not by the candidate
+            timed_out = stopped == "timeout"
+
+    points: List[Dict[str, Any]] = []
+    error = None
+    limited = False
+    for line in out.splitlines():
+        try:
+            rec = json.loads(line)
+        except Exception:
+            continue
+        if "error" in rec:
+            error = rec["error"]
+            break
+        if "stop" in rec:
+            limited = True
+            continue
+        points.append(rec)
+    if not points and not timed_out:
+        return {"ok": True, "skipped": f"benchmark failed: {error or 'no output'}", "points": [], "summary": ""}
+
+    exponent = fit_exponent(points)
+    # growth hit the per-call limit before enough sizes took measurable time (e.g. exponential
+    # recursion): the steepest evidence decides, and no evidence at all counts as too slow
+    cut_short = limited and sum(1 for p in points if p["t"] >= NOISE_FLOOR_S) < MIN_FIT_POINTS
+    if cut_short:
+        exponent = max((e for e in (exponent, jump_exponent(points)) if e is not None), default=None)
+    label = complexity_label(exponent, timed_out or cut_short)
+    last = points[-1] if points else {}
+    too_slow = timed_out or (exponent is not None and exponent > budget) or (cut_short and exponent is None)
+    result: Dict[str, Any] = {
+        "ok": not too_slow,
+        "exponent": round(exponent, 2) if exponent is not None else None,
+        "complexity": label,
+        "inconclusive": exponent is None and not timed_out and not cut_short,
+        "budget": budget,
+        "timed_out": timed_out,
+        "points": points,
+        "peak_rss_mb": round(max((p.get("rss_kb", 0) for p in points), default=0) / 1024, 1),
+        "usage": limits.usage,
+        "summary": "",
+    }
+    if error:
+        result["error"] = error
+    if too_slow:
+        if timed_out and not points:
+            where = f"the smallest input (n={sizes[0]}) did not finish within {timeout_s}s"
+        elif timed_out:
+            where = f"a call did not finish within {timeout_s}s after n={last['n']} took {last['t']:.3f}s"
+        elif exponent is None:
+            where = f"{last['t']:.3f}s at n={last['n']} already reached the {MAX_POINT_S}s per-call limit"
+        else:
+            where = f"time exponent {exponent:.2f} > budget {budget:.2f}; {last['t']:.3f}s at n={last['n']}"
+        result["summary"] = (
+            f"Too slow: observed {label} growth ({where}).\n"
+            "The doctests pass; rewrite the function with a more efficient algorithm that keeps the same behavior."
+        )
+    return result
@@ -1,36 +1,248 @@
-import subprocess, sys, tempfile, textwrap, os, json, signal, resource
+import subprocess, sys, tempfile, textwrap, os, json, signal, resource, math, time, hashlib
 from pathlib import Path
 from src.security.guard import safe_tempdir_root, assert_write_allowed
+from src.execution_sandbox.cache import SandboxCache, cache_key
+from src.execution_sandbox.cgroups import RunCgroup, create_run_cgroup
 
-def _limit_resources(mem_mb: int, cpu_seconds: int):
+def _lower_rlimit(which: int, value: int):
+    # never ask for more than the inherited hard limit: raising it fails for unprivileged users
+    _, hard = resource.getrlimit(which)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(which, (value, value))
+
+def _limit_resources(mem_mb: int, cpu_seconds: int, cgroup: RunCgroup | None = None):
     def _setter():
+        # CPU and file-size limits are strict and apply whatever happens to the cgroup attach
+        # below: lowering them works on every POSIX platform, and if it still fails, Popen
+        # raises in the parent instead of running the candidate without a CPU bound.
+        _lower_rlimit(resource.RLIMIT_CPU, cpu_seconds)
+        _lower_rlimit(resource.RLIMIT_FSIZE, 50 * 1024 * 1024)
+        if cgroup is not None:
+            try:
+                # memory is bounded by the cgroup; RLIMIT_AS would also cap virtual reservations
+                cgroup.attach_self()
+                return
+            except OSError:
+                pass  # fall back to RLIMIT_AS below; the parent notices via RunCgroup.attached()
         try:
+            # best-effort, as before cgroups: macOS rejects most RLIMIT_AS values
             resource.setrlimit(resource.RLIMIT_AS, (mem_mb * 1024 * 1024, mem_mb * 1024 * 1024))
-            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
-            resource.setrlimit(resource.RLIMIT_FSIZE, (50 * 1024 * 1024, 50 * 1024 * 1024))
-        except Exception:
+        except (ValueError, OSError):
             pass
     return _setter
 
-def run_doctest(code_text: str, timeout_s: int = 5, mem_mb: int = 2048):
-    """Write code to temp file and run doctest; return dict with status, stdout, stderr, traceback."""
+class SandboxLimits:
+    """Limits for one child process: a per-run cgroup when available, rlimits otherwise.
+
+    Use as a context manager; after exit ``usage`` holds the run's CPU/memory usage
+    (cgroup backend only) and the backend name.
+    """
+
+    def __init__(self, mem_mb: int, cpu_seconds: int):
+        self.cgroup = create_run_cgroup(mem_mb)
+        self.preexec_fn = _limit_resources(mem_mb, cpu_seconds, self.cgroup)
+        self.usage = {"backend": "cgroup" if self.cgroup else "rlimit"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.cgroup is not None:
+            if self.cgroup.attached():
+                self.usage = self.cgroup.usage()
+            else:
+                self.usage = {"backend": "rlimit", "cgroup_attach_failed": True}
+                print(f"[sandbox] could not attach to {self.cgroup.path}; the run was limited by RLIMIT_AS instead",
+                      file=sys.stderr)
+            self.cgroup.remove()
+        return False
+
+def communicate(proc: subprocess.Popen, timeout_s: float, deadline=None, poll_s: float = 0.1):
+    """``proc.communicate(timeout=timeout_s)`` that also kills the child once ``deadline`` expires.
+
+    Returns ``(stdout, stderr, stopped)`` where ``stopped`` is None, ``"timeout"`` or ``"deadline"``.
+    """
+    end = time.monotonic() + timeout_s
+    while True:
+        left = end - time.monotonic()
+        try:
+            out, err = proc.communicate(timeout=max(0.0, min(left, poll_s) if deadline is not None else left))
+            return out, err, None
+        except subprocess.TimeoutExpired:
+            if time.monotonic() >= end:
+                stopped = "timeout"
+            elif deadline is not None and deadline.expired():
+                stopped = "deadline"
+            else:
+                continue
+        proc.kill()
+        out, err = proc.communicate()
+        return out, err, stopped
+
+def _deadline_result(stdout: str = "", path: str = "") -> dict:
+    return {"ok": False, "stdout": stdout, "stderr": "DEADLINE", "traceback": "DEADLINE", "path": path,
+            "deadline_exceeded": True}
+
+# Same behaviour and output as `python -m doctest -v candidate.py`, plus line coverage of the
+# candidate recorded in-process (sys.monitoring on 3.12+, a file-filtered settrace otherwise)
+_COVERAGE_RUNNER = r'''
+import doctest, json, os, sys
+path, cov_out = sys.argv[1], sys.argv[2]
+executed = set()
+if hasattr(sys, "monitoring"):
+    mon = sys.monitoring
+    mon.use_tool_id(mon.COVERAGE_ID, "codegen-sandbox")
+    def _on_line(code, line):
+        if code.co_filename == path:
+            executed.add(line)
+        return mon.DISABLE
+    mon.register_callback(mon.COVERAGE_ID, mon.events.LINE, _on_line)
+    mon.set_events(mon.COVERAGE_ID, mon.events.LINE)
+else:
+    def _tracer(frame, event, arg):
+        if frame.f_code.co_filename != path:
+            return None
+        if event == "line":
+            executed.add(frame.f_lineno)
+        return _tracer
+    sys.settrace(_tracer)
+failures = 1
+try:
+    dirname, filename = os.path.split(path)
+    sys.path.insert(0, dirname)
+    m = __import__(filename[:-3])
+    del sys.path[0]
+    failures, _ = doctest.testmod(m, verbose=True)
+finally:
+    sys.settrace(None)
+    with open(cov_out, "w") as f:
+        json.dump(sorted(executed), f)
+sys.exit(1 if failures else 0)
+'''
+
+def _executable_lines(source: str, filename: str) -> set[int]:
+    lines: set[int] = set()
+    try:
+        todo = [compile(source, filename, "exec")]
+    except SyntaxError:
+        return lines
+    while todo:
+        co = todo.pop()
+        lines.update(ln for _, _, ln in co.co_lines() if ln)
+        todo.extend(c for c in co.co_consts if hasattr(c, "co_lines"))
+    return lines
+
+def run_doctest(code_text: str, timeout_s: int = 5, mem_mb: int = 2048, cache: SandboxCache | None = None,
+                coverage: bool = False, deadline=None):
+    """Write code to temp file and run doctest; return dict with status, stdout, stderr, traceback.
+
+    With a cache, candidates identical up to formatting are answered from it and
+    the returned dict carries ``cached=True``; coverage runs are keyed on the exact
+    source, since their line numbers shift with comments and blank lines. With ``coverage=True`` the same child
+    also records line coverage, returned as ``coverage`` (executed/missed line
+    numbers and percent) unless the run timed out. With a ``deadline``
+    (``src.debugging_loop.deadline.Deadline``) the timeout is clipped to the time
+    left and the child is killed once it expires; such runs carry
+    ``deadline_exceeded=True`` and are not cached.
+    """
+    if cache is None:
+        return _run_doctest(code_text, timeout_s, mem_mb, coverage, deadline)
+    extra: dict = {"coverage": coverage}
+    if coverage:
+        extra["source"] = hashlib.sha256(textwrap.dedent(code_text).encode("utf-8")).hexdigest()
+    key = cache_key(code_text, timeout_s, mem_mb, **extra)
+    hit = cache.get(key)
+    if hit is not None:
+        hit["cached"] = True
+        return hit
+    res = _run_doctest(code_text, timeout_s, mem_mb, coverage, deadline)
+    if not res.get("deadline_exceeded"):
+        cache.put(key, res)
+    return res
+
+def _run_doctest(code_text: str, timeout_s: int, mem_mb: int, coverage: bool = False, deadline=None):
+    budget = deadline.clip(timeout_s) if deadline is not None else timeout_s
+    if budget <= 0:
+        return _deadline_result()
     safe_root = safe_tempdir_root()
     with tempfile.TemporaryDirectory(dir=str(safe_root)) as td:
         path = os.path.join(td, "candidate.py")
+        source = textwrap.dedent(code_text)
         assert_write_allowed(path)
         with open(path, "w", encoding="utf-8") as f:
-            f.write(textwrap.dedent(code_text))
+            f.write(source)
 
         cmd = [sys.executable, "-m", "doctest", "-v", path]
-        try:
-            proc = subprocess.run(
-                cmd, capture_output=True, text=True, timeout=timeout_s,
-                preexec_fn=_limit_resources(mem_mb, timeout_s)
+        cov_out = os.path.join(td, "coverage.json")
+        if coverage:
+            runner = os.path.join(td, "doctest_cov.py")
+            assert_write_allowed(runner)
+            with open(runner, "w", encoding="utf-8") as f:
+                f.write(_COVERAGE_RUNNER)
+            cmd = [sys.executable, runner, path, cov_out]
+        with SandboxLimits(mem_mb, max(1, math.ceil(budget))) as limits:
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                preexec_fn=limits.preexec_fn
+            )
+            stdout, stderr, stopped = communicate(proc, budget, deadline)
+            if stopped == "deadline" or (stopped == "timeout" and budget < timeout_s):
+                res = _deadline_result(stdout or "", path)
+            elif stopped == "timeout":
+                res = {"ok": False, "stdout": stdout or "", "stderr": "TIMEOUT", "traceback": "TIMEOUT", "path": path}
+            else:
+                ok = (proc.returncode == 0)
+                res = {
+                    "ok": ok, "stdout": stdout, "stderr": stderr,
+                    "traceback": stdout if not ok else "", "path": path
+                }
+        if coverage and os.path.exists(cov_out):
+            try:
+                with open(cov_out, encoding="utf-8") as f:
+                    executed = set(json.load(f))
+                executable = _executable_lines(source, path)
+                missed = sorted(executable - executed)
+                res["coverage"] = {
+                    "executed": sorted(executed & executable),
+                    "missed": missed,
+                    "percent": round(100.0 * (len(executable) - len(missed)) / len(executable), 1) if executable else 100.0,
+                }
+            except Exception:
+                pass
+        res["usage"] = limits.usage
+        if limits.usage.get("oom_killed"):
+            res["ok"] = False
+            res["traceback"] = (res["stdout"] or "") + f"\nKilled: memory limit of {mem_mb} MB exceeded"
+        return res
+
+def run_check(code_text: str, test_code: str, timeout_s: int = 30, mem_mb: int = 2048, deadline=None):
+    """Run ``code_text`` followed by ``test_code`` (asserts, or a ``check(fn)`` call) as one script.
+
+    Same limits as ``run_doctest``; ``ok`` is True when the script exits 0. Used for
+    hidden dataset tests (HumanEval ``check``, MBPP ``assert`` lists).
+    """
+    budget = deadline.clip(timeout_s) if deadline is not None else timeout_s
+    if budget <= 0:
+        return _deadline_result()
+    safe_root = safe_tempdir_root()
+    with tempfile.TemporaryDirectory(dir=str(safe_root)) as td:
+        path = os.path.join(td, "check.py")
+        assert_write_allowed(path)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(textwrap.dedent(code_text).rstrip() + "\n\n\n" + test_code.rstrip() + "\n")
+        with SandboxLimits(mem_mb, max(1, math.ceil(budget))) as limits:
+            proc = subprocess.Popen(
+                [sys.executable, path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                cwd=td, preexec_fn=limits.preexec_fn
             )
-            ok = (proc.returncode == 0)
-            return {
-                "ok": ok, "stdout": proc.stdout, "stderr": proc.stderr,
-                "traceback": proc.stdout if not ok else "", "path": path
-            }
-        except subprocess.TimeoutExpired as e:
-            return {"ok": False, "stdout": e.stdout or "", "stderr": "TIMEOUT", "traceback": "TIMEOUT", "path": path}
+            stdout, stderr, stopped = communicate(proc, budget, deadline)
+        if stopped == "deadline" or (stopped == "timeout" and budget < timeout_s):
+            res = _deadline_result(stdout or "", path)
+        elif stopped == "timeout":
+            res = {"ok": False, "stdout": stdout or "", "stderr": "TIMEOUT", "traceback": "TIMEOUT", "path": path}
+        else:
+            ok = proc.returncode == 0 and not limits.usage.get("oom_killed")
+            res = {"ok": ok, "stdout": stdout, "stderr": stderr, "traceback": stderr if not ok else "", "path": path}
+        res["usage"] = limits.usage
+        return res
@@ -0,0 +1,279 @@
+"""Persistent inverted index with BM25 ranking over ``cases.jsonl``.
+
+Files next to the case file:
+- ``<cases>.idx.log``: a header line, then one JSON line per case ``[offset, length, {token: tf}]``
+  written by ``save_case``
+- ``<cases>.idx.bin``: snapshot of the in-memory postings plus the log position it covers;
+  a JSON header line followed by the raw arrays, so loading it never executes code
+  (unlike a pickle, which anyone able to write ``outputs/`` could use to run code here)
+
+Loading reads the snapshot and replays only the log tail. The index is rebuilt from
+``cases.jsonl`` when the log is missing or was written for a different case file
+(compaction, manual edits). Records are read lazily by byte offset for the top hits only.
+"""
+
+from __future__ import annotations
+import heapq
+import json
+import math
+import os
+import sys
+import threading
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from src.memory.locking import store_lock
+
+INDEX_VERSION = 2
+K1 = 1.5
+B = 0.75
+# Tokens in more than this share of cases ("write", "function", "a") carry almost no
+# BM25 weight but dominate query cost; they are only scored when the rarer query
+# tokens match fewer than top_k cases
+MAX_DF_RATIO = 0.5
+SNAPSHOT_EVERY = 1000
+
+
+def _read(f, typecode: str, count: int) -> array:
+    arr = array(typecode)
+    arr.fromfile(f, count)
+    return arr
+
+
+class CaseIndex:
+    def __init__(self, cases_file: Path):
+        self.cases_file = Path(cases_file)
+        self.log_file = self.cases_file.with_name(self.cases_file.name + ".idx.log")
+        self.snapshot_file = self.cases_file.with_name(self.cases_file.name + ".idx.bin")
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.doc_lens = array("I")
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.total_len = 0
+        self.log_pos = 0
+        self.log_ino = 0
+        self.cases_ino = 0
+        self.unsnapshotted = 0
+        self.loaded = False
+
+    # ------------------------------ writing -------------------------------------
+
+    def append(self, offset: int, length: int, tokens: Iterable[str]) -> None:
+        """Record one case in the log (called by ``save_case`` right after appending the record).
+
+        Without a log there is nothing to append to; the next ``refresh`` builds the
+        index from ``cases.jsonl``, this case included.
+        """
+        if not self.log_file.exists():
+            return
+        entry = json.dumps([offset, length, dict(Counter(tokens))], ensure_ascii=False) + "\n"
+        with self.log_file.open("a", encoding="utf-8") as f:
+            f.write(entry)
+
+    def _add(self, offset: int, length: int, tf: Dict[str, int]) -> None:
+        doc = len(self.offsets)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        dl = sum(tf.values())
+        self.doc_lens.append(dl)
+        self.total_len += dl
+        for tok, n in tf.items():
+            plist = self.postings.get(tok)
+            if plist is None:
+                plist = self.postings[tok] = (array("I"), array("I"))
+            plist[0].append(doc)
+            plist[1].append(n)
+
+    # ------------------------------ loading -------------------------------------
+
+    def refresh(self) -> None:
+        """Bring the in-memory index up to date with the log, rebuilding it if stale."""
+        with self._lock:
+            if self._catch_up():
+                return
+        # lock order is always store lock -> index lock (save_case and compaction take the store lock first)
+        with store_lock(self.cases_file), self._lock:
+            if not self._catch_up():
+                self._rebuild_locked()
+
+    def _catch_up(self) -> bool:
+        """Replay new log lines; False when the index must be rebuilt from ``cases.jsonl``."""
+        try:
+            cases_ino = self.cases_file.stat().st_ino
+        except FileNotFoundError:
+            self._reset()
+            return True
+        try:
+            log_st = self.log_file.stat()
+        except FileNotFoundError:
+            return False
+        if self.loaded and (log_st.st_ino != self.log_ino or log_st.st_size < self.log_pos):
+            self._reset()  # another process rebuilt the index
+        if not self.loaded:
+            self._load(log_st.st_ino)
+        if self.cases_ino != cases_ino:
+            # cases.jsonl was replaced (compaction, manual edit) behind the index's back
+            return False
+        self._replay_log()
+        if self.unsnapshotted >= SNAPSHOT_EVERY:
+            self._write_snapshot()
+        return True
+
+    def _load(self, log_ino: int) -> None:
+        self.loaded, self.log_ino = True, log_ino
+        try:
+            with self.log_file.open("rb") as f:
+                first = f.readline()
+            self.cases_ino = json.loads(first)["cases_ino"]
+            self.log_pos = len(first)
+        except Exception:
+            return
+        if not self.snapshot_file.exists():
+            return
+        try:
+            with self.snapshot_file.open("rb") as f:
+                head = json.loads(f.readline())
+                if (head.get("version") != INDEX_VERSION or head.get("log_ino") != log_ino
+                        or head.get("byteorder") != sys.byteorder):
+                    return
+                n = head["docs"]
+                offsets, lengths, doc_lens = _read(f, "Q", n), _read(f, "I", n), _read(f, "I", n)
+                postings = {tok: (_read(f, "I", df), _read(f, "I", df)) for tok, df in head["vocab"]}
+            self.offsets, self.lengths, self.doc_lens, self.postings = offsets, lengths, doc_lens, postings
+            self.total_len, self.log_pos = head["total_len"], head["log_pos"]
+        except Exception:
+            pass
+
+    def _replay_log(self) -> None:
+        with self.log_file.open("rb") as f:
+            f.seek(self.log_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partial write in progress; pick it up next time
+                self.log_pos += len(line)
+                try:
+                    offset, length, tf = json.loads(line)
+                except Exception:
+                    continue
+                self._add(offset, length, tf)
+                self.unsnapshotted += 1
+
+    def _write_snapshot(self) -> None:
+        head = {
+            "version": INDEX_VERSION, "byteorder": sys.byteorder, "docs": len(self.offsets),
+            "total_len": self.total_len, "log_pos": self.log_pos, "log_ino": self.log_ino,
+            "vocab": [[tok, len(docs)] for tok, (docs, _) in self.postings.items()],
+        }
+        tmp = self.snapshot_file.with_name(self.snapshot_file.name + f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(json.dumps(head, ensure_ascii=False).encode("utf-8") + b"\n")
+            for arr in (self.offsets, self.lengths, self.doc_lens):
+                arr.tofile(f)
+            for docs, tfs in self.postings.values():
+                docs.tofile(f)
+                tfs.tofile(f)
+        os.replace(tmp, self.snapshot_file)
+        self.unsnapshotted = 0
+
+    def rebuild(self) -> None:
+        """Re-index ``cases.jsonl`` from scratch into a fresh log and snapshot."""
+        with store_lock(self.cases_file), self._lock:
+            self._rebuild_locked()
+
+    def _rebuild_locked(self) -> None:
+        from src.memory.store import _normalize
+        self._reset()
+        if not self.cases_file.exists():
+            return
+        tmp = self.log_file.with_name(self.log_file.name + f".{os.getpid()}.tmp")
+        with self.cases_file.open("rb") as src, tmp.open("w", encoding="utf-8") as log:
+            self.cases_ino = os.fstat(src.fileno()).st_ino
+            header = json.dumps({"cases_ino": self.cases_ino})
+            log.write(header + "\n")
+            self.log_pos = len(header) + 1
+            offset = 0
+            for line in src:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    rec = json.loads(line)
+                    toks = rec.get("tokens") or _normalize(rec.get("task", ""))
+                except Exception:
+                    toks = None
+                if toks:
+                    tf = dict(Counter(toks))
+                    self._add(offset, len(line), tf)
+                    entry = json.dumps([offset, len(line), tf], ensure_ascii=False) + "\n"
+                    log.write(entry)
+                    self.log_pos += len(entry.encode("utf-8"))
+                offset += len(line)
+        os.replace(tmp, self.log_file)
+        self.log_ino = self.log_file.stat().st_ino
+        self.loaded = True
+        self._write_snapshot()
+
+    # ------------------------------ querying ------------------------------------
+
+    def search(self, tokens: Iterable[str], top_k: int = 2) -> List[Tuple[float, int, int]]:
+        """Return ``(score, offset, length)`` for the best BM25 matches, best first."""
+        self.refresh()
+        # a refresh or rebuild in another thread mutates the postings: score under the lock
+        with self._lock:
+            return self._search_locked(tokens, top_k)
+
+    def _search_locked(self, tokens: Iterable[str], top_k: int) -> List[Tuple[float, int, int]]:
+        n = len(self.offsets)
+        if not n:
+            return []
+        q = [t for t in set(tokens) if t in self.postings]
+        rare = [t for t in q if len(self.postings[t][0]) <= MAX_DF_RATIO * n]
+        avgdl = self.total_len / n or 1.0
+        base, slope, doc_lens = K1 * (1.0 - B), K1 * B / avgdl, self.doc_lens
+        scores: Dict[int, float] = {}
+        get = scores.get
+
+        def accumulate(terms: List[str]) -> None:
+            for tok in terms:
+                docs, tfs = self.postings[tok]
+                df = len(docs)
+                w = math.log(1.0 + (n - df + 0.5) / (df + 0.5)) * (K1 + 1.0)
+                for doc, tf in zip(docs, tfs):
+                    scores[doc] = get(doc, 0.0) + w * tf / (tf + base + slope * doc_lens[doc])
+
+        accumulate(rare)
+        if len(scores) < top_k:
+            accumulate([t for t in q if t not in rare])
+        best = heapq.nlargest(top_k, scores.items(), key=lambda kv: (kv[1], kv[0]))
+        return [(score, self.offsets[doc], self.lengths[doc]) for doc, score in best]
+
+    def load_record(self, offset: int, length: int) -> Dict[str, Any] | None:
+        with self.cases_file.open("rb") as f:
+            f.seek(offset)
+            raw = f.read(length)
+        try:
+            return json.loads(raw)
+        except Exception:
+            return None
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+_INDEXES: Dict[str, CaseIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def index_for(cases_file: Path) -> CaseIndex:
+    """Per-process index shared by all callers for the same case file."""
+    key = str(Path(cases_file).resolve())
+    with _INDEXES_LOCK:
+        idx = _INDEXES.get(key)
+        if idx is None:
+            idx = _INDEXES[key] = CaseIndex(Path(cases_file))
+        return idx
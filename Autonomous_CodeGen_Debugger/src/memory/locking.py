@@ -0,0 +1,48 @@
+from __future__ import annotations
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None  # type: ignore
+
+_local = threading.local()
+_thread_locks: Dict[str, threading.RLock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def store_lock(cases_file: Path) -> Iterator[None]:
+    """Exclusive lock on ``<cases>.lock`` shared by appends, index rebuilds and compaction.
+
+    Re-entrant within a thread (compaction rebuilds the indexes while holding it).
+    The lock lives in a separate file so it survives ``cases.jsonl`` being replaced.
+    """
+    lock_path = Path(cases_file).with_name(Path(cases_file).name + ".lock")
+    key = str(lock_path.resolve())
+    held: Dict[str, int] = getattr(_local, "held", None) or {}
+    _local.held = held
+    if held.get(key):
+        held[key] += 1
+        try:
+            yield
+        finally:
+            held[key] -= 1
+        return
+    with _thread_locks_guard:
+        tlock = _thread_locks.setdefault(key, threading.RLock())
+    with tlock:
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            held[key] = 1
+            try:
+                yield
+            finally:
+                held[key] = 0
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -1,9 +1,14 @@
 from __future__ import annotations
+import argparse
+import hashlib
 import json
+import os
 import re
 from pathlib import Path
 from typing import List, Dict, Any
 
+from src.memory.index import index_for
+from src.memory.locking import store_lock
 
 MEMORY_DIR = Path("outputs/memory")
 MEMORY_FILE = MEMORY_DIR / "cases.jsonl"
@@ -23,25 +28,124 @@ def save_case(task: str, fn: str, signature: str, code: str, plan: List[Dict[str
         "plan": plan or [],
         "tokens": _normalize(task),
     }
-    with MEMORY_FILE.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+    # no vector encoding here: the semantic store encodes new cases lazily on its next query
+    # one writer at a time: records and index log lines never interleave across processes
+    with store_lock(MEMORY_FILE):
+        with MEMORY_FILE.open("ab") as f:
+            offset = f.seek(0, 2)
+            f.write(line)
+        index_for(MEMORY_FILE).append(offset, len(line), rec["tokens"])
 
 
-def retrieve_hints(task: str, top_k: int = 2) -> List[Dict[str, Any]]:
+def retrieve_hints(task: str, top_k: int = 2, mode: str | None = None) -> List[Dict[str, Any]]:
+    """Return up to ``top_k`` similar past cases, best first.
+
+    ``mode`` (default ``CODEGEN_MEMORY_MODE`` or ``lexical``):
+    - ``lexical``: BM25 over task tokens (``src/memory/index.py``)
+    - ``semantic``: cosine similarity of task vectors (``src/memory/vectors.py``); falls
+      back to lexical when numpy is not installed. Matching paraphrases that share no
+      words needs an HF encoder (``CODEGEN_MEMORY_ENCODER``); the default hash encoder
+      only adds fuzzy matching of word parts
+    """
     if not MEMORY_FILE.exists():
         return []
-    q = set(_normalize(task))
-    hits: List[tuple[int, Dict[str, Any]]] = []
-    with MEMORY_FILE.open("r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                rec = json.loads(line)
-            except Exception:
-                continue
-            toks = set(rec.get("tokens", []))
-            score = len(q & toks)
-            if score:
-                hits.append((score, rec))
-    hits.sort(key=lambda x: x[0], reverse=True)
-    return [rec for _, rec in hits[:top_k]]
+    mode = (mode or os.getenv("CODEGEN_MEMORY_MODE", "lexical")).strip().lower()
+    idx = index_for(MEMORY_FILE)
+    hits = None
+    if mode == "semantic":
+        try:
+            from src.memory.vectors import store_for
+            hits = store_for(MEMORY_FILE).search(task, top_k)
+        except ImportError:
+            hits = None
+    if hits is None:
+        hits = idx.search(_normalize(task), top_k)
+    out: List[Dict[str, Any]] = []
+    for _, offset, length in hits:
+        rec = idx.load_record(offset, length)
+        if rec is not None:
+            out.append(rec)
+    return out
+
+
+def _repairs(rec: Dict[str, Any]) -> int:
+    return sum(1 for e in rec.get("plan") or [] if isinstance(e, dict) and e.get("tag") == "repair:start")
+
+
+def _dedupe_key(rec: Dict[str, Any]) -> tuple[str, str, str]:
+    from src.execution_sandbox.cache import normalize_code
+    code_hash = hashlib.sha256(normalize_code(rec.get("code", "")).encode("utf-8")).hexdigest()
+    return " ".join(_normalize(rec.get("task", ""))), (rec.get("signature") or "").strip(), code_hash
+
+
+def compact_cases(dry_run: bool = False) -> Dict[str, Any]:
+    """Dedupe ``cases.jsonl`` by (normalized task, signature, code AST hash) and rewrite it atomically.
+
+    Of each group the record solved with the fewest repair iterations is kept (the latest
+    one on ties), in the position of the group's latest record. Unparseable lines are
+    dropped. The lexical and (if present) vector indexes are rebuilt afterwards.
+    """
+    stats: Dict[str, Any] = {"before": 0, "after": 0, "duplicates": 0, "malformed": 0,
+                             "bytes_before": 0, "bytes_after": 0}
+    if not MEMORY_FILE.exists():
+        return stats
+    with store_lock(MEMORY_FILE):
+        best: Dict[tuple[str, str, str], tuple[int, int, bytes]] = {}
+        last_seen: Dict[tuple[str, str, str], int] = {}
+        with MEMORY_FILE.open("rb") as f:
+            for pos, line in enumerate(f):
+                stats["bytes_before"] += len(line)
+                try:
+                    rec = json.loads(line)
+                    if not isinstance(rec, dict) or not line.endswith(b"\n"):
+                        raise ValueError("partial record")
+                except Exception:
+                    stats["malformed"] += 1
+                    continue
+                stats["before"] += 1
+                key = _dedupe_key(rec)
+                last_seen[key] = pos
+                kept = best.get(key)
+                if kept is None or _repairs(rec) <= kept[0]:
+                    best[key] = (_repairs(rec), pos, line)
+        stats["after"] = len(best)
+        stats["duplicates"] = stats["before"] - stats["after"]
+        lines = [best[k][2] for k in sorted(best, key=lambda k: last_seen[k])]
+        stats["bytes_after"] = sum(len(ln) for ln in lines)
+        if dry_run or (not stats["duplicates"] and not stats["malformed"]):
+            return stats
+        tmp = MEMORY_FILE.with_name(MEMORY_FILE.name + f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, MEMORY_FILE)
+        index_for(MEMORY_FILE).rebuild()
+        try:
+            from src.memory.vectors import store_for
+            vs = store_for(MEMORY_FILE)
+            if vs.meta_file.exists():
+                vs.rebuild()
+        except ImportError:
+            pass
+    return stats
+
+
+def main() -> int:
+    global MEMORY_DIR, MEMORY_FILE
+    ap = argparse.ArgumentParser(description="Maintain the case memory store")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="Dedupe cases.jsonl and rebuild its indexes")
+    c.add_argument("--file", default=str(MEMORY_FILE), help="Path to cases.jsonl")
+    c.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    args = ap.parse_args()
+    MEMORY_FILE = Path(args.file)
+    MEMORY_DIR = MEMORY_FILE.parent
+    stats = compact_cases(dry_run=args.dry_run)
+    print(json.dumps(stats, indent=2))
+    return 0
+
 
+if __name__ == "__main__":
+    raise SystemExit(main())
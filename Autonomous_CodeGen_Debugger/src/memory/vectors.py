@@ -0,0 +1,361 @@
+"""Vector-similarity retrieval over ``cases.jsonl`` (semantic memory mode).
+
+Files next to the case file:
+- ``<cases>.vec.npy``: float32 ``(n, dim)`` matrix of L2-normalized task vectors, appended
+  in place and memory-mapped for search. The ``.npy`` header is padded to a fixed size
+  so appending only rewrites the row count.
+- ``<cases>.vec.off``: raw uint64 ``(offset, length)`` of each row's record in ``cases.jsonl``
+- ``<cases>.vec.json``: encoder name, dimension and the ``cases.jsonl`` inode the rows belong to
+- ``<cases>.vec.ivf.npz``: optional coarse (IVF) index, built once the store is large
+
+Encoders:
+- ``hash`` (default): signed feature hashing of task words and their character trigrams,
+  so inflections and shared word parts ("palindromic"/"palindrome") still match. It is
+  still lexical: a paraphrase that shares no words ("palindrome" vs. "reads the same
+  backwards") scores near zero
+- any local HF encoder directory via ``CODEGEN_MEMORY_ENCODER`` (mean-pooled last hidden
+  state); paraphrase recall needs one of these
+
+The store is created on the first semantic query. ``save_case`` never encodes: each
+query first encodes, in batches, the cases appended since the store last covered
+``cases.jsonl`` (its ``covered`` byte position), so runs in lexical mode pay nothing.
+numpy is required; without it callers fall back to the lexical index.
+"""
+
+from __future__ import annotations
+import ast
+import json
+import os
+import threading
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from src.memory.locking import store_lock
+
+HASH_DIM = 256
+HEADER_LEN = 128
+IVF_MIN_ROWS = 50_000
+# hashed vectors of unrelated tasks still share a few buckets
+MIN_SIMILARITY = 0.15
+# rebuild the coarse index once this share of rows was appended after it was built
+IVF_STALE_RATIO = 0.2
+# generic task phrasing that would otherwise dominate every hashed vector
+STOP_WORDS = frozenset(
+    "a an and the of to in for on with that which is are be it its as by or from this "
+    "write create implement function returns return given takes input output result python".split()
+)
+
+
+def _words(text: str) -> List[str]:
+    from src.memory.store import _normalize
+    return [w for w in _normalize(text) if w not in STOP_WORDS]
+
+
+def _hash_encode(text: str, dim: int = HASH_DIM) -> np.ndarray:
+    # binary features: a repeated word or trigram does not outweigh the rest of the task
+    feats: Dict[str, float] = {}
+    for w in _words(text):
+        feats[w] = 1.0
+        padded = f"<{w}>"
+        for i in range(len(padded) - 2):
+            feats.setdefault(padded[i:i + 3], 0.5)
+    vec = np.zeros(dim, dtype=np.float32)
+    for f, weight in feats.items():
+        h = zlib.crc32(f.encode("utf-8"))
+        vec[h % dim] += weight if h & 0x80000000 else -weight
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+@lru_cache(maxsize=2)
+def _hf_encoder(path: str):
+    import torch  # type: ignore
+    from transformers import AutoModel, AutoTokenizer  # type: ignore
+
+    tok = AutoTokenizer.from_pretrained(path, local_files_only=True)
+    model = AutoModel.from_pretrained(path, local_files_only=True)
+    model.eval()
+
+    def encode(texts: List[str]) -> np.ndarray:
+        with torch.no_grad():
+            batch = tok(texts, padding=True, truncation=True, max_length=256, return_tensors="pt")
+            hidden = model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1)
+            pooled = torch.nn.functional.normalize(pooled, dim=-1)
+        return pooled.float().cpu().numpy()
+
+    return encode
+
+
+def encoder_name() -> str:
+    path = os.getenv("CODEGEN_MEMORY_ENCODER", "").strip()
+    return f"hf:{path}" if path else f"hash-v2:{HASH_DIM}"
+
+
+def encode(texts: List[str]) -> np.ndarray:
+    """Encode task texts into L2-normalized float32 rows with the configured encoder."""
+    name = encoder_name()
+    if name.startswith("hf:"):
+        return np.ascontiguousarray(_hf_encoder(name[3:])(texts), dtype=np.float32)
+    return np.stack([_hash_encode(t) for t in texts]) if texts else np.zeros((0, HASH_DIM), np.float32)
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    d = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    body = d.ljust(HEADER_LEN - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + len(body).to_bytes(2, "little") + body.encode("latin1")
+
+
+def _read_rows(path: Path) -> Tuple[int, int]:
+    with path.open("rb") as f:
+        head = f.read(HEADER_LEN)
+    shape = ast.literal_eval(head[10:].decode("latin1").strip())["shape"]
+    return int(shape[0]), int(shape[1])
+
+
+class VectorStore:
+    def __init__(self, cases_file: Path):
+        self.cases_file = Path(cases_file)
+        base = self.cases_file.name
+        self.vec_file = self.cases_file.with_name(base + ".vec.npy")
+        self.off_file = self.cases_file.with_name(base + ".vec.off")
+        self.meta_file = self.cases_file.with_name(base + ".vec.json")
+        self.ivf_file = self.cases_file.with_name(base + ".vec.ivf.npz")
+        self._lock = threading.Lock()
+        self._mm: np.ndarray | None = None
+        self._offsets: np.ndarray | None = None
+        self._ivf: Dict[str, Any] | None = None
+        self._vec_ino = 0
+
+    # ------------------------------ writing -------------------------------------
+
+    def _meta(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.meta_file.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def _covered(self) -> int:
+        """Byte position in ``cases.jsonl`` up to which every case has been encoded."""
+        covered = int(self._meta().get("covered", 0))
+        n, _ = _read_rows(self.vec_file)
+        n = min(n, self.off_file.stat().st_size // 16)
+        if n:
+            # rows appended before a crash could update ``covered`` still count
+            last = np.fromfile(self.off_file, dtype=np.uint64, count=2, offset=(n - 1) * 16)
+            covered = max(covered, int(last[0] + last[1]))
+        return covered
+
+    def _behind(self) -> bool:
+        try:
+            return self.cases_file.stat().st_size > self._covered()
+        except (OSError, ValueError, SyntaxError):
+            return False
+
+    def _catch_up_locked(self, batch: int = 256) -> None:
+        """Encode and append the cases written since the store last covered ``cases.jsonl``."""
+        start = self._covered()
+        offset = self._encode_from(start, batch)
+        if offset != start:
+            meta = self._meta()
+            meta["covered"] = offset
+            self.meta_file.write_text(json.dumps(meta), encoding="utf-8")
+
+    def _encode_from(self, start: int, batch: int, vec_file: Path | None = None, off_file: Path | None = None) -> int:
+        """Append rows for the complete records from byte ``start`` on; returns the position reached."""
+        from src.memory.store import _normalize
+        texts: List[str] = []
+        offs: List[Tuple[int, int]] = []
+        offset = start
+        with self.cases_file.open("rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partial write in progress; picked up by a later query
+                try:
+                    rec = json.loads(line)
+                    text = rec.get("task", "") or " ".join(rec.get("tokens", []))
+                except Exception:
+                    text = ""
+                if _normalize(text):
+                    texts.append(text)
+                    offs.append((offset, len(line)))
+                offset += len(line)
+                if len(texts) >= batch:
+                    self._append_rows(encode(texts), offs, vec_file, off_file)
+                    texts, offs = [], []
+        if texts:
+            self._append_rows(encode(texts), offs, vec_file, off_file)
+        return offset
+
+    def _append_rows(self, rows: np.ndarray, offs: List[Tuple[int, int]],
+                     vec_file: Path | None = None, off_file: Path | None = None) -> None:
+        vec_file, off_file = vec_file or self.vec_file, off_file or self.off_file
+        n, dim = _read_rows(vec_file)
+        # offsets first and the row count last, so a reader never sees a row without its
+        # offset; rows of an interrupted append are dropped by the truncates
+        with off_file.open("r+b") as f:
+            f.truncate(n * 16)
+            f.seek(0, 2)
+            f.write(np.asarray(offs, dtype=np.uint64).reshape(-1, 2).tobytes())
+        with vec_file.open("r+b") as f:
+            f.truncate(HEADER_LEN + n * dim * 4)
+            f.seek(0, 2)
+            f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+            f.flush()
+            f.seek(0)
+            f.write(_npy_header(n + len(rows), dim))
+
+    def rebuild(self, batch: int = 256) -> None:
+        """Encode every case in ``cases.jsonl`` into a fresh store."""
+        with store_lock(self.cases_file), self._lock:
+            self._rebuild_locked(batch)
+
+    def _rebuild_locked(self, batch: int = 256) -> None:
+        dim = int(encode(["probe"]).shape[1])
+        tmp_vec = self.vec_file.with_name(self.vec_file.name + f".{os.getpid()}.tmp")
+        tmp_off = self.off_file.with_name(self.off_file.name + f".{os.getpid()}.tmp")
+        tmp_vec.write_bytes(_npy_header(0, dim))
+        tmp_off.write_bytes(b"")
+        cases_ino = self.cases_file.stat().st_ino
+        covered = self._encode_from(0, batch, tmp_vec, tmp_off)
+        os.replace(tmp_vec, self.vec_file)
+        os.replace(tmp_off, self.off_file)
+        try:
+            self.ivf_file.unlink()
+        except FileNotFoundError:
+            pass
+        meta = {"encoder": encoder_name(), "dim": dim, "cases_ino": cases_ino, "covered": covered}
+        self.meta_file.write_text(json.dumps(meta), encoding="utf-8")
+        self._mm = self._offsets = self._ivf = None
+
+    # ------------------------------ querying ------------------------------------
+
+    def _stale(self) -> bool:
+        meta = self._meta()
+        try:
+            cases_ino = self.cases_file.stat().st_ino
+        except FileNotFoundError:
+            return False
+        return (meta.get("encoder") != encoder_name() or meta.get("cases_ino") != cases_ino
+                or not self.vec_file.exists() or not self.off_file.exists())
+
+    def _refresh(self) -> int:
+        """(Re)map the matrix if rows were appended; return the row count."""
+        if not self.cases_file.exists() or self._stale():
+            return 0
+        n, dim = _read_rows(self.vec_file)
+        n = min(n, self.off_file.stat().st_size // 16)
+        vec_ino = self.vec_file.stat().st_ino
+        if vec_ino != self._vec_ino:
+            self._vec_ino, self._mm, self._ivf = vec_ino, None, None  # rebuilt by another process
+        if self._mm is None or len(self._mm) != n:
+            self._mm = np.memmap(self.vec_file, dtype=np.float32, mode="r", offset=HEADER_LEN, shape=(n, dim)) if n else None
+            self._offsets = np.fromfile(self.off_file, dtype=np.uint64, count=n * 2).reshape(-1, 2)
+        return n
+
+    def _coarse_index(self, n: int) -> Dict[str, Any] | None:
+        if n < IVF_MIN_ROWS:
+            return None
+        if self._ivf is None and self.ivf_file.exists():
+            try:
+                with np.load(self.ivf_file) as z:
+                    self._ivf = {k: z[k] for k in z.files}
+                if int(self._ivf.get("vec_ino", -1)) != self._vec_ino:
+                    self._ivf = None
+            except Exception:
+                self._ivf = None
+        if self._ivf is None or int(self._ivf["rows"]) > n or n - int(self._ivf["rows"]) > IVF_STALE_RATIO * n:
+            self._ivf = build_ivf(self._mm)
+            self._ivf["vec_ino"] = np.int64(self._vec_ino)
+            tmp = self.ivf_file.with_name(f"{self.ivf_file.stem}.{os.getpid()}.tmp.npz")
+            np.savez(tmp, **self._ivf)
+            os.replace(tmp, self.ivf_file)
+        return self._ivf
+
+    def search(self, text: str, top_k: int = 2) -> List[Tuple[float, int, int]]:
+        """Return ``(cosine, offset, length)`` of the most similar cases, best first."""
+        q = encode([text])[0]
+        if not np.any(q):
+            return []
+        if self._stale():
+            # lock order is always store lock -> vector lock, as in save_case
+            with store_lock(self.cases_file), self._lock:
+                if self._stale():
+                    self._rebuild_locked()
+        if self._behind():
+            with store_lock(self.cases_file), self._lock:
+                self._catch_up_locked()
+        with self._lock:
+            n = self._refresh()
+            if not n:
+                return []
+            mm, offsets = self._mm, self._offsets
+            ivf = self._coarse_index(n)
+        if ivf is None:
+            scores = mm @ q
+            cand = None
+        else:
+            cand = ivf_candidates(ivf, q, n)
+            scores = mm[cand] @ q
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        out = []
+        for i in top:
+            if scores[i] < MIN_SIMILARITY:
+                break
+            row = int(cand[i]) if cand is not None else int(i)
+            out.append((float(scores[i]), int(offsets[row, 0]), int(offsets[row, 1])))
+        return out
+
+
+def build_ivf(mm: np.ndarray, iters: int = 10, sample_per_list: int = 40, seed: int = 0) -> Dict[str, Any]:
+    """Spherical k-means over a sample; rows are grouped into ``sqrt(n)`` inverted lists."""
+    n = len(mm)
+    nlist = max(1, int(n ** 0.5))
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(mm[np.sort(rng.choice(n, min(n, nlist * sample_per_list), replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty]
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    assign_all = np.concatenate([
+        np.argmax(np.asarray(mm[i:i + 65536]) @ centroids.T, axis=1) for i in range(0, n, 65536)
+    ])
+    order = np.argsort(assign_all, kind="stable")
+    bounds = np.searchsorted(assign_all[order], np.arange(nlist + 1))
+    return {"centroids": centroids, "order": order, "bounds": bounds, "rows": np.int64(n)}
+
+
+def ivf_candidates(ivf: Dict[str, Any], q: np.ndarray, n: int) -> np.ndarray:
+    """Rows in the lists closest to ``q`` plus every row appended after the index was built."""
+    centroids, order, bounds = ivf["centroids"], ivf["order"], ivf["bounds"]
+    nprobe = max(8, len(centroids) // 16)
+    probe = np.argpartition(-(centroids @ q), min(nprobe, len(centroids)) - 1)[:nprobe]
+    parts = [order[bounds[c]:bounds[c + 1]] for c in probe]
+    parts.append(np.arange(int(ivf["rows"]), n))
+    return np.sort(np.concatenate(parts))
+
+
+_STORES: Dict[str, VectorStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def store_for(cases_file: Path) -> VectorStore:
+    key = str(Path(cases_file).resolve())
+    with _STORES_LOCK:
+        vs = _STORES.get(key)
+        if vs is None:
+            vs = _STORES[key] = VectorStore(Path(cases_file))
+        return vs
@@ -0,0 +1,70 @@
+"""Aho-Corasick keyword automaton: which of many keywords occur in a text, in one pass.
+
+Built once from the seed registry's keywords; ``find`` walks the text a character
+at a time, so its cost depends on the text length (plus matches), not on how
+many keywords or seed rules are registered. Matching is plain substring
+matching, the same as ``keyword in text``.
+"""
+
+from __future__ import annotations
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for kw in keywords:
+            self._add(kw)
+        self._build()
+
+    def _add(self, keyword: str) -> int:
+        if keyword in self._ids:
+            return self._ids[keyword]
+        kid = self._ids[keyword] = len(self.keywords)
+        self.keywords.append(keyword)
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(kid)
+        return kid
+
+    def _build(self) -> None:
+        # breadth-first: a state's failure link is the longest proper suffix that is also a trie path
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def id(self, keyword: str) -> int:
+        return self._ids[keyword]
+
+    def find(self, text: str) -> Set[int]:
+        """Ids of all keywords occurring in ``text``."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[int] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
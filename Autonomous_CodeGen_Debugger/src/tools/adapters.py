@@ -1,13 +1,30 @@
 from __future__ import annotations
+import hashlib
+import os
 import subprocess
 import shlex
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any, List
 
+# (tool, mode, tool version, content sha256) -> (file path, result), least recently used first. The mode is
+# "session" (dmypy, ruff via stdin, in-process bandit) or "cli": their outputs differ. pytest depends
+# on a whole tree and is never cached. Bounded: the worker is long-running and every candidate is new content.
+CACHEABLE_TOOLS = ("ruff", "mypy", "bandit", "coverage")
+CACHE_MAX_ENTRIES = int(os.getenv("CODEGEN_TOOL_CACHE_SIZE", "512"))
+_RESULT_CACHE: "OrderedDict[tuple, tuple[str, Dict[str, Any]]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
 
-def _run(cmd: List[str], cwd: Path | None = None, timeout: int = 120) -> Dict[str, Any]:
+
+def _run(cmd: List[str], cwd: Path | None = None, timeout: int = 120, env: Dict[str, str] | None = None,
+         input_text: str | None = None) -> Dict[str, Any]:
     try:
-        proc = subprocess.run(cmd, cwd=str(cwd) if cwd else None, capture_output=True, text=True, timeout=timeout)
+        proc = subprocess.run(cmd, cwd=str(cwd) if cwd else None, capture_output=True, text=True, timeout=timeout,
+                              env={**os.environ, **env} if env else None, input=input_text)
         return {
             "ok": proc.returncode == 0,
             "returncode": proc.returncode,
@@ -38,11 +55,12 @@ def run_pytest(cwd: Path, timeout: int = 180) -> Dict[str, Any]:
 
 
 def run_coverage_doctest(path: Path, timeout: int = 180) -> Dict[str, Any]:
-    # Run doctest under coverage, then show report
-    first = _run(["coverage", "run", "-m", "doctest", "-v", str(path)], timeout=timeout)
+    # Run doctest under coverage, then show report; a per-file data file keeps concurrent runs apart
+    env = {"COVERAGE_FILE": str(Path(path).with_suffix(".coverage"))}
+    first = _run(["coverage", "run", "-m", "doctest", "-v", str(path)], timeout=timeout, env=env)
     if not first.get("ok"):
         return first | {"phase": "coverage-run"}
-    report = _run(["coverage", "report", "-m"], timeout=timeout)
+    report = _run(["coverage", "report", "-m"], timeout=timeout, env=env)
     return {
         "ok": first.get("ok", False) and report.get("ok", False),
         "returncode": report.get("returncode", 1),
@@ -53,25 +71,82 @@ def run_coverage_doctest(path: Path, timeout: int = 180) -> Dict[str, Any]:
     }
 
 
-def run_selected_tools(code_path: Path, tools: List[str], cwd: Path | None = None, timeout: int = 180) -> Dict[str, Any]:
+@lru_cache(maxsize=None)
+def tool_version(tool: str) -> str:
+    res = _run([tool, "--version"], timeout=30)
+    if not res["ok"]:
+        return "unavailable"
+    return (res["stdout"] or res["stderr"]).strip().splitlines()[0] if (res["stdout"] or res["stderr"]).strip() else "unknown"
+
+
+def _cache_key(tool: str, code_path: Path, mode: str = "cli") -> tuple | None:
+    try:
+        digest = hashlib.sha256(Path(code_path).read_bytes()).hexdigest()
+    except OSError:
+        return None
+    return (tool, mode, tool_version(tool), digest)
+
+
+def _rebase(res: Dict[str, Any], old: str, new: str) -> Dict[str, Any]:
+    """A cached result for the same content under another file name, with the paths in its output updated."""
+    if old == new:
+        return res
+    return res | {k: res[k].replace(old, new) for k in ("stdout", "stderr", "cmd") if isinstance(res.get(k), str)}
+
+
+def _run_tool(tool: str, code_path: Path, cwd: Path | None, timeout: int, session: Any = None) -> Dict[str, Any]:
+    start = time.perf_counter()
+    mode = "session" if session and tool in ("ruff", "mypy", "bandit") else "cli"
+    key = _cache_key(tool, code_path, mode) if tool in CACHEABLE_TOOLS else None
+    if key is not None:
+        with _CACHE_LOCK:
+            hit = _RESULT_CACHE.get(key)
+            if hit is not None:
+                _RESULT_CACHE.move_to_end(key)
+        if hit is not None:
+            return _rebase(hit[1], hit[0], str(code_path)) | {"cached": True, "wall_s": round(time.perf_counter() - start, 4)}
+    if tool == "ruff":
+        res = session.ruff(code_path, timeout) if session else run_ruff(code_path, timeout)
+    elif tool == "mypy":
+        res = session.mypy(code_path, timeout) if session else run_mypy(code_path, timeout)
+    elif tool == "bandit":
+        res = session.bandit(code_path, timeout) if session else run_bandit(code_path, timeout)
+    elif tool == "coverage":
+        res = run_coverage_doctest(code_path, timeout)
+    else:
+        res = run_pytest(cwd, timeout)
+    # Missing tools and timeouts say nothing about the code; do not remember them
+    if key is not None and res.get("returncode") not in (124, 127):
+        with _CACHE_LOCK:
+            _RESULT_CACHE[key] = (str(code_path), res)
+            _RESULT_CACHE.move_to_end(key)
+            while len(_RESULT_CACHE) > CACHE_MAX_ENTRIES:
+                _RESULT_CACHE.popitem(last=False)
+    return res | {"cached": False, "wall_s": round(time.perf_counter() - start, 4)}
+
+
+def run_selected_tools(code_path: Path, tools: List[str], cwd: Path | None = None, timeout: int = 180,
+                       max_workers: int = 4, session: Any = None) -> Dict[str, Any]:
+    """Run the selected tools concurrently (bounded pool); results for unchanged file content are reused.
+
+    Pass a ``src.tools.session.ToolSession`` to use warm tools (dmypy, ruff via stdin, in-process bandit).
+    Each tool result carries ``wall_s`` and ``cached``; ``timing`` holds the overall wall time.
+    """
     results: Dict[str, Any] = {"tools": {}, "ok": True}
+    order = ("ruff", "mypy", "bandit", "coverage", "pytest")
     tset = {t.strip().lower() for t in tools if t}
-    if not tset:
+    selected = [t for t in order if t in tset and (t != "pytest" or cwd)]
+    if not selected:
         return results
-    if "ruff" in tset:
-        results["tools"]["ruff"] = run_ruff(code_path, timeout)
-        results["ok"] = results["ok"] and results["tools"]["ruff"]["ok"]
-    if "mypy" in tset:
-        results["tools"]["mypy"] = run_mypy(code_path, timeout)
-        results["ok"] = results["ok"] and results["tools"]["mypy"]["ok"]
-    if "bandit" in tset:
-        results["tools"]["bandit"] = run_bandit(code_path, timeout)
-        results["ok"] = results["ok"] and results["tools"]["bandit"]["ok"]
-    if "coverage" in tset:
-        results["tools"]["coverage"] = run_coverage_doctest(code_path, timeout)
-        results["ok"] = results["ok"] and results["tools"]["coverage"]["ok"]
-    if "pytest" in tset and cwd:
-        results["tools"]["pytest"] = run_pytest(cwd, timeout)
-        results["ok"] = results["ok"] and results["tools"]["pytest"]["ok"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(selected)))) as pool:
+        futures = {t: pool.submit(_run_tool, t, code_path, cwd, timeout, session) for t in selected}
+        for t in selected:
+            results["tools"][t] = futures[t].result()
+            results["ok"] = results["ok"] and results["tools"][t]["ok"]
+    results["timing"] = {
+        "wall_s": round(time.perf_counter() - start, 4),
+        "per_tool": {t: results["tools"][t]["wall_s"] for t in selected},
+    }
     return results
 
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from src.tools.adapters import _run, run_bandit, run_mypy
+
+
+class ToolSession:
+    """Warm tool processes shared by all iterations of one debug session.
+
+    - mypy runs through a ``dmypy`` daemon started on first use (it exits by itself
+      after ``idle_timeout`` seconds if the session dies without ``close()``)
+    - ruff reads the code from stdin instead of discovering files on disk
+    - bandit runs in-process through its manager API when importable
+
+    Each tool falls back to the one-shot adapter when its fast path is unavailable.
+    """
+
+    def __init__(self, workdir: Path = Path("outputs/.tools"), idle_timeout: int = 600):
+        self.workdir = Path(workdir)
+        self.idle_timeout = idle_timeout
+        self.status_file = self.workdir / f".dmypy-{os.getpid()}.json"
+        self._dmypy_state: str | None = None  # None (not started), "up" or "failed"
+        self._lock = threading.Lock()
+        self._bandit_conf: Any = None
+
+    def __enter__(self) -> "ToolSession":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.close()
+        return False
+
+    # ------------------------------- ruff ---------------------------------------
+
+    def ruff(self, path: Path, timeout: int = 120) -> Dict[str, Any]:
+        code = Path(path).read_text(encoding="utf-8")
+        return _run(["ruff", "check", "--stdin-filename", str(path), "-"], timeout=timeout, input_text=code)
+
+    # ------------------------------- mypy ---------------------------------------
+
+    def _dmypy(self, *args: str, timeout: int = 120) -> Dict[str, Any]:
+        return _run(["dmypy", "--status-file", str(self.status_file), *args], timeout=timeout)
+
+    def _ensure_dmypy(self, timeout: int) -> bool:
+        with self._lock:
+            if self._dmypy_state is None:
+                self.workdir.mkdir(parents=True, exist_ok=True)
+                res = self._dmypy("start", "--timeout", str(self.idle_timeout), "--", "--hide-error-codes", timeout=timeout)
+                self._dmypy_state = "up" if res["ok"] else "failed"
+            return self._dmypy_state == "up"
+
+    def mypy(self, path: Path, timeout: int = 120) -> Dict[str, Any]:
+        if not self._ensure_dmypy(timeout):
+            return run_mypy(path, timeout)
+        res = self._dmypy("check", str(path), timeout=timeout)
+        # rc 1 = type errors found; anything else non-zero means the daemon itself failed
+        if res["returncode"] not in (0, 1):
+            return run_mypy(path, timeout)
+        return res
+
+    # ------------------------------ bandit --------------------------------------
+
+    def bandit(self, path: Path, timeout: int = 120) -> Dict[str, Any]:
+        try:
+            from bandit.core import config as b_config, manager as b_manager  # type: ignore
+        except ImportError:
+            return run_bandit(path, timeout)
+        try:
+            with self._lock:
+                if self._bandit_conf is None:
+                    self._bandit_conf = b_config.BanditConfig()
+            mgr = b_manager.BanditManager(self._bandit_conf, "file", quiet=True)
+            mgr.discover_files([str(path)], False)
+            mgr.run_tests()
+            issues = mgr.get_issue_list()
+        except Exception:
+            return run_bandit(path, timeout)
+        lines = [
+            f"{i.fname}:{i.lineno}: {i.test_id} [{i.severity}/{i.confidence}] {i.text}" for i in issues
+        ]
+        return {
+            "ok": not issues,
+            "returncode": 1 if issues else 0,
+            "stdout": "\n".join(lines),
+            "stderr": "",
+            "cmd": f"bandit (in-process) {path}",
+        }
+
+    # ----------------------------- lifecycle ------------------------------------
+
+    def close(self) -> None:
+        with self._lock:
+            if self._dmypy_state == "up":
+                self._dmypy("stop", timeout=30)
+                for _ in range(20):
+                    if not self.status_file.exists():
+                        break
+                    time.sleep(0.05)
+                try:
+                    self.status_file.unlink()
+                except OSError:
+                    pass
+            self._dmypy_state = None
@@ -3,25 +3,32 @@ from __future__ import annotations
 
 import json
 import os
-import re
 import sys
 import threading
 from pathlib import Path
-from typing import List
+from typing import Iterator, List
 
 import shlex
+import requests
 import streamlit as st
 
 
 BASE = Path(__file__).resolve().parents[1]  # Autonomous_CodeGen_Debugger/
+sys.path.insert(0, str(BASE))
+
+from server.pool import NoWorkerAvailable, PoolJob, WorkerPool  # noqa: E402
+
 DEFAULT_MODEL_ROOT = Path(os.getenv("CODEGEN_MODELS_ROOT", "/Volumes/MyProjects/GitHub/AI/Autonomous_CodeGen_Debugger/models"))
 
 
-def discover_models(root: Path) -> List[Path]:
-    if not root.exists():
+@st.cache_data(ttl=60, show_spinner=False)
+def discover_models(root: str) -> List[Path]:
+    """Immediate subdirectories of the models root; cached so reruns do not rescan the disk."""
+    path = Path(root)
+    if not path.exists():
         return []
     # List immediate subdirectories; users will pick the top folder and our code resolves internally
-    return [p for p in root.iterdir() if p.is_dir()]
+    return sorted(p for p in path.iterdir() if p.is_dir())
 
 
 def build_command(
@@ -77,64 +84,62 @@ def build_command(
     return cmd
 
 
-def call_worker_api(url: str, payload: dict, timeout: int) -> dict:
-    endpoint = url.rstrip("/") + "/run"
-    try:
-        import requests  # type: ignore
-    except ImportError:
-        requests = None
+@st.cache_resource
+def http_session() -> requests.Session:
+    """One keep-alive connection pool to the worker, shared by all reruns and browser sessions."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    if requests is not None:
-        try:
-            resp = requests.post(endpoint, json=payload, timeout=timeout)
-            resp.raise_for_status()
-        except Exception as exc:  # pragma: no cover - streamlit UI path
-            raise RuntimeError(f"{exc}") from exc
-        return resp.json()
 
-    import urllib.error
-    import urllib.request
+# The UI is an interactive client: its jobs are scheduled ahead of batch submissions
+UI_HEADERS = {"X-Client-Id": os.getenv("CODEGEN_UI_CLIENT_ID", "ui"), "X-Priority": "interactive"}
 
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(endpoint, data=data, headers={"Content-Type": "application/json"})
-    try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:  # nosec B310 - user-provided host
-            body = resp.read()
-    except urllib.error.HTTPError as exc:  # pragma: no cover - streamlit UI path
-        detail = exc.read().decode("utf-8", errors="ignore") if hasattr(exc, "read") else ""
-        raise RuntimeError(f"HTTP {exc.code}: {detail[:2000]}") from exc
-    except urllib.error.URLError as exc:  # pragma: no cover - streamlit UI path
-        raise RuntimeError(f"Connection error: {exc.reason}") from exc
 
-    return json.loads(body.decode("utf-8"))
+@st.cache_resource
+def worker_pool() -> WorkerPool:
+    """Workers from ``CODEGEN_WORKER_URLS`` (or ``CODEGEN_WORKER_URL``), health-checked in the background."""
+    return WorkerPool.from_env(session=http_session(),
+                               health_timeout=float(os.getenv("CODEGEN_WORKER_HEALTH_TIMEOUT", "5"))).start()
 
 
-def call_worker_health(url: str, timeout: int) -> dict:
-    endpoint = url.rstrip("/") + "/health"
-    try:
-        import requests  # type: ignore
-    except ImportError:
-        requests = None
+@st.cache_data(ttl=10, show_spinner=False)
+def healthy_workers() -> List[str]:
+    return worker_pool().healthy()
 
-    if requests is not None:
-        resp = requests.get(endpoint, timeout=timeout)
-        resp.raise_for_status()
-        return resp.json()
 
-    import urllib.error
-    import urllib.request
-
-    req = urllib.request.Request(endpoint, headers={"Accept": "application/json"})
+def submit_job(payload: dict, model: str | None, timeout: int) -> PoolJob:
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            body = resp.read()
-    except urllib.error.HTTPError as exc:  # pragma: no cover - streamlit UI path
-        detail = exc.read().decode("utf-8", errors="ignore") if hasattr(exc, "read") else ""
-        raise RuntimeError(f"HTTP {exc.code}: {detail[:2000]}") from exc
-    except urllib.error.URLError as exc:  # pragma: no cover - streamlit UI path
-        raise RuntimeError(f"Connection error: {exc.reason}") from exc
-
-    return json.loads(body.decode("utf-8"))
+        # prefer a worker that already serves the picked model; any worker otherwise
+        return worker_pool().submit(payload, model=model, headers=UI_HEADERS, timeout=timeout, strict_model=False)
+    except requests.HTTPError as exc:
+        resp = exc.response
+        if resp is not None and resp.status_code == 429:
+            raise RuntimeError(f"Workers are busy; retry in {resp.headers.get('Retry-After', 'a few')} seconds.") from exc
+        raise
+
+
+def stream_job_events(job: PoolJob, timeout: int) -> Iterator[tuple[str, dict]]:
+    """(event, data) pairs from the job's server-sent event stream, ending with ``result``."""
+    with worker_pool().events(job, timeout=timeout) as resp:
+        event, data = "message", []
+        for line in resp.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if not line:
+                if data:
+                    yield event, json.loads("\n".join(data))
+                event, data = "message", []
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].strip())
+
+
+def cancel_job(job: PoolJob) -> None:
+    worker_pool().cancel(job, headers=UI_HEADERS)
 
 
 def inject_quit_menu() -> None:
@@ -219,22 +224,6 @@ def clear_inputs() -> None:
 
 
 
-def extract_final_code(all_output: str) -> str | None:
-    # Prefer explicit markers if present
-    m = re.search(r"^===CODE BEGIN===\n(?P<code>.*?)(?:\n)?^===CODE END===\s*$", all_output, re.S | re.M)
-    if m:
-        return m.group("code").strip() + "\n"
-    # Fallback: find the last occurrence of a def at column 0
-    lines = all_output.splitlines()
-    for i in range(len(lines) - 1, -1, -1):
-        if lines[i].lstrip().startswith("def "):
-            code = "\n".join(lines[i:])
-            if code.count('"""') % 2 == 1:
-                code += '\n"""'
-            return code.strip() + "\n"
-    return None
-
-
 def main() -> None:
     st.set_page_config(page_title="Autonomous CodeGen & Debugger", layout="wide")
     st.title("Autonomous Code Generation + Self-Debugger (Local LLM)")
@@ -253,7 +242,7 @@ def main() -> None:
         st.header("Model")
         model_root = st.text_input("Models root", value=str(DEFAULT_MODEL_ROOT))
         root_path = Path(model_root)
-        models = discover_models(root_path)
+        models = discover_models(str(root_path))
         model_labels = [p.name for p in models] or ["<no models found>"]
         idx = st.selectbox("Choose model directory", options=range(len(model_labels)), format_func=lambda i: model_labels[i]) if models else 0
         selected_model = models[idx] if models else None
@@ -271,18 +260,14 @@ def main() -> None:
             candidates = st.number_input("Initial candidates", value=1, min_value=1, max_value=10, step=1)
             run_timeout = st.number_input("Run timeout (s)", value=300, min_value=30, max_value=3600, step=30, help="Maximum wait before labeling the run as long-running")
 
-    worker_url = os.getenv("CODEGEN_WORKER_URL", "").strip()
     worker_ready = False
     worker_error: str | None = None
-    if worker_url:
-        try:
-            health = call_worker_health(worker_url, timeout=int(os.getenv("CODEGEN_WORKER_HEALTH_TIMEOUT", "5")))
-            if health.get("status") == "ok":
-                worker_ready = True
-        except Exception as exc:
-            worker_error = str(exc)
-    else:
-        worker_error = "Set CODEGEN_WORKER_URL to a running FastAPI worker."
+    try:
+        worker_ready = bool(healthy_workers())
+        if not worker_ready:
+            worker_error = "No healthy worker."
+    except NoWorkerAvailable as exc:
+        worker_error = str(exc)
 
     if worker_error:
         st.error("Service temporarily unavailable. Please try again later.")
@@ -341,45 +326,74 @@ def main() -> None:
     run_custom = st.button("Run Custom", use_container_width=False)
 
     def run_and_stream(cmd_list: List[str]):
-        log_box = st.empty()
-        code_box = st.empty()
+        status_box = st.empty()
+        live_box = st.empty()
         plan_box = st.empty()
+        code_box = st.empty()
         if not worker_ready:
             st.error("Service temporarily unavailable. Please try again later.")
             return
+        payload = {
+            "task": task.strip(),
+            "fn": fn_name.strip() or None,
+            "signature": signature.strip() or None,
+            "doctests": doctests.strip() or None,
+            "iters": int(iters),
+            "timeout": int(timeout),
+            "max_new_tokens": int(tokens),
+            "decode": decode,
+            "candidates": int(candidates),
+            "add_imports": (st.session_state.get("output_mode") == "Function"),
+            "standalone": (st.session_state.get("output_mode") == "Full code"),
+            "clean_doc": False,
+        }
+        job = None
+        final = None
         try:
-            payload = {
-                "task": task.strip(),
-                "fn": fn_name.strip() or None,
-                "signature": signature.strip() or None,
-                "doctests": doctests.strip() or None,
-                "iters": int(iters),
-                "timeout": int(timeout),
-                "max_new_tokens": int(tokens),
-                "decode": decode,
-                "candidates": int(candidates),
-                "add_imports": (st.session_state.get("output_mode") == "Function"),
-                "standalone": (st.session_state.get("output_mode") == "Full code"),
-                "clean_doc": False,
-            }
-            with st.spinner("Calling worker..."):
-                data = call_worker_api(worker_url, payload, int(run_timeout))
-            plan_events = data.get("plan", [])
-            if plan_events:
-                lines = [f"PLAN: {e.get('tag')} { {k:v for k,v in e.items() if k!='tag'} }" for e in plan_events]
-                plan_box.code("\n".join(lines))
-            code = data.get("code", "")
-            logs = data.get("logs", [])
-            if logs:
-                log_box.code("\n".join(logs[-200:]))
-            if code:
-                st.success("Final code")
-                code_box.code(code, language="python")
-                st.download_button("Download .py", data=code, file_name=(fn_name.strip() or "solution") + ".py")
-            else:
-                st.warning("Worker returned no code.")
+            job = submit_job(payload, selected_model.name if selected_model else None, timeout=30)
+            plan_lines: List[str] = []
+            live = ""
+            for event, data in stream_job_events(job, int(run_timeout)):
+                if event == "status":
+                    pos = data.get("queue_position")
+                    status_box.info(f"Job {job.id[:8]} on {job.url}: {data['status']}" + (f" (position {pos} in queue)" if pos else ""))
+                elif event == "completion" and data.get("state") == "start":
+                    live = ""
+                elif event == "token":
+                    live += data.get("text", "")
+                    live_box.code(live, language="python")
+                elif event == "plan":
+                    plan_lines.append(f"PLAN: {data.get('tag')} { {k: v for k, v in data.items() if k not in ('tag', 'seq', 'type')} }")
+                    plan_box.code("\n".join(plan_lines[-200:]))
+                elif event == "result":
+                    final = data
+        except RuntimeError as exc:
+            st.error(str(exc))
+            return
         except Exception:
             st.error("Service temporarily unavailable. Please try again later.")
+            return
+        finally:
+            if job is not None and final is None:
+                # stopped or rerun before the job finished: do not leave it running on the worker
+                cancel_job(job)
+        live_box.empty()
+        status_box.empty()
+        if final is None:
+            # the stream ended (timeout or dropped connection) before the job's result arrived
+            st.error(f"Lost the event stream for job {job.id[:8]} on {job.url} before it finished; the job was cancelled.")
+            return
+        if final.get("status") != "done":
+            st.error(f"Run {final.get('status')}: {final.get('error') or ''}".strip())
+            return
+        data = final.get("result") or {}
+        code = data.get("code", "")
+        if code:
+            st.success("Final code" + ("" if data.get("ok") else " (doctests did not pass)"))
+            code_box.code(code, language="python")
+            st.download_button("Download .py", data=code, file_name=(fn_name.strip() or "solution") + ".py")
+        else:
+            st.warning("Worker returned no code.")
 
     # Execute generated or custom command based on which button is pressed
     if run_clicked: